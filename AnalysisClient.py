@@ -0,0 +1,105 @@
+import getopt
+import json
+import os
+import socket
+import sys
+
+# Commands understood by AnalysisServer
+COMMANDS = ['categorize', 'check', 'paths', 'reload', 'status', 'shutdown']
+
+
+# Sends one request to an AnalysisServer and returns its response
+# Only the standard library is imported, so a request costs little more than starting the interpreter.
+# @param command: The command of the request (see COMMANDS)
+# @param socket_path: The path of the Unix socket of the server, ignored if a port is given
+# @param port: The localhost TCP port of the server
+# @param parameters: Additional fields of the request, e.g. the path of a categorization file
+# @return: The response, a failed one if the server closed the connection without answering
+def send_request(command: str, socket_path: str = None, port: int = None, **parameters) -> dict:
+    if port is None:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection(('127.0.0.1', port))
+    with connection, connection.makefile('rb') as stream:
+        connection.sendall(json.dumps(dict(parameters, command=command)).encode() + b'\n')
+        line = stream.readline()
+    if not line:
+        return {'ok': False, 'error': 'The server closed the connection without a response'}
+    return json.loads(line)
+
+
+# Sends a request from the command line and prints the response
+def main(argv) -> None:
+    socket_path = os.path.join(os.getcwd(), "analysis.sock")
+    port = None
+    categorization_path = None
+    json_output = False
+
+    # Handles command line arguments, followed by the command (see COMMANDS), which defaults to check
+    # '-h' or '--help' prints the proper format
+    # '-c' or '--categorization_path' specifies the categorization file of a categorize command
+    # '--socket' specifies the path of the Unix socket of the server
+    # '--port' connects to a localhost TCP port instead of a Unix socket
+    # '--json' prints the whole response as JSON
+    proper_format = "AnalysisClient.py -h -c [command]\nalternative long options:\n--help\n--categorization_path\n" \
+                    "--socket\n--port\n--json\ncommands:\n" + '\n'.join(COMMANDS) + '\n'
+    try:
+        opts, args = getopt.getopt(argv, "hc:", ["help", "categorization_path=", "socket=", "port=", "json"])
+    except getopt.GetoptError:
+        print('Error')
+        print(proper_format)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(proper_format)
+            sys.exit()
+        elif opt in ("-c", "--categorization_path"):
+            categorization_path = arg
+        elif opt == "--socket":
+            socket_path = arg
+        elif opt == "--port":
+            if not arg.isdecimal() or not 1 <= int(arg) <= 65535:
+                print(f'Port {arg} is not an integer between 1 and 65535')
+                print(proper_format)
+                sys.exit(2)
+            port = int(arg)
+        elif opt == "--json":
+            json_output = True
+    command = args[0] if args else 'check'
+    if command not in COMMANDS:
+        print(f'Command {command} not recognised, choose from {COMMANDS}')
+        sys.exit(2)
+    parameters = {}
+    if command == 'categorize':
+        if categorization_path is None:
+            print('The categorize command needs a categorization file (-c)')
+            sys.exit(2)
+        # The server resolves relative paths against its own working directory
+        parameters['path'] = os.path.abspath(categorization_path)
+
+    response = send_request(command, socket_path, port, **parameters)
+    if json_output:
+        print(json.dumps(response, indent=4))
+    elif not response['ok']:
+        print(f"Error: {response['error']}")
+    else:
+        for record in response.get('diagnostics', []):
+            print(f">>>>>>>>>>{record['message']}<<<<<<<<<<")
+        result = response['result']
+        if command == 'check':
+            print(f"{'Privacy Vulnerable' if result['vulnerable'] else 'Privacy Safe'}: {result['summary']}")
+        elif command == 'categorize':
+            for warning in result['warnings']:
+                print(f'>>>>>>>>>>{warning}<<<<<<<<<<')
+            print(f"Changed the privacy type of {result['changed']} graph node(s)")
+        elif command == 'reload':
+            print(f"Updated {len(result['updated'])} policy file(s)")
+        elif command != 'shutdown':
+            print(json.dumps(result, indent=4))
+    if not response['ok']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
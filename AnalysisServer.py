@@ -0,0 +1,237 @@
+import asyncio
+import getopt
+import json
+import os
+import sys
+import Categorization
+import Diagnostics
+import ROSGraph
+import Watch
+
+
+# A long-running analysis service that keeps a ROSGraph and its privacy graph in memory between requests
+# Clients connect to a Unix socket or a localhost TCP port and send one JSON request per line, each answered by one
+# JSON response line (see AnalysisClient). Requests are handled one at a time under a lock in a worker thread, so
+# connections are accepted and read while an analysis runs, and no request sees a half-updated graph. A categorization
+# is applied as a delta of privacy types (see ROSGraph.apply_categorization_delta), a reload only reads the policy
+# files that changed since the last one (see Watch.KeystoreWatcher) and the privacy report is kept until the graph or
+# the categorization changes.
+# Requests: {"command": "categorize", "categorization": {...}} or {"command": "categorize", "path": "..."} replaces
+# the categorization, "check" returns the verdict, "paths" the privacy report, "reload" reads changed policy files,
+# "status" the sizes of the graphs and "shutdown" stops the server. An optional "id" is returned with the response.
+class AnalysisServer:
+    # @param policy_path: The directory of the keystore
+    # @param standard_elements: The standard elements of the graph, see ROSGraph.ROSGraph
+    # @param exhaustive: Whether to report all edge-disjoint paths per source and leak
+    # @param paths_per_pair: The number of shortest witness paths reported per source and leak, ignored if exhaustive
+    def __init__(self, policy_path: str, include_standard_elements=False, standard_elements=None, exhaustive=False,
+                 paths_per_pair=1):
+        self.graph = ROSGraph.ROSGraph(include_standard_elements=include_standard_elements,
+                                       standard_elements=standard_elements)
+        self.watcher = Watch.KeystoreWatcher(self.graph, policy_path)
+        self.exhaustive = exhaustive
+        self.paths_per_pair = paths_per_pair
+        self.report = None  # PrivacyReport of the current graph and categorization, None if it is outdated
+        self.handlers = {'categorize': self.categorize, 'check': self.check, 'paths': self.paths,
+                         'reload': self.reload, 'status': self.status}
+        self.lock = None  # Created in the event loop of serve
+        self.server = None
+        self.connections = {}  # Task answering a connection -> its StreamWriter, closed when the server stops
+
+    # Reads the policy files that changed since the last reload, the first reload reads all of them
+    # @return: The policy files whose contributions were updated
+    def reload(self, request=None) -> dict:
+        updated = self.watcher.update()
+        if updated:
+            self.report = None
+        return {'updated': updated}
+
+    # Replaces the categorization, only graph nodes whose privacy type changes are updated
+    # @param request: The request with the categorization, either as dictionary in 'categorization' or as file in
+    #                 'path'
+    # @return: The number of changed graph nodes and the entries of the categorization that could not be applied
+    def categorize(self, request: dict) -> dict:
+        if 'path' in request:
+            categorization = Categorization.read_categorization(request['path'])
+        else:
+            categorization = Categorization.validate_categorization(request['categorization'])
+        matcher = Categorization.CategorizationMatcher(categorization)
+        overlay, warnings = matcher.resolve(self.graph.get_ros_graph())
+        delta = {name: overlay.get(name, 'default') for name, attributes in self.graph.get_ros_graph().nodes(data=True)
+                 if overlay.get(name, 'default') != attributes['privacy_type']}
+        if delta:
+            self.graph.apply_categorization_delta(delta)
+            self.report = None
+        self.watcher.set_categorization(categorization)
+        return {'changed': len(delta), 'warnings': warnings}
+
+    # Determines whether the graph is privacy vulnerable, reusing the privacy report if nothing changed since the last
+    # check
+    def check(self, request=None) -> dict:
+        if self.report is None:
+            self.graph.is_privacy_vulnerable(exhaustive=self.exhaustive, paths_per_pair=self.paths_per_pair)
+            self.report = self.graph.get_privacy_report()
+        return {'vulnerable': self.report.is_vulnerable(), 'summary': self.report.summary()}
+
+    # Returns the privacy report of the graph with the vulnerable paths
+    def paths(self, request=None) -> dict:
+        self.check()
+        return self.report.to_dict()
+
+    # Returns the sizes of the graphs and the number of policy files
+    def status(self, request=None) -> dict:
+        privacy_graph = self.graph.get_privacy_graph()
+        return {'policy_files': len(self.watcher.contributions),
+                'ros_nodes': self.graph.get_ros_graph().number_of_nodes(),
+                'ros_edges': self.graph.get_ros_graph().number_of_edges(),
+                'privacy_nodes': privacy_graph.number_of_nodes(),
+                'privacy_edges': privacy_graph.number_of_edges(), 'checked': self.report is not None}
+
+    # Serves requests until a shutdown request
+    # @param socket_path: The path of the Unix socket to listen on, ignored if a port is given
+    # @param port: The localhost TCP port to listen on
+    async def serve(self, socket_path: str = None, port: int = None) -> None:
+        self.lock = asyncio.Lock()
+        if port is None:
+            self.server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            Diagnostics.info(f'Listening on {socket_path}')
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, '127.0.0.1', port)
+            Diagnostics.info(f'Listening on 127.0.0.1:{port}')
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            # Open connections end at their next read instead of being cancelled by asyncio.run
+            for writer in self.connections.values():
+                writer.close()
+            await asyncio.gather(*self.connections, return_exceptions=True)
+            if port is None and os.path.exists(socket_path):
+                os.remove(socket_path)
+        Diagnostics.info('Stopped serving')
+
+    # Answers the requests of a connection, one response line per request line
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle_request(line)
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[task]
+            writer.close()
+
+    # Runs a request and returns its response
+    # @param line: The request as JSON document
+    # @return: The response with 'ok', the 'result' or 'error' and the warnings of the request in 'diagnostics'
+    async def handle_request(self, line: bytes) -> dict:
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            return {'ok': False, 'error': f'Request is not valid JSON: {error}'}
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'Request is not a JSON object'}
+        response = {'id': request.get('id')}
+        command = request.get('command')
+        if command == 'shutdown':
+            self.server.close()
+            return dict(response, ok=True, result={})
+        if command not in self.handlers:
+            return dict(response, ok=False, error=f'Command {command} not recognised, choose from '
+                                                  f'{list(self.handlers) + ["shutdown"]}')
+        async with self.lock:
+            return dict(response, **await asyncio.to_thread(self._run_handler, command, request))
+
+    # Runs the handler of a command in a worker thread and collects its diagnostics
+    # Any error of the handler is answered as a failed request, so one bad request does not cost the client its response
+    def _run_handler(self, command: str, request: dict) -> dict:
+        with Diagnostics.diagnostics.capture() as records:
+            try:
+                response = {'ok': True, 'result': self.handlers[command](request)}
+            except Exception as error:
+                response = {'ok': False, 'error': f'{command} failed: {error!r}'}
+        response['diagnostics'] = [{'level': Diagnostics.LEVEL_NAMES.get(record['level'], record['level']),
+                                    'message': record['message'], 'context': record['context']}
+                                   for record in records if record['level'] >= Diagnostics.WARNING]
+        return response
+
+
+# Starts the server from the command line
+def main(argv) -> None:
+    policy_path = os.path.join(os.getcwd(), "policies")
+    categorization_path = None
+    socket_path = os.path.join(os.getcwd(), "analysis.sock")
+    port = None
+    include_standard_elements = False
+    standard_elements = ROSGraph.STANDARD_ELEMENTS
+    exhaustive_paths = False
+    paths_per_pair = 1
+
+    # Handles command line arguments
+    # '-h' or '--help' prints the proper format
+    # '-c' or '--categorization_path' specifies a categorization file applied before the first request
+    # '--policy_path' specifies the directory of the keystore
+    # '--socket' specifies the path of the Unix socket to listen on
+    # '--port' listens on a localhost TCP port instead of a Unix socket
+    # '-d', '-l', '-e' and '-k' work like the options of main.py
+    proper_format = "AnalysisServer.py -h -c -d -l -e -k\nalternative long options:\n--help\n" \
+                    "--categorization_path\n--policy_path\n--socket\n--port\n--default_connections\n" \
+                    "--lifecycle_connections\n--exhaustive_paths\n--paths_per_pair\n"
+    try:
+        opts, _ = getopt.getopt(argv, "hc:dlek:", ["help", "categorization_path=", "policy_path=", "socket=", "port=",
+                                                   "default_connections", "lifecycle_connections",
+                                                   "exhaustive_paths", "paths_per_pair="])
+    except getopt.GetoptError:
+        print('Error')
+        print(proper_format)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(proper_format)
+            sys.exit()
+        elif opt in ("-c", "--categorization_path"):
+            categorization_path = arg
+        elif opt == "--policy_path":
+            policy_path = arg
+        elif opt == "--socket":
+            socket_path = arg
+        elif opt == "--port":
+            if not arg.isdecimal() or not 1 <= int(arg) <= 65535:
+                print(f'Port {arg} is not an integer between 1 and 65535')
+                print(proper_format)
+                sys.exit(2)
+            port = int(arg)
+        elif opt in ("-d", "--default_connections"):
+            include_standard_elements = True
+        elif opt in ("-l", "--lifecycle_connections"):
+            standard_elements = ROSGraph.STANDARD_ELEMENTS + ROSGraph.LIFECYCLE_ELEMENTS
+        elif opt in ("-e", "--exhaustive_paths"):
+            exhaustive_paths = True
+        elif opt in ("-k", "--paths_per_pair"):
+            if not arg.isdecimal() or int(arg) < 1:
+                print(f'Number of paths per pair {arg} is not an integer of at least 1')
+                print(proper_format)
+                sys.exit(2)
+            paths_per_pair = int(arg)
+
+    server = AnalysisServer(policy_path, include_standard_elements=include_standard_elements,
+                            standard_elements=standard_elements, exhaustive=exhaustive_paths,
+                            paths_per_pair=paths_per_pair)
+    server.reload()
+    if categorization_path is not None:
+        server.categorize({'path': categorization_path})
+    server.check()
+    asyncio.run(server.serve(socket_path, port))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,128 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import networkx as nx
+import Categorization
+import GraphCore
+import Reachability
+import ROSGraph
+
+# The ROS graph and settings shared by all evaluations of a worker process, set by _initialize_worker
+_worker_graph = None
+_worker_remove_non_descendants = True
+
+
+# Evaluates many categorizations against one ROS graph
+# Every categorization is applied as an overlay of privacy types on top of the unchanged ROS graph, so the policies are
+# parsed and the ROS graph is built only once for all of them. The evaluations can be spread over worker processes,
+# each of which receives the ROS graph once.
+# @param graph: The ROSGraph to evaluate the categorizations against
+# @param categorization_paths: The categorization files to evaluate
+# @param workers: The number of processes evaluating categorizations, 1 evaluates them in this process, 0 uses all CPU
+#                 cores
+# @return: One result per categorization file as returned by evaluate_categorization, in the given order
+def evaluate_categorizations(graph: ROSGraph.ROSGraph, categorization_paths: list, workers=1) -> list:
+    graph.update_privacy_graph()  # Removes the standard elements if they are excluded
+    ros_graph = graph.get_ros_graph()
+    categorizations = [Categorization.read_categorization(path) for path in categorization_paths]
+    if workers == 1 or len(categorizations) < 2:
+        results = [evaluate_categorization(ros_graph, categorization, graph.remove_non_descendants)
+                   for categorization in categorizations]
+    else:
+        workers = min(workers or os.cpu_count(), len(categorizations))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker,
+                                 initargs=(ros_graph, graph.remove_non_descendants)) as executor:
+            results = list(executor.map(_evaluate_categorization_in_worker, categorizations))
+    for path, result in zip(categorization_paths, results):
+        result['categorization'] = path
+    return results
+
+
+# Lists the categorization files of a directory or a comma separated list of files and directories
+# Files of a directory are sorted by name, with numbers compared by value (step_2 before step_10)
+def list_categorizations(paths: str) -> list:
+    categorization_paths = []
+    for path in paths.split(','):
+        if os.path.isdir(path):
+            categorization_paths += sorted((os.path.join(path, file) for file in os.listdir(path)
+                                            if file.endswith('.json')), key=_natural_sort_key)
+        else:
+            categorization_paths.append(path)
+    return categorization_paths
+
+
+def _natural_sort_key(path: str) -> list:
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)]
+
+
+# Builds the privacy type overlay of a categorization, with the same result as ROSGraph.apply_categorization
+# @param ros_graph: The ROS graph the categorization is applied to
+# @param categorization: The categorization as returned by Categorization.read_categorization, with exact names and
+#                        rules (see Categorization.CategorizationMatcher)
+# @return: The overlay mapping graph node names to privacy types and the warnings for entries that could not be applied
+def categorization_overlay(ros_graph: nx.DiGraph, categorization: dict) -> (dict, list):
+    return Categorization.CategorizationMatcher(categorization).resolve(ros_graph)
+
+
+# Builds the pruned privacy graph of a ROS graph with a privacy type overlay, like ROSGraph.update_privacy_graph does
+# for a categorized ROSGraph
+# @param ros_graph: The ROS graph, it is not changed
+# @param overlay: The privacy types replacing those of the ROS graph, by graph node name
+# @param remove_non_descendants: Whether to remove graph nodes that are not reachable from any source
+def overlay_privacy_graph(ros_graph: nx.DiGraph, overlay: dict, remove_non_descendants=True) -> nx.DiGraph:
+    privacy_graph = nx.DiGraph()
+    for name, attributes in ros_graph.nodes(data=True):
+        privacy_type = overlay.get(name, attributes['privacy_type'])
+        if privacy_type not in ROSGraph.PRIVACY_REMOVED_TYPES:
+            privacy_graph.add_node(name, **dict(attributes, privacy_type=privacy_type))
+    privacy_graph.add_edges_from((source, target, dict(attributes))
+                                 for source, target, attributes in ros_graph.edges(data=True)
+                                 if attributes.get('allowed') is True and privacy_graph.has_node(source) and
+                                 privacy_graph.has_node(target))
+    sources = [name for name, attributes in privacy_graph.nodes(data=True)
+               if attributes['node_type'] == 'node' and attributes['privacy_type'] == 'source']
+    Reachability.prune_privacy_graph(privacy_graph, sources, remove_non_descendants=remove_non_descendants)
+    return privacy_graph
+
+
+# Evaluates one categorization against a ROS graph without changing the graph
+# @param ros_graph: The ROS graph
+# @param categorization: The categorization as returned by Categorization.read_categorization
+# @param remove_non_descendants: Whether to remove graph nodes that are not reachable from any source
+# @return: A dictionary with the verdict, the connected source and leak pairs, one vulnerable path per pair and the
+#          warnings for categorization entries that could not be applied
+def evaluate_categorization(ros_graph: nx.DiGraph, categorization: dict, remove_non_descendants=True) -> dict:
+    overlay, warnings = categorization_overlay(ros_graph, categorization)
+    core = GraphCore.CompactGraph(overlay_privacy_graph(ros_graph, overlay, remove_non_descendants))
+    sources = core.nodes_of('node', 'source')
+    leaks = core.nodes_of('node', 'leak') + core.nodes_of('node', 'default')
+    pairs, vulnerable_paths = Reachability.find_vulnerable_paths(core, sources, leaks)
+    return {'vulnerable': len(pairs) > 0, 'pairs': [core.names_of(pair) for pair in pairs],
+            'paths': [core.names_of(path) for path in vulnerable_paths], 'warnings': warnings}
+
+
+def _initialize_worker(ros_graph: nx.DiGraph, remove_non_descendants: bool) -> None:
+    global _worker_graph, _worker_remove_non_descendants
+    _worker_graph = ros_graph
+    _worker_remove_non_descendants = remove_non_descendants
+
+
+def _evaluate_categorization_in_worker(categorization: dict) -> dict:
+    return evaluate_categorization(_worker_graph, categorization, _worker_remove_non_descendants)
+
+
+# Formats the results of evaluate_categorizations as a table with one row per categorization and one line per
+# vulnerable path
+def format_results(results: list) -> str:
+    names = [os.path.basename(result['categorization']) for result in results]
+    width = max([len('Categorization')] + [len(name) for name in names])
+    lines = [f"{'Categorization':<{width}}  {'Verdict':<10}  {'Pairs':>5}  Vulnerable paths"]
+    for name, result in zip(names, results):
+        verdict = 'Vulnerable' if result['vulnerable'] else 'Safe'
+        paths = [' -> '.join(path) for path in result['paths']] or ['-']
+        lines.append(f"{name:<{width}}  {verdict:<10}  {len(result['pairs']):>5}  {paths[0]}")
+        for path in paths[1:]:
+            lines.append(f"{'':<{width}}  {'':<10}  {'':>5}  {path}")
+        for warning in result['warnings']:
+            lines.append(f"{'':<{width}}  {'':<10}  {'':>5}  Warning: {warning}")
+    return '\n'.join(lines)
@@ -0,0 +1,345 @@
+from xml.sax.saxutils import escape
+import datetime
+import getopt
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import Diagnostics
+import GraphExport
+import ROSGraph
+import XMLParser
+
+# Phases of an analysis run timed by the benchmark, in the order they run
+PHASES = ['crawl', 'parse', 'graph_build', 'privacy_graph_build', 'vulnerability_check', 'export']
+# Transmission types with the node competences of the providing and the using side
+TRANSMISSIONS = {'topic': ('publish', 'subscribe'), 'service': ('reply', 'request'), 'action': ('execute', 'call')}
+
+
+# Generates a synthetic SROS2 keystore
+# Every enclave gets one fragment file with the profiles of its nodes, which the policy files include. Every profile
+# includes a chain of common fragments include_depth levels deep, like the common/node.xml profiles of real
+# keystores. Each node provides or uses connections_per_node random topics, services and actions, and each rule is a
+# DENY rule with probability deny_ratio.
+# @param path: The directory to write the keystore to, it is created if it does not exist
+# @param enclaves: The number of enclaves
+# @param nodes: The number of nodes per enclave
+# @param topics: The number of topics
+# @param services: The number of services
+# @param actions: The number of actions
+# @param include_depth: The number of nested includes of the common fragments (0 includes none)
+# @param deny_ratio: The share of DENY rules
+# @param connections_per_node: The number of transmitters each node is connected to
+# @param policy_files: The number of policy files the enclaves are spread over
+# @param seed: The seed of the random generator
+# @return: The names of the generated nodes and transmitters and the number of written files
+def generate_keystore(path: str, enclaves=4, nodes=25, topics=100, services=30, actions=10, include_depth=2,
+                      deny_ratio=0.05, connections_per_node=8, policy_files=1, seed=0) -> dict:
+    generator = random.Random(seed)
+    transmitters = ([('topic', f'/topic_{index}') for index in range(topics)] +
+                    [('service', f'/service_{index}') for index in range(services)] +
+                    [('action', f'/action_{index}') for index in range(actions)])
+    os.makedirs(os.path.join(path, 'profiles', 'common'), exist_ok=True)
+    written_files = 0
+    for level in range(include_depth):
+        with open(os.path.join(path, 'profiles', 'common', f'level_{level}.xml'), 'w') as outfile:
+            outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<profile xmlns:xi="http://www.w3.org/2001/XInclude">\n')
+            if level + 1 < include_depth:
+                outfile.write(f'  <xi:include href="level_{level + 1}.xml" xpointer="xpointer(/profile/*)"/>\n')
+            else:
+                outfile.write('  <topics subscribe="ALLOW">\n    <topic>/clock</topic>\n  </topics>\n'
+                              '  <topics publish="ALLOW">\n    <topic>/rosout</topic>\n  </topics>\n')
+            outfile.write('</profile>\n')
+        written_files += 1
+
+    node_names = []
+    for enclave in range(enclaves):
+        with open(os.path.join(path, 'profiles', f'enclave_{enclave}.xml'), 'w') as outfile:
+            outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<profiles xmlns:xi="http://www.w3.org/2001/XInclude">\n')
+            for node in range(nodes):
+                node_name = f'node_{enclave}_{node}'
+                node_names.append('/' + node_name)
+                outfile.write(f'  <profile node="{node_name}" ns="/">\n')
+                if include_depth > 0:
+                    outfile.write('    <xi:include href="common/level_0.xml" xpointer="xpointer(/profile/*)"/>\n')
+                for transmission_type, transmitter in generator.sample(transmitters,
+                                                                       min(connections_per_node, len(transmitters))):
+                    competence = TRANSMISSIONS[transmission_type][generator.random() < 0.5]
+                    rule = 'DENY' if generator.random() < deny_ratio else 'ALLOW'
+                    outfile.write(f'    <{transmission_type}s {competence}="{rule}">\n'
+                                  f'      <{transmission_type}>{escape(transmitter)}</{transmission_type}>\n'
+                                  f'    </{transmission_type}s>\n')
+                outfile.write('  </profile>\n')
+            outfile.write('</profiles>\n')
+        written_files += 1
+
+    for policy in range(policy_files):
+        with open(os.path.join(path, f'policy_{policy}.xml'), 'w') as outfile:
+            outfile.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                          '<policy version="0.2.0" xmlns:xi="http://www.w3.org/2001/XInclude">\n  <enclaves>\n')
+            for enclave in range(policy, enclaves, policy_files):
+                outfile.write(f'    <enclave path="/enclave_{enclave}">\n      <profiles>\n'
+                              f'        <xi:include href="profiles/enclave_{enclave}.xml" '
+                              f'xpointer="xpointer(/profiles/*)"/>\n      </profiles>\n    </enclave>\n')
+            outfile.write('  </enclaves>\n</policy>\n')
+        written_files += 1
+    return {'nodes': node_names, 'transmitters': [transmitter for _, transmitter in transmitters],
+            'files': written_files}
+
+
+# Generates a categorization for the nodes and transmitters of a generated keystore in the format of main.py
+# @param keystore: The names returned by generate_keystore
+# @param path: The path of the categorization file to write
+# @return: The categorization
+def generate_categorization(keystore: dict, path: str, sources=0.02, leaks=0.05, conduits=0.2, sanitizers=0.05,
+                            sensitive=0.1, mundane=0.1, seed=0) -> dict:
+    generator = random.Random(seed)
+    nodes = list(keystore['nodes'])
+    transmitters = list(keystore['transmitters'])
+    generator.shuffle(nodes)
+    generator.shuffle(transmitters)
+    categorization = {}
+    start = 0
+    for key, share in [('source', sources), ('leak', leaks), ('conduit', conduits), ('sanitizer', sanitizers)]:
+        count = max(1, round(share * len(nodes))) if share > 0 else 0
+        categorization[key] = nodes[start:start + count]
+        start += count
+    start = 0
+    for key, share in [('sensitive', sensitive), ('mundane', mundane)]:
+        count = round(share * len(transmitters))
+        categorization[key] = transmitters[start:start + count]
+        start += count
+    with open(path, 'w') as outfile:
+        json.dump(categorization, outfile, indent=4)
+    return categorization
+
+
+# Runs all phases of an analysis once and measures them
+# @param trace_memory: Whether to record the peak memory of every phase with tracemalloc, which slows down the run
+# @return: A dictionary mapping phases to their duration in seconds and, if traced, their peak memory in bytes
+def run_phases(keystore_path: str, categorization: dict, workers=1, export_format='npz',
+               trace_memory=False) -> dict:
+    measurements = {}
+    results = {}
+    XMLParser.fragment_cache.clear()
+
+    def measure(phase, function):
+        if trace_memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        results[phase] = function()
+        measurements[phase] = {'seconds': time.perf_counter() - start}
+        if trace_memory:
+            measurements[phase]['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+
+    def parse():
+        XMLParser.fragment_cache.register(results['crawl']['fragment'])
+        return [rule for xml_file in results['crawl']['policy'] for rule in XMLParser.iter_sros2_rules(xml_file)]
+
+    def build_privacy_graph():
+        graph = results['graph_build']
+        graph.apply_categorization(categorization['source'], categorization['leak'], categorization['conduit'],
+                                   categorization['sanitizer'], categorization['sensitive'],
+                                   categorization['mundane'])
+        return graph.get_privacy_graph()
+
+    def export():
+        with tempfile.TemporaryDirectory() as export_path:
+            return GraphExport.save_graphs(results['graph_build'], export_path, export_format)
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        measure('crawl', lambda: XMLParser.scan_keystore(XMLParser.crawl_keystore(keystore_path)))
+        if workers == 1:
+            measure('parse', parse)
+            measure('graph_build', lambda: _build_graph(results['parse']))
+        else:
+            # Parsing and building overlap in the parallel mode, so both are measured as one phase
+            measure('graph_build', lambda: XMLParser.build_graph_from_directory(path=keystore_path,
+                                                                                workers=workers))
+        measure('privacy_graph_build', build_privacy_graph)
+        measure('vulnerability_check', lambda: results['graph_build'].is_privacy_vulnerable())
+        measure('export', export)
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    graph = results['graph_build']
+    measurements['sizes'] = {'ros_nodes': graph.get_ros_graph().number_of_nodes(),
+                             'ros_edges': graph.get_ros_graph().number_of_edges(),
+                             'privacy_nodes': graph.get_privacy_graph().number_of_nodes(),
+                             'privacy_edges': graph.get_privacy_graph().number_of_edges(),
+                             'vulnerable': results['vulnerability_check']}
+    return measurements
+
+
+def _build_graph(rules: list) -> ROSGraph.ROSGraph:
+    graph = ROSGraph.ROSGraph()
+    graph.add_connections(rules)
+    return graph
+
+
+# Generates a keystore, runs the phases repeat times and once more with memory tracing
+# @param parameters: The parameters of generate_keystore
+# @param repeat: The number of timed runs, the minimum duration per phase is reported
+# @param keystore_path: The directory of the generated keystore, None uses a temporary directory that is removed
+# @return: The benchmark results with the parameters, the environment, the durations and peak memory per phase
+def run_benchmark(parameters: dict, repeat=3, workers=1, export_format='npz', keystore_path=None) -> dict:
+    temporary = keystore_path is None
+    if temporary:
+        keystore_path = tempfile.mkdtemp(prefix='sros2_benchmark_')
+    echo_level = Diagnostics.diagnostics.echo_level
+    Diagnostics.diagnostics.echo_level = None
+    try:
+        keystore = generate_keystore(keystore_path, **parameters)
+        categorization = generate_categorization(keystore, os.path.join(keystore_path, 'categorization.json'),
+                                                 seed=parameters.get('seed', 0))
+        runs = [run_phases(keystore_path, categorization, workers, export_format) for _ in range(repeat)]
+        traced = run_phases(keystore_path, categorization, workers, export_format, trace_memory=True)
+        Diagnostics.diagnostics.clear()
+    finally:
+        Diagnostics.diagnostics.echo_level = echo_level
+        if temporary:
+            shutil.rmtree(keystore_path, ignore_errors=True)
+    phases = {}
+    for phase in PHASES:
+        if phase in traced:
+            phases[phase] = {'seconds': min(run[phase]['seconds'] for run in runs),
+                             'peak_bytes': traced[phase]['peak_bytes']}
+    return {'revision': _git_revision(), 'python': platform.python_version(),
+            'date': datetime.datetime.now().isoformat(timespec='seconds'), 'parameters': parameters,
+            'repeat': repeat, 'workers': workers, 'export_format': export_format, 'files': keystore['files'],
+            'sizes': traced['sizes'], 'phases': phases}
+
+
+# Compares the rules the streaming parser reads from the policy files of a keystore with the rules of the same files
+# with all XIncludes expanded by lxml (see XMLParser.read_policy_rules_with_xinclude)
+# @param path: The directory of the keystore
+# @return: The policy files whose rules differ
+def check_rules(path: str) -> list:
+    classified = XMLParser.scan_keystore(XMLParser.crawl_keystore(path))
+    return [policy for policy in classified['policy']
+            if sorted(XMLParser.read_policy_rules(policy), key=repr) !=
+            sorted(XMLParser.read_policy_rules_with_xinclude(policy), key=repr)]
+
+
+# Returns the commit the benchmark runs on, None outside of a git checkout
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Formats benchmark results as a table, compared to a baseline if given
+def format_results(results: dict, baseline: dict = None) -> str:
+    lines = [f"Revision {results['revision']}, {results['sizes']['ros_nodes']} graph nodes, "
+             f"{results['sizes']['ros_edges']} edges, {results['files']} files"]
+    header = f"{'Phase':<20}  {'Seconds':>10}  {'Peak MiB':>10}"
+    if baseline is not None:
+        lines[0] += f" (baseline {baseline['revision']})"
+        header += f"  {'Speedup':>8}  {'Memory':>8}"
+    lines.append(header)
+    for phase, measurement in results['phases'].items():
+        line = f"{phase:<20}  {measurement['seconds']:>10.4f}  {measurement['peak_bytes'] / 2 ** 20:>10.2f}"
+        if baseline is not None and phase in baseline['phases']:
+            base = baseline['phases'][phase]
+            line += (f"  {base['seconds'] / max(measurement['seconds'], 1e-9):>7.2f}x"
+                     f"  {measurement['peak_bytes'] / max(base['peak_bytes'], 1):>7.2f}x")
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+# Runs the benchmark from the command line
+def main(argv) -> None:
+    parameters = {'enclaves': 4, 'nodes': 25, 'topics': 100, 'services': 30, 'actions': 10, 'include_depth': 2,
+                  'deny_ratio': 0.05, 'connections_per_node': 8, 'policy_files': 1, 'seed': 0}
+    repeat = 3
+    workers = 1
+    export_format = 'npz'
+    output_path = None
+    baseline_path = None
+    keystore_path = None
+    check_path = None
+
+    # Handles command line arguments
+    # '--<parameter> <value>' sets a parameter of the generated keystore (see generate_keystore)
+    # '-r' or '--repeat' specifies the number of timed runs
+    # '-j' or '--workers' specifies the number of processes parsing policy files
+    # '--save_format' specifies the export format that is timed
+    # '-o' or '--output' saves the results as JSON
+    # '-b' or '--baseline' compares the results to results saved before
+    # '-k' or '--keystore_path' keeps the generated keystore in the given directory
+    # '-c' or '--check_rules' only compares the rules of the policy files of a keystore to those read with lxml's
+    # xinclude() (see check_rules)
+    proper_format = "Benchmark.py -h -r -j -o -b -k -c\nalternative long options:\n--help\n--repeat\n--workers\n" \
+                    "--save_format\n--output\n--baseline\n--keystore_path\n--check_rules\n" + \
+                    ''.join(f'--{parameter}\n' for parameter in parameters)
+    try:
+        opts, _ = getopt.getopt(argv, "hr:j:o:b:k:c:", ["help", "repeat=", "workers=", "save_format=", "output=",
+                                                        "baseline=", "keystore_path=", "check_rules="] +
+                                [f'{parameter}=' for parameter in parameters])
+    except getopt.GetoptError:
+        print('Error')
+        print(proper_format)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(proper_format)
+            sys.exit()
+        elif opt in ("-r", "--repeat"):
+            if not arg.isdecimal() or int(arg) < 1:
+                print(f'Number of runs {arg} is not an integer of at least 1')
+                print(proper_format)
+                sys.exit(2)
+            repeat = int(arg)
+        elif opt in ("-j", "--workers"):
+            if not arg.isdecimal():
+                print(f'Number of workers {arg} is not a non-negative integer')
+                print(proper_format)
+                sys.exit(2)
+            workers = int(arg)
+        elif opt == "--save_format":
+            export_format = arg
+        elif opt in ("-o", "--output"):
+            output_path = arg
+        elif opt in ("-b", "--baseline"):
+            baseline_path = arg
+        elif opt in ("-k", "--keystore_path"):
+            keystore_path = arg
+        elif opt in ("-c", "--check_rules"):
+            check_path = arg
+        else:
+            parameter = opt[2:]
+            parameters[parameter] = type(parameters[parameter])(arg)
+
+    if check_path is not None:
+        mismatches = check_rules(check_path)
+        for policy in mismatches:
+            print(f'Rules of {policy} differ from the rules read with xinclude()')
+        print(f'{len(mismatches)} policy file(s) with differing rules')
+        sys.exit(1 if mismatches else 0)
+
+    results = run_benchmark(parameters, repeat, workers, export_format, keystore_path)
+    baseline = None
+    if baseline_path is not None:
+        with open(baseline_path, 'r') as infile:
+            baseline = json.load(infile)
+    print(format_results(results, baseline))
+    if output_path is not None:
+        with open(output_path, 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+        print(f'Saved benchmark results to {output_path}')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
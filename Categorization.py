@@ -0,0 +1,141 @@
+import json
+import re
+import networkx as nx
+import Reachability
+
+# Keys of a categorization file in the order ROSGraph.apply_categorization applies them, with the privacy type they
+# assign and the node types they apply to
+CATEGORIZATION_KEYS = [('source', 'source', ['node']), ('leak', 'leak', ['node']), ('conduit', 'conduit', ['node']),
+                       ('sanitizer', 'sanitizer', ['node']),
+                       ('sensitive', 'sensitive', Reachability.TRANSMITTER_TYPES),
+                       ('mundane', 'mundane', Reachability.TRANSMITTER_TYPES)]
+# Prefixes of the entries of a categorization that are rules instead of exact names
+PREFIX_RULE = 'prefix:'
+GLOB_RULE = 'glob:'
+REGEX_RULE = 're:'
+
+
+# Reads a categorization file with the keys of CATEGORIZATION_KEYS, missing keys are treated as empty lists
+def read_categorization(path: str) -> dict:
+    with open(path, 'r') as infile:
+        return validate_categorization(json.load(infile))
+
+
+# Checks that a categorization read from JSON maps the keys of CATEGORIZATION_KEYS to lists of strings
+# @param categorization: The parsed categorization, other keys are ignored
+# @return: The categorization with all keys of CATEGORIZATION_KEYS, missing keys as empty lists
+# @raise ValueError: If the categorization is no JSON object or a key does not map to a list of strings
+def validate_categorization(categorization) -> dict:
+    if not isinstance(categorization, dict):
+        raise ValueError(f'Categorization is not a JSON object but {type(categorization).__name__}')
+    for key, _, _ in CATEGORIZATION_KEYS:
+        entries = categorization.get(key, [])
+        if not isinstance(entries, list) or not all(isinstance(entry, str) for entry in entries):
+            raise ValueError(f'Categorization key {key} does not map to a list of strings')
+    return {key: categorization.get(key, []) for key, _, _ in CATEGORIZATION_KEYS}
+
+
+# Assigns privacy types to graph nodes by the entries of a categorization, compiled once for all graph nodes
+# An entry is an exact graph node name or a rule:
+# 'prefix:/robot1' matches /robot1 and every name in its namespace, e.g. /robot1/camera/image_raw
+# 'glob:/robot*/camera/image_raw' matches names with * for any characters but /, ** for any characters and ? for one
+# character but /
+# 're:/robot[0-9]+/.*' matches names the whole of which match the regular expression
+# If entries for the same node types overlap, an exact name beats the longest matching prefix, which beats the glob and
+# regex rules. Entries of the same kind are resolved like apply_categorization resolves names: the last key of
+# CATEGORIZATION_KEYS wins, and among the globs and regexes of one key the first listed one.
+# The prefixes are kept in a dictionary, which is looked up once per namespace of a name. Every glob and regex is
+# compiled on its own and they are tried in the order above, so flags, group names and backreferences of a regex only
+# apply to the regex itself.
+class CategorizationMatcher:
+    # @param categorization: A dictionary mapping the keys of CATEGORIZATION_KEYS to lists of entries, missing keys
+    #                        are treated as empty lists
+    def __init__(self, categorization: dict):
+        self.exact = {}  # 'node' or 'transmitter' -> {name: privacy type}
+        self.prefixes = {}  # 'node' or 'transmitter' -> {prefix without trailing /: privacy type}
+        self.patterns = {}  # 'node' or 'transmitter' -> [(compiled glob or regex, privacy type)] in the order tried
+        self.warnings = []  # Entries that are no strings and rules that are no valid regular expressions
+        for key, privacy_type, node_types in reversed(CATEGORIZATION_KEYS):
+            kind = _kind(node_types[0])
+            for entry in categorization.get(key, []):
+                if not isinstance(entry, str):
+                    self.warnings.append(f'Entry {entry!r} of {key} is not a string')
+                elif entry.startswith(PREFIX_RULE):
+                    prefix = entry[len(PREFIX_RULE):]
+                    self.prefixes.setdefault(kind, {}).setdefault(prefix[:-1] if prefix.endswith('/') else prefix,
+                                                                  privacy_type)
+                elif entry.startswith(GLOB_RULE) or entry.startswith(REGEX_RULE):
+                    if entry.startswith(GLOB_RULE):
+                        pattern = glob_to_regex(entry[len(GLOB_RULE):])
+                    else:
+                        pattern = entry[len(REGEX_RULE):]
+                    try:
+                        compiled = re.compile(pattern)
+                    except re.error as error:
+                        self.warnings.append(f'Rule {entry} is not a valid regular expression: {error}')
+                        continue
+                    self.patterns.setdefault(kind, []).append((compiled, privacy_type))
+                else:
+                    self.exact.setdefault(kind, {}).setdefault(entry, privacy_type)
+
+    # Whether the categorization has rules that can match graph nodes not listed by name
+    def has_rules(self) -> bool:
+        return bool(self.prefixes or self.patterns)
+
+    # Returns the privacy type the categorization assigns to a graph node
+    # @param name: The name of the graph node
+    # @param node_type: The node type of the graph node
+    # @return: The privacy type, None if no entry matches
+    def match(self, name: str, node_type: str):
+        kind = _kind(node_type)
+        exact = self.exact.get(kind, {})
+        if name in exact:
+            return exact[name]
+        prefixes = self.prefixes.get(kind)
+        if prefixes:
+            if name in prefixes:
+                return prefixes[name]
+            end = name.rfind('/')
+            while end >= 0:
+                if name[:end] in prefixes:
+                    return prefixes[name[:end]]
+                end = name.rfind('/', 0, end)
+        for pattern, privacy_type in self.patterns.get(kind, []):
+            if pattern.fullmatch(name) is not None:
+                return privacy_type
+        return None
+
+    # Resolves the privacy types of the graph nodes of a ROS graph in one pass over its graph nodes
+    # Without prefix, glob and regex rules only the listed names are looked up.
+    # @return: A dictionary mapping graph node names to privacy types and the warnings for invalid rules and names that
+    #          could not be applied
+    def resolve(self, ros_graph: nx.DiGraph) -> (dict, list):
+        privacy_types = {}
+        warnings = list(self.warnings)
+        for kind, exact in self.exact.items():
+            for name, privacy_type in exact.items():
+                if not ros_graph.has_node(name):
+                    warnings.append(f'Graph node {name} does not exist')
+                elif _kind(ros_graph.nodes[name]['node_type']) != kind:
+                    warnings.append(f"Graph node {name} can't be {privacy_type}, it is a(n) "
+                                    f"{ros_graph.nodes[name]['node_type']}")
+                elif not self.has_rules():
+                    privacy_types[name] = privacy_type
+        if self.has_rules():
+            for name, attributes in ros_graph.nodes(data=True):
+                privacy_type = self.match(name, attributes['node_type'])
+                if privacy_type is not None:
+                    privacy_types[name] = privacy_type
+        return privacy_types, warnings
+
+
+# Translates a glob of graph node names into a regular expression
+# * matches any characters but /, ** any characters and ? one character but /
+def glob_to_regex(glob: str) -> str:
+    return ''.join({'**': '.*', '*': '[^/]*', '?': '[^/]'}.get(token) or re.escape(token)
+                   for token in re.findall(r'\*\*|\*|\?|[^*?]+', glob))
+
+
+# ROS nodes and transmitters are categorized by separate entries
+def _kind(node_type: str) -> str:
+    return 'node' if node_type == 'node' else 'transmitter'
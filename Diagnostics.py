@@ -0,0 +1,87 @@
+import contextlib
+import sys
+
+# Levels of diagnostics, higher levels are more severe
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning', ERROR: 'error'}
+
+
+# Collects the diagnostics of a run in memory and echoes those at or above a level to stdout
+# Every diagnostic is a record with its level, message and optional context (e.g. the graph node it is about), so a
+# summary of the run can be emitted at the end instead of scraping the console output. Warnings and errors are echoed
+# in the >>>>>>>>>>message<<<<<<<<<< form, other diagnostics as plain lines.
+class Diagnostics:
+    # @param echo_level: The lowest level echoed to stdout, None echoes nothing
+    def __init__(self, echo_level=INFO):
+        self.echo_level = echo_level
+        self.records = []
+
+    # Records a diagnostic
+    # @param level: The level of the diagnostic (DEBUG, INFO, WARNING, ERROR)
+    # @param message: The message of the diagnostic
+    # @param context: Additional values describing the diagnostic
+    def log(self, level: int, message: str, **context) -> None:
+        self.add_record({'level': level, 'message': message, 'context': context})
+
+    # Records a diagnostic recorded elsewhere, e.g. in a worker process
+    def add_record(self, record: dict) -> None:
+        self.records.append(record)
+        if self.echo_level is not None and record['level'] >= self.echo_level:
+            if record['level'] >= WARNING:
+                print(f">>>>>>>>>>{record['message']}<<<<<<<<<<")
+            else:
+                print(record['message'])
+            sys.stdout.flush()
+
+    # Collects the diagnostics recorded inside the with block into a separate list without echoing them
+    @contextlib.contextmanager
+    def capture(self):
+        records, echo_level = self.records, self.echo_level
+        self.records, self.echo_level = [], None
+        try:
+            yield self.records
+        finally:
+            self.records, self.echo_level = records, echo_level
+
+    # Returns the recorded diagnostics at or above a level
+    def records_at(self, level: int) -> list:
+        return [record for record in self.records if record['level'] >= level]
+
+    # Returns the number of recorded diagnostics per level name
+    def counts(self) -> dict:
+        counts = {name: 0 for name in LEVEL_NAMES.values()}
+        for record in self.records:
+            name = LEVEL_NAMES.get(record['level'], str(record['level']))
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+    # Returns the recorded diagnostics at or above a level in a form that can be written as JSON
+    def to_list(self, level=WARNING) -> list:
+        return [{'level': LEVEL_NAMES.get(record['level'], record['level']), 'message': record['message'],
+                 'context': record['context']} for record in self.records_at(level)]
+
+    def clear(self) -> None:
+        self.records = []
+
+
+# The diagnostics of all graph operations in this process
+diagnostics = Diagnostics()
+
+
+def debug(message: str, **context) -> None:
+    diagnostics.log(DEBUG, message, **context)
+
+
+def info(message: str, **context) -> None:
+    diagnostics.log(INFO, message, **context)
+
+
+def warning(message: str, **context) -> None:
+    diagnostics.log(WARNING, message, **context)
+
+
+def error(message: str, **context) -> None:
+    diagnostics.log(ERROR, message, **context)
@@ -0,0 +1,104 @@
+from array import array
+import networkx as nx
+
+# Small-int codes of the node_type and privacy_type attributes
+NODE_TYPES = ['node', 'topic', 'service', 'action']
+PRIVACY_TYPES = ['default', 'source', 'leak', 'conduit', 'sanitizer', 'sensitive', 'mundane']
+_NODE_TYPE_CODES = {node_type: code for code, node_type in enumerate(NODE_TYPES)}
+_PRIVACY_TYPE_CODES = {privacy_type: code for code, privacy_type in enumerate(PRIVACY_TYPES)}
+
+
+# A compact, integer-indexed snapshot of a graph for the analysis passes
+# Graph node names are interned to consecutive integer ids in the order of the networkx graph. node_type, privacy_type
+# and enclave are stored as small-int codes in typed arrays, and the successors and predecessors of all graph nodes as
+# CSR arrays (offsets into one flat array of ids per direction). Successors keep the order of the networkx graph, so
+# searches on the snapshot visit graph nodes in the same order as on the networkx graph.
+class CompactGraph:
+    # Builds the snapshot of a networkx graph
+    # @param nx_graph: A graph whose nodes have node_type, privacy_type and enclave attributes
+    def __init__(self, nx_graph: nx.DiGraph):
+        self.names = list(nx_graph.nodes())
+        self.ids = {name: index for index, name in enumerate(self.names)}
+        self.enclaves = []
+        self._enclave_codes = {}
+        self.node_types = array('b')
+        self.privacy_types = array('b')
+        self.enclave_codes = array('i')
+        # (node type code, privacy type code) -> ids of all graph nodes of the class
+        self._class_index = {}
+        for node_id, (name, attributes) in enumerate(nx_graph.nodes(data=True)):
+            self.node_types.append(_NODE_TYPE_CODES[attributes['node_type']])
+            self.privacy_types.append(_PRIVACY_TYPE_CODES[attributes['privacy_type']])
+            self.enclave_codes.append(self._enclave_code(attributes.get('enclave')))
+            self._class_index.setdefault((self.node_types[node_id], self.privacy_types[node_id]), set()).add(node_id)
+        self.successor_offsets, self.successor_ids = self._csr(nx_graph.succ)
+        self.predecessor_offsets, self.predecessor_ids = self._csr(nx_graph.pred)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    # Builds the CSR arrays of an adjacency mapping
+    def _csr(self, adjacency) -> (array, array):
+        offsets = array('l', [0])
+        ids = array('l')
+        for name in self.names:
+            ids.extend(self.ids[neighbour] for neighbour in adjacency[name])
+            offsets.append(len(ids))
+        return offsets, ids
+
+    # Returns the code of an enclave, adding it to the enclave table if it is new
+    def _enclave_code(self, enclave) -> int:
+        code = self._enclave_codes.get(enclave)
+        if code is None:
+            code = len(self.enclaves)
+            self._enclave_codes[enclave] = code
+            self.enclaves.append(enclave)
+        return code
+
+    # Returns the ids of the successors of a graph node
+    def successors(self, node_id: int) -> array:
+        return self.successor_ids[self.successor_offsets[node_id]:self.successor_offsets[node_id + 1]]
+
+    # Returns the ids of the predecessors of a graph node
+    def predecessors(self, node_id: int) -> array:
+        return self.predecessor_ids[self.predecessor_offsets[node_id]:self.predecessor_offsets[node_id + 1]]
+
+    # Returns the ids of all graph nodes with the given node type and privacy type in graph order
+    # @param node_type: The type of node to get (node, topic, service, action)
+    # @param privacy_type: The privacy type of node to get (source, leak, conduit, sanitizer, default, ...)
+    def nodes_of(self, node_type, privacy_type) -> list:
+        return sorted(self._class_index.get((_NODE_TYPE_CODES[node_type], _PRIVACY_TYPE_CODES[privacy_type]), ()))
+
+    # Returns the node type, privacy type and enclave of a graph node
+    def attributes(self, node_id: int) -> dict:
+        return {'node_type': NODE_TYPES[self.node_types[node_id]],
+                'privacy_type': PRIVACY_TYPES[self.privacy_types[node_id]],
+                'enclave': self.enclaves[self.enclave_codes[node_id]]}
+
+    # Updates the attributes of a graph node after an attribute-only change of the graph it was built from
+    # @param name: The name of the graph node
+    # @param attributes: The new attributes of the graph node
+    def update_attributes(self, name, attributes: dict) -> None:
+        node_id = self.ids.get(name)
+        if node_id is None:
+            return
+        previous_class = (self.node_types[node_id], self.privacy_types[node_id])
+        self._class_index[previous_class].discard(node_id)
+        if not self._class_index[previous_class]:
+            del self._class_index[previous_class]
+        self.node_types[node_id] = _NODE_TYPE_CODES[attributes['node_type']]
+        self.privacy_types[node_id] = _PRIVACY_TYPE_CODES[attributes['privacy_type']]
+        self._class_index.setdefault((self.node_types[node_id], self.privacy_types[node_id]), set()).add(node_id)
+        self.enclave_codes[node_id] = self._enclave_code(attributes.get('enclave'))
+
+    # Translates graph node ids to names
+    def names_of(self, node_ids) -> list:
+        return [self.names[node_id] for node_id in node_ids]
+
+    # Builds a networkx graph with the nodes, attributes and edges of the snapshot, e.g. for drawing
+    def to_networkx(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        graph.add_nodes_from((name, self.attributes(node_id)) for node_id, name in enumerate(self.names))
+        graph.add_edges_from((name, self.names[successor])
+                             for node_id, name in enumerate(self.names) for successor in self.successors(node_id))
+        return graph
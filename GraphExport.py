@@ -0,0 +1,238 @@
+from lxml import etree as ET
+import json
+import os
+import networkx as nx
+import ROSGraph
+
+# Formats the ROS and privacy graphs can be saved in, all but adjlist keep every attribute and can be read back
+EXPORT_FORMATS = ['npz', 'graphml', 'ndjson', 'adjlist']
+# Attributes of graph nodes written by the exports
+NODE_ATTRIBUTES = ['node_type', 'enclave', 'data_type', 'privacy_type']
+GRAPHML_NAMESPACE = 'http://graphml.graphdrawing.org/xmlns'
+# Marks attributes that a graph node did not have when it was written
+_MISSING = object()
+
+
+# Saves the ROS graph and the privacy graph of a ROSGraph into one file set in the given directory
+# @param graph: The ROSGraph to save
+# @param path: The output directory
+# @param export_format: The format to save the graphs in (npz, graphml, ndjson, adjlist)
+# @return: The paths of the written files
+def save_graphs(graph: ROSGraph.ROSGraph, path: str, export_format='npz') -> list:
+    os.makedirs(path, exist_ok=True)
+    graphs = {'ros': graph.get_ros_graph(), 'privacy': graph.get_privacy_graph()}
+    if export_format == 'npz':
+        return [write_npz(graphs, os.path.join(path, 'graphs.npz'))]
+    elif export_format == 'graphml':
+        return [write_graphml(graphs, os.path.join(path, 'graphs.graphml'))]
+    elif export_format == 'ndjson':
+        return [write_ndjson(graphs, os.path.join(path, 'graphs.ndjson'))]
+    elif export_format == 'adjlist':
+        # Legacy format without attributes, can't be read back
+        for name, nx_graph in graphs.items():
+            nx.write_multiline_adjlist(nx_graph, os.path.join(path, f'{name}_graph'))
+        return [os.path.join(path, f'{name}_graph') for name in graphs]
+    raise ValueError(f'Export format {export_format} not recognised')
+
+
+# Reads a file set written by save_graphs
+# @param path: The written file or the directory it was written to
+# @param export_format: The format of the file (npz, graphml, ndjson)
+# @return: A dictionary mapping 'ros' and 'privacy' to pairs of node and edge lists, as taken by
+#          ROSGraph.load_graph_elements
+def load_graphs(path: str, export_format='npz') -> dict:
+    if os.path.isdir(path):
+        path = os.path.join(path, f'graphs.{export_format}')
+    if export_format == 'npz':
+        return read_npz(path)
+    elif export_format == 'graphml':
+        return read_graphml(path)
+    elif export_format == 'ndjson':
+        return read_ndjson(path)
+    raise ValueError(f'Export format {export_format} can not be read')
+
+
+# Reads the ROS graph of a file set written by save_graphs into a new ROSGraph
+def load_ros_graph(path: str, export_format='npz', include_standard_elements=False) -> ROSGraph.ROSGraph:
+    nodes, edges = load_graphs(path, export_format)['ros']
+    graph = ROSGraph.ROSGraph(include_standard_elements=include_standard_elements)
+    graph.load_graph_elements(nodes, edges)
+    return graph
+
+
+# Writes graphs as columns of NumPy arrays into one compressed .npz file
+# String attributes are stored as integer codes into a vocabulary per attribute, where -1 stands for None and -2 for a
+# missing attribute. The allowed attribute of edges is stored as -1 (None), 0 (False) or 1 (True).
+# @param graphs: A dictionary mapping graph names to networkx graphs
+# @param path: The path of the file to write
+def write_npz(graphs: dict, path: str) -> str:
+    import numpy as np  # Only needed for this format
+    arrays = {}
+    for name, nx_graph in graphs.items():
+        node_index = {node: index for index, node in enumerate(nx_graph.nodes())}
+        arrays[f'{name}_nodes'] = np.array(list(node_index), dtype=str)
+        for attribute in NODE_ATTRIBUTES:
+            vocabulary = {}
+            codes = np.fromiter((_code(vocabulary, attributes, attribute)
+                                 for _, attributes in nx_graph.nodes(data=True)), dtype=np.int32,
+                                count=len(node_index))
+            arrays[f'{name}_node_{attribute}'] = codes
+            arrays[f'{name}_node_{attribute}_vocabulary'] = np.array(list(vocabulary), dtype=str)
+        edge_count = nx_graph.number_of_edges()
+        arrays[f'{name}_edge_source'] = np.fromiter((node_index[source] for source, _ in nx_graph.edges()),
+                                                    dtype=np.int32, count=edge_count)
+        arrays[f'{name}_edge_target'] = np.fromiter((node_index[target] for _, target in nx_graph.edges()),
+                                                    dtype=np.int32, count=edge_count)
+        vocabulary = {}
+        arrays[f'{name}_edge_role'] = np.fromiter((_code(vocabulary, attributes, 'role')
+                                                   for _, _, attributes in nx_graph.edges(data=True)),
+                                                  dtype=np.int32, count=edge_count)
+        arrays[f'{name}_edge_role_vocabulary'] = np.array(list(vocabulary), dtype=str)
+        arrays[f'{name}_edge_allowed'] = np.fromiter(
+            ({None: -1, False: 0, True: 1}[attributes.get('allowed')]
+             for _, _, attributes in nx_graph.edges(data=True)), dtype=np.int8, count=edge_count)
+    arrays['graph_names'] = np.array(list(graphs), dtype=str)
+    with open(path, 'wb') as outfile:
+        np.savez_compressed(outfile, **arrays)
+    return path
+
+
+# Returns the vocabulary code of a string attribute for write_npz
+def _code(vocabulary: dict, attributes: dict, attribute: str) -> int:
+    if attribute not in attributes:
+        return -2
+    value = attributes[attribute]
+    if value is None:
+        return -1
+    return vocabulary.setdefault(value, len(vocabulary))
+
+
+# Reads graphs written by write_npz
+def read_npz(path: str) -> dict:
+    import numpy as np  # Only needed for this format
+    graphs = {}
+    with np.load(path, allow_pickle=False) as arrays:
+        for name in arrays['graph_names'].tolist():
+            names = arrays[f'{name}_nodes'].tolist()
+            columns = {}
+            for attribute in NODE_ATTRIBUTES:
+                vocabulary = arrays[f'{name}_node_{attribute}_vocabulary'].tolist()
+                columns[attribute] = [_decode(vocabulary, code)
+                                      for code in arrays[f'{name}_node_{attribute}'].tolist()]
+            nodes = []
+            for index, node in enumerate(names):
+                attributes = {}
+                for attribute in NODE_ATTRIBUTES:
+                    if columns[attribute][index] is not _MISSING:
+                        attributes[attribute] = columns[attribute][index]
+                nodes.append((node, attributes))
+            role_vocabulary = arrays[f'{name}_edge_role_vocabulary'].tolist()
+            edges = [(names[source], names[target],
+                      {'role': _decode(role_vocabulary, role), 'allowed': [None, False, True][allowed + 1]})
+                     for source, target, role, allowed in zip(arrays[f'{name}_edge_source'].tolist(),
+                                                              arrays[f'{name}_edge_target'].tolist(),
+                                                              arrays[f'{name}_edge_role'].tolist(),
+                                                              arrays[f'{name}_edge_allowed'].tolist())]
+            graphs[name] = (nodes, edges)
+    return graphs
+
+
+# Returns the attribute value of a vocabulary code written by write_npz
+def _decode(vocabulary: list, code: int):
+    if code == -2:
+        return _MISSING
+    if code == -1:
+        return None
+    return vocabulary[code]
+
+
+# Writes graphs into one GraphML file with one graph element per graph, streaming every node and edge to the file
+# Attributes that are None are left out and read back as None.
+# @param graphs: A dictionary mapping graph names to networkx graphs
+# @param path: The path of the file to write
+def write_graphml(graphs: dict, path: str) -> str:
+    namespace = '{' + GRAPHML_NAMESPACE + '}'
+    with ET.xmlfile(path, encoding='utf-8') as outfile:
+        outfile.write_declaration()
+        with outfile.element(namespace + 'graphml', nsmap={None: GRAPHML_NAMESPACE}):
+            for attribute in NODE_ATTRIBUTES:
+                outfile.write(ET.Element(namespace + 'key', {'id': attribute, 'for': 'node', 'attr.name': attribute,
+                                                             'attr.type': 'string'}))
+            outfile.write(ET.Element(namespace + 'key', {'id': 'role', 'for': 'edge', 'attr.name': 'role',
+                                                         'attr.type': 'string'}))
+            outfile.write(ET.Element(namespace + 'key', {'id': 'allowed', 'for': 'edge', 'attr.name': 'allowed',
+                                                         'attr.type': 'boolean'}))
+            for name, nx_graph in graphs.items():
+                with outfile.element(namespace + 'graph', {'id': name, 'edgedefault': 'directed'}):
+                    for node, attributes in nx_graph.nodes(data=True):
+                        element = ET.Element(namespace + 'node', {'id': node})
+                        for attribute in NODE_ATTRIBUTES:
+                            if attributes.get(attribute) is not None:
+                                ET.SubElement(element, namespace + 'data', {'key': attribute}).text = \
+                                    attributes[attribute]
+                        outfile.write(element)
+                    for source, target, attributes in nx_graph.edges(data=True):
+                        element = ET.Element(namespace + 'edge', {'source': source, 'target': target})
+                        if attributes.get('role') is not None:
+                            ET.SubElement(element, namespace + 'data', {'key': 'role'}).text = attributes['role']
+                        if attributes.get('allowed') is not None:
+                            ET.SubElement(element, namespace + 'data', {'key': 'allowed'}).text = \
+                                'true' if attributes['allowed'] else 'false'
+                        outfile.write(element)
+    return path
+
+
+# Reads graphs written by write_graphml, dropping every element once it was read
+def read_graphml(path: str) -> dict:
+    namespace = '{' + GRAPHML_NAMESPACE + '}'
+    graphs = {}
+    nodes = edges = None
+    for event, element in ET.iterparse(path, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == namespace + 'graph':
+                nodes, edges = [], []
+                graphs[element.get('id')] = (nodes, edges)
+            continue
+        if element.tag == namespace + 'node':
+            data = {child.get('key'): child.text for child in element}
+            nodes.append((element.get('id'), ROSGraph.node_attributes(data.get('node_type'), data.get('enclave'),
+                                                                      data.get('privacy_type'),
+                                                                      data.get('data_type'))))
+        elif element.tag == namespace + 'edge':
+            data = {child.get('key'): child.text for child in element}
+            allowed = data.get('allowed')
+            edges.append((element.get('source'), element.get('target'),
+                          {'role': data.get('role'), 'allowed': None if allowed is None else allowed == 'true'}))
+        else:
+            continue
+        element.clear()
+    return graphs
+
+
+# Writes graphs as newline-delimited JSON, one line per node and edge
+# @param graphs: A dictionary mapping graph names to networkx graphs
+# @param path: The path of the file to write
+def write_ndjson(graphs: dict, path: str) -> str:
+    with open(path, 'w') as outfile:
+        for name, nx_graph in graphs.items():
+            for node, attributes in nx_graph.nodes(data=True):
+                outfile.write(json.dumps({'graph': name, 'node': node, 'attributes': attributes}) + '\n')
+            for source, target, attributes in nx_graph.edges(data=True):
+                outfile.write(json.dumps({'graph': name, 'edge': [source, target], 'attributes': attributes}) + '\n')
+    return path
+
+
+# Reads graphs written by write_ndjson line by line
+def read_ndjson(path: str) -> dict:
+    graphs = {}
+    with open(path, 'r') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            nodes, edges = graphs.setdefault(record['graph'], ([], []))
+            if 'node' in record:
+                nodes.append((record['node'], record['attributes']))
+            else:
+                edges.append((record['edge'][0], record['edge'][1], record['attributes']))
+    return graphs
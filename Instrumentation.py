@@ -0,0 +1,104 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import time
+
+
+# Timers, counters and optional cProfile capture for the phases of an analysis run
+# Everything is off by default, so the hooks in XMLParser and ROSGraph only cost a flag check. Phase timers are
+# inclusive, a phase running inside another one is counted in both. Only the outermost running phase is profiled,
+# since cProfile can't capture nested profiles.
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.profile_phases = False
+        self.timers = {}  # Phase -> {'seconds': total duration, 'calls': number of runs}
+        self.counters = {}  # Counter name -> value
+        self.profiles = {}  # Phase -> cProfile.Profile collecting all runs of the phase
+        self._profiling = False
+
+    # Switches the instrumentation on or off
+    # @param profile_phases: Whether to capture a cProfile profile per phase
+    def enable(self, enabled=True, profile_phases=False) -> None:
+        self.enabled = enabled
+        self.profile_phases = enabled and profile_phases
+
+    # Times a phase, and profiles it if profiling is on
+    # @param name: The name of the phase
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        profile = None
+        if self.profile_phases and not self._profiling:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            self._profiling = True
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            timer = self.timers.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            timer['seconds'] += duration
+            timer['calls'] += 1
+
+    # Increases a counter
+    # @param name: The name of the counter
+    # @param amount: The amount to add
+    def count(self, name: str, amount=1) -> None:
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # Returns the timers and counters in a form that can be written as JSON
+    def report(self) -> dict:
+        return {'phases': {name: dict(timer) for name, timer in self.timers.items()}, 'counters': dict(self.counters)}
+
+    # Formats the timers, counters and the most expensive functions of every profiled phase as text
+    # @param top: The number of functions listed per profiled phase
+    def format_report(self, top=10) -> str:
+        lines = [f"{'Phase':<28}  {'Seconds':>10}  {'Calls':>6}"]
+        for name, timer in self.timers.items():
+            lines.append(f"{name:<28}  {timer['seconds']:>10.4f}  {timer['calls']:>6}")
+        lines.append(f"{'Counter':<28}  {'Value':>10}")
+        for name, value in self.counters.items():
+            lines.append(f'{name:<28}  {value:>10}')
+        for name, profile in self.profiles.items():
+            stream = io.StringIO()
+            pstats.Stats(profile, stream=stream).sort_stats('cumulative').print_stats(top)
+            lines.append(f'Profile of phase {name}:')
+            lines.append(stream.getvalue().strip())
+        return '\n'.join(lines)
+
+    # Writes the profile of every profiled phase to <phase>.prof in a directory, to be read with pstats or snakeviz
+    # @return: The paths of the written files
+    def save_profiles(self, path: str) -> list:
+        os.makedirs(path, exist_ok=True)
+        written_files = []
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(path, f'{name}.prof'))
+            written_files.append(os.path.join(path, f'{name}.prof'))
+        return written_files
+
+    def clear(self) -> None:
+        self.timers = {}
+        self.counters = {}
+        self.profiles = {}
+
+
+# The instrumentation of all graph operations in this process
+instrumentation = Instrumentation()
+
+
+def phase(name: str):
+    return instrumentation.phase(name)
+
+
+def count(name: str, amount=1) -> None:
+    instrumentation.count(name, amount)
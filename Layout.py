@@ -0,0 +1,300 @@
+import hashlib
+import networkx as nx
+import numpy as np
+import Diagnostics
+
+# Layouts that can be chosen for the graph visualization
+LAYOUTS = ['spiral', 'spring', 'planar', 'multipartite', 'kamada_kawai', 'multilevel', 'enclave']
+# Layouts computed for the whole ROS graph, whose positions are reused for the graph nodes of the privacy graph
+SCALABLE_LAYOUTS = ['multilevel', 'enclave']
+# Coarsening stops at this number of graph nodes or once a level shrinks by less than COARSENING_RATIO
+COARSEST_SIZE = 50
+COARSENING_RATIO = 0.8
+# Up to this number of graph nodes all pairs of graph nodes repel each other, above distant graph nodes are grouped
+# by the cells of a grid
+EXACT_REPULSION_SIZE = 400
+# Pulls graph nodes to the center, so that a graph of n graph nodes spreads over a disk of radius sqrt(n / GRAVITY)
+GRAVITY = 0.1
+
+
+# Computes the positions of the graph nodes of a graph for a layout
+# @param graph: The graph to lay out
+# @param layout: The layout to use (see LAYOUTS)
+# @return: A dictionary mapping graph nodes to positions as taken by the networkx draw functions
+def compute_layout(graph: nx.DiGraph, layout: str) -> dict:
+    if layout == 'spiral':
+        return nx.spiral_layout(graph)
+    elif layout == 'spring':
+        return nx.spring_layout(graph)
+    elif layout == 'planar':
+        return nx.planar_layout(graph)
+    elif layout == 'multipartite':
+        # Shows enclaves, can be used for node_type
+        return nx.multipartite_layout(graph, subset_key='enclave')
+    elif layout == 'kamada_kawai':  # Needs package 'scipy' to run, quadratic in memory
+        return nx.kamada_kawai_layout(graph)
+    elif layout == 'multilevel':
+        return multilevel_layout(graph)
+    elif layout == 'enclave':
+        return enclave_layout(graph)
+    else:
+        Diagnostics.warning(f'Layout {layout} not recognised, defaulted to spiral layout')
+        return nx.spiral_layout(graph)
+
+
+# Computes a fingerprint of the structure of a graph, which is the same for graphs with the same graph nodes, node
+# types, enclaves and edges, no matter the order they were added in or their privacy types
+def graph_fingerprint(graph: nx.DiGraph) -> str:
+    fingerprint = hashlib.sha256()
+    for name, attributes in sorted((str(name), attributes) for name, attributes in graph.nodes(data=True)):
+        fingerprint.update(f"{name}\0{attributes.get('node_type')}\0{attributes.get('enclave')}\n".encode())
+    fingerprint.update(b'\1')
+    for source, target in sorted((str(source), str(target)) for source, target in graph.edges()):
+        fingerprint.update(f'{source}\0{target}\n'.encode())
+    return fingerprint.hexdigest()
+
+
+# Positions of layouts by layout and graph fingerprint, so a graph that was laid out before is not laid out again
+# Only the most recently stored layouts are kept.
+class LayoutCache:
+    # @param size: The number of layouts kept
+    def __init__(self, size=8):
+        self.size = size
+        self.layouts = {}  # (layout, fingerprint) -> positions, in the order they were stored
+
+    # Returns the positions of a layout of a graph with the given fingerprint, None if they are not cached
+    def get(self, layout: str, fingerprint: str):
+        return self.layouts.get((layout, fingerprint))
+
+    def put(self, layout: str, fingerprint: str, positions: dict) -> None:
+        self.layouts.pop((layout, fingerprint), None)
+        self.layouts[layout, fingerprint] = positions
+        while len(self.layouts) > self.size:
+            del self.layouts[next(iter(self.layouts))]
+
+    def clear(self) -> None:
+        self.layouts = {}
+
+
+# Lays out a graph with a multilevel force-directed layout
+# Every connected component is laid out on its own, then the components are packed in rows from the biggest to the
+# smallest, so unconnected graph nodes don't drift away from the rest of the graph. Within a component the graph is
+# coarsened by repeatedly merging graph nodes along a maximal matching of heavy edges, until it is small enough. The
+# coarsest graph is laid out with many iterations of a force-directed layout, then every level is refined from the
+# positions of the coarser level with few iterations. Forces are computed on NumPy arrays, on big levels with the
+# repulsion of distant graph nodes approximated by grid cells (see _repulsion).
+# @param graph: The graph to lay out, edge directions are ignored
+# @param iterations: The number of iterations on the coarsest level, finer levels use fewer
+# @param seed: The seed of the random initial positions
+# @return: A dictionary mapping graph nodes to positions in [-1, 1] x [-1, 1]
+def multilevel_layout(graph: nx.DiGraph, iterations=100, seed=0) -> dict:
+    if graph.number_of_nodes() == 0:
+        return {}
+    rng = np.random.default_rng(seed)
+    components = sorted((list(component) for component in nx.connected_components(graph.to_undirected(as_view=True))),
+                        key=len, reverse=True)
+    boxes = []
+    for component in components:
+        positions = _multilevel_positions(graph.subgraph(component), iterations, rng)
+        positions -= positions.min(axis=0)
+        boxes.append(positions)
+    # Pack the components in rows of about the width of a square holding all of them, one unit apart
+    row_width = np.sqrt(sum((box.max(axis=0) + 1).prod() for box in boxes))
+    x = y = row_height = 0.0
+    for box in boxes:
+        width, height = box.max(axis=0) + 1
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0.0, y + row_height, 0.0
+        box += (x, y)
+        x += width
+        row_height = max(row_height, height)
+    nodes = [node for component in components for node in component]
+    return dict(zip(nodes, _rescale(np.concatenate(boxes))))
+
+
+# Lays out a connected graph with the multilevel force-directed layout of multilevel_layout
+# @return: The positions of the graph nodes in the order of the graph, at about unit distance
+def _multilevel_positions(graph: nx.Graph, iterations: int, rng) -> np.ndarray:
+    nodes = list(graph)
+    if len(nodes) <= 2:
+        return np.array([[0.0, 0.0], [1.0, 0.0]])[:len(nodes)]
+    index = {node: position for position, node in enumerate(nodes)}
+    pairs = {}
+    for source, target in graph.edges():
+        if source != target:
+            pair = (min(index[source], index[target]), max(index[source], index[target]))
+            pairs[pair] = pairs.get(pair, 0) + 1
+    pair_array = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    levels = [(pair_array[:, 0], pair_array[:, 1], np.array(list(pairs.values()), dtype=float),
+               np.ones(len(nodes)))]
+    parents = []
+    while len(levels[-1][3]) > COARSEST_SIZE:
+        parent, coarse_level = _coarsen(*levels[-1], rng)
+        if len(coarse_level[3]) > COARSENING_RATIO * len(levels[-1][3]):
+            break
+        parents.append(parent)
+        levels.append(coarse_level)
+
+    sources, targets, edge_weights, node_weights = levels[-1]
+    positions = rng.uniform(-1, 1, (len(node_weights), 2)) * np.sqrt(node_weights.sum())
+    positions = _force_directed(positions, sources, targets, edge_weights, node_weights, iterations,
+                                np.sqrt(node_weights.sum()) / 10)
+    for depth in range(len(parents) - 1, -1, -1):
+        sources, targets, edge_weights, node_weights = levels[depth]
+        # Merged graph nodes start at the position of the graph node they were merged into, slightly apart
+        positions = positions[parents[depth]] + rng.uniform(-0.1, 0.1, (len(node_weights), 2))
+        positions = _force_directed(positions, sources, targets, edge_weights, node_weights,
+                                    max(10, iterations // (len(parents) - depth + 1)), 1.0)
+    return positions
+
+
+# Merges the graph nodes of a level along a maximal matching that prefers heavy edges
+# Graph nodes left without an unmerged neighbor join the coarse graph node of a neighbor, so stars (e.g. topics with
+# many subscribers) collapse as well.
+# @return: The graph node of the coarse level each graph node was merged into and the coarse level as (sources,
+#          targets, edge weights, node weights)
+def _coarsen(sources, targets, edge_weights, node_weights, rng) -> (np.ndarray, tuple):
+    adjacency = [[] for _ in range(len(node_weights))]
+    for source, target, weight in zip(sources.tolist(), targets.tolist(), edge_weights.tolist()):
+        adjacency[source].append((weight, target))
+        adjacency[target].append((weight, source))
+    weights = node_weights.tolist()
+    parent = [-1] * len(weights)
+    coarse_count = 0
+    for node in rng.permutation(len(weights)).tolist():
+        if parent[node] != -1:
+            continue
+        # Heavy edges between light graph nodes are merged first, so the coarse graph nodes stay balanced
+        candidates = [(weight / (weights[node] + weights[neighbor]), neighbor)
+                      for weight, neighbor in adjacency[node] if parent[neighbor] == -1]
+        if candidates:
+            parent[node] = parent[max(candidates)[1]] = coarse_count
+        elif adjacency[node]:
+            parent[node] = parent[max(adjacency[node])[1]]
+            continue
+        else:
+            parent[node] = coarse_count
+        coarse_count += 1
+    parent = np.array(parent, dtype=np.int64)
+    coarse_pairs = {}
+    for source, target, weight in zip(parent[sources].tolist(), parent[targets].tolist(), edge_weights.tolist()):
+        if source != target:
+            pair = (min(source, target), max(source, target))
+            coarse_pairs[pair] = coarse_pairs.get(pair, 0) + weight
+    pair_array = np.array(list(coarse_pairs), dtype=np.int64).reshape(-1, 2)
+    coarse_node_weights = np.bincount(parent, weights=node_weights, minlength=coarse_count)
+    return parent, (pair_array[:, 0], pair_array[:, 1], np.array(list(coarse_pairs.values()), dtype=float),
+                    coarse_node_weights)
+
+
+# Moves graph nodes by a Fruchterman-Reingold force model with an ideal edge length of 1
+# Graph nodes repel each other in proportion to the product of their node weights, edges pull their graph nodes
+# together in proportion to their edge weights and a weak gravity (see GRAVITY) keeps the graph compact. The step size
+# starts at temperature and cools down linearly.
+# @return: The new positions
+def _force_directed(positions, sources, targets, edge_weights, node_weights, iterations, temperature) -> np.ndarray:
+    positions = positions.copy()
+    for iteration in range(iterations):
+        displacement = _repulsion(positions, node_weights)
+        delta = positions[sources] - positions[targets]
+        force = delta * (np.sqrt((delta ** 2).sum(axis=1)) * edge_weights)[:, None]
+        displacement -= _sum_at(sources, force, len(positions))
+        displacement += _sum_at(targets, force, len(positions))
+        displacement -= GRAVITY * positions * node_weights[:, None]
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        step = temperature * (1 - iteration / iterations)
+        positions += displacement * (np.minimum(length, step) / length)[:, None]
+    return positions
+
+
+# Computes the repulsive forces of all graph nodes on each other
+# Small levels are computed exactly. On big levels the graph nodes are sorted into the cells of a grid with about two
+# graph nodes per cell. Graph nodes in the same or neighboring cells repel each other directly, the repulsion of all
+# other cells is computed for all cells at once as a convolution of the cell weights with the force between cells, so
+# a level takes time about linear in its number of graph nodes.
+def _repulsion(positions: np.ndarray, node_weights: np.ndarray) -> np.ndarray:
+    if len(positions) <= EXACT_REPULSION_SIZE:
+        delta = positions[:, None, :] - positions[None, :, :]
+        distance2 = np.maximum((delta ** 2).sum(axis=2), 1e-9)
+        return (delta * (np.outer(node_weights, node_weights) / distance2)[:, :, None]).sum(axis=1)
+    from scipy.signal import fftconvolve  # Only needed for big graphs
+    from scipy.spatial import cKDTree
+    grid = int(np.clip(np.sqrt(len(positions) / 2), 4, 256))
+    low = positions.min(axis=0)
+    cell_size = max((positions.max(axis=0) - low).max() / grid, 1e-9)
+    cells = np.minimum(((positions - low) / cell_size).astype(np.int64), grid - 1)
+    masses = np.bincount(cells[:, 0] * grid + cells[:, 1], weights=node_weights, minlength=grid * grid)
+    offsets = np.arange(1 - grid, grid) * cell_size
+    offset_x, offset_y = np.meshgrid(offsets, offsets, indexing='ij')
+    distance2 = offset_x ** 2 + offset_y ** 2
+    distance2[grid - 2:grid + 1, grid - 2:grid + 1] = np.inf  # Neighboring cells repel directly
+    displacement = np.stack([fftconvolve(masses.reshape(grid, grid), offset / distance2, mode='same')
+                             [cells[:, 0], cells[:, 1]] for offset in (offset_x, offset_y)], axis=1)
+    displacement *= node_weights[:, None]
+    # Pairs in neighboring cells are at most 2 * sqrt(2) cells apart
+    near = cKDTree(positions).query_pairs(2 * np.sqrt(2) * cell_size, output_type='ndarray')
+    near = near[(np.abs(cells[near[:, 0]] - cells[near[:, 1]]) <= 1).all(axis=1)]
+    delta = positions[near[:, 0]] - positions[near[:, 1]]
+    distance2 = np.maximum((delta ** 2).sum(axis=1), 1e-9)
+    repulsion = delta * (node_weights[near[:, 0]] * node_weights[near[:, 1]] / distance2)[:, None]
+    displacement += _sum_at(near[:, 0], repulsion, len(positions))
+    displacement -= _sum_at(near[:, 1], repulsion, len(positions))
+    return displacement
+
+
+# Sums two-dimensional vectors by the index they belong to, like np.add.at but much faster
+def _sum_at(indices: np.ndarray, vectors: np.ndarray, length: int) -> np.ndarray:
+    return np.stack([np.bincount(indices, weights=vectors[:, 0], minlength=length),
+                     np.bincount(indices, weights=vectors[:, 1], minlength=length)], axis=1)
+
+
+# Centers positions and scales them into [-1, 1] x [-1, 1], keeping the aspect ratio
+def _rescale(positions: np.ndarray) -> np.ndarray:
+    positions = positions - positions.mean(axis=0)
+    extent = np.abs(positions).max()
+    return positions / extent if extent > 0 else positions
+
+
+# Lays out a graph in clusters of the enclaves of its graph nodes
+# Every enclave is laid out on its own with multilevel_layout, in a disk whose area grows with its number of graph
+# nodes. The disks are then placed by a force-directed layout of the enclaves, where enclaves with many edges between
+# them attract each other and big enclaves push each other away, and overlapping disks are moved apart.
+# @param graph: The graph to lay out, its graph nodes need an enclave attribute
+# @param seed: The seed of the random initial positions
+# @return: A dictionary mapping graph nodes to positions in [-1, 1] x [-1, 1]
+def enclave_layout(graph: nx.DiGraph, seed=0) -> dict:
+    enclaves = {}
+    for name, enclave in graph.nodes(data='enclave'):
+        enclaves.setdefault(enclave, []).append(name)
+    if len(enclaves) < 2:
+        return multilevel_layout(graph, seed=seed)
+    enclave_index = {enclave: position for position, enclave in enumerate(enclaves)}
+    radii = np.sqrt(np.array([len(names) for names in enclaves.values()], dtype=float))
+    pairs = {}
+    for source, target in graph.edges():
+        source, target = enclave_index[graph.nodes[source]['enclave']], enclave_index[graph.nodes[target]['enclave']]
+        if source != target:
+            pair = (min(source, target), max(source, target))
+            pairs[pair] = pairs.get(pair, 0) + 1
+    pair_array = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+    rng = np.random.default_rng(seed)
+    area = np.sqrt(graph.number_of_nodes())
+    centers = _force_directed(rng.uniform(-1, 1, (len(enclaves), 2)) * area, pair_array[:, 0], pair_array[:, 1],
+                              np.array(list(pairs.values()), dtype=float), radii ** 2, 100, area / 10)
+    # The laid out enclaves fill squares around their centers, which fit in disks of sqrt(2) times their radius
+    required = (radii[:, None] + radii[None, :]) * 1.5
+    for _ in range(100):
+        delta = centers[:, None, :] - centers[None, :, :]
+        distances = np.maximum(np.sqrt((delta ** 2).sum(axis=2)), 1e-9)
+        overlaps = np.maximum(required - distances, 0)
+        np.fill_diagonal(overlaps, 0)
+        if not overlaps.any():
+            break
+        centers += (delta * (overlaps / distances / 2)[:, :, None]).sum(axis=1)
+
+    positions = {}
+    for (enclave, names), center, radius in zip(enclaves.items(), centers, radii):
+        for name, position in multilevel_layout(graph.subgraph(names), seed=seed).items():
+            positions[name] = center + position * radius
+    names = list(positions)
+    return dict(zip(names, _rescale(np.array([positions[name] for name in names]))))
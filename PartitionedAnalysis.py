@@ -0,0 +1,191 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
+import networkx as nx
+import Instrumentation
+import PrivacyReport
+import Reachability
+import ROSGraph
+
+
+# Analyzes the privacy graph of a ROSGraph partition by partition, one partition per enclave
+# A partition holds the ROS nodes of an enclave, the transmitters they are connected to and the edges between them.
+# Every edge connects a ROS node and a transmitter, so every edge belongs to exactly one partition and paths only cross
+# enclaves through boundary transmitters, which are connected to ROS nodes of more than one enclave.
+# Each partition is summarized independently, possibly in a worker process: for every source and boundary transmitter
+# of the partition, the leaks and boundary transmitters it reaches within the partition, with a path to each. The
+# summaries are then stitched together by a search over the boundary transmitters. Summaries are cached by a
+# fingerprint of their partition, so after a change of the policies or the categorization only the partitions that
+# changed are summarized again.
+class PartitionedAnalysis:
+    # @param workers: The number of processes summarizing partitions, 1 summarizes them in this process, 0 uses all
+    #                 CPU cores
+    def __init__(self, workers=1):
+        self.workers = workers
+        self.summaries = {}  # Enclave -> (fingerprint of the partition, summary of the partition)
+        self.recomputed = []  # Enclaves whose partitions were summarized by the last analysis
+
+    # Determines the connected source and leak pairs of a ROSGraph with one witness path each
+    # The pairs are the same as those of ROSGraph.is_privacy_vulnerable, the witness paths may be longer since they
+    # are shortest only within each partition.
+    # @param graph: The ROSGraph to analyze, it is not changed
+    # @return: A PrivacyReport with one witness path per pair
+    def analyze(self, graph: ROSGraph.ROSGraph) -> PrivacyReport.PrivacyReport:
+        with Instrumentation.phase('partitioned_analysis'):
+            base_graph = graph.get_base_privacy_graph()
+            partitions, boundary = partition_graph(base_graph)
+            pending = {}
+            for enclave, partition in partitions.items():
+                fingerprint = partition_fingerprint(partition, boundary)
+                cached = self.summaries.get(enclave)
+                if cached is None or cached[0] != fingerprint:
+                    pending[enclave] = fingerprint
+            for enclave in list(self.summaries):
+                if enclave not in partitions:
+                    del self.summaries[enclave]
+            tasks = [_partition_task(partitions[enclave], boundary) for enclave in pending]
+            if self.workers == 1 or len(tasks) < 2:
+                results = [summarize_partition(*task) for task in tasks]
+            else:
+                workers = min(self.workers or os.cpu_count(), len(tasks))
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(_summarize_partition_in_worker, tasks))
+            for (enclave, fingerprint), summary in zip(pending.items(), results):
+                self.summaries[enclave] = (fingerprint, summary)
+            self.recomputed = list(pending)
+            Instrumentation.count('partitions_summarized', len(pending))
+            return self._stitch(graph, base_graph)
+
+    # Combines the summaries of the partitions into a PrivacyReport
+    def _stitch(self, graph: ROSGraph.ROSGraph, base_graph: nx.DiGraph) -> PrivacyReport.PrivacyReport:
+        entry_partitions = {}  # Source or boundary transmitter -> enclaves whose summaries start in it
+        for enclave, (_, summary) in self.summaries.items():
+            for entry in summary:
+                entry_partitions.setdefault(entry, []).append(enclave)
+        rank = {name: position for position, name in enumerate(base_graph)}
+        report = PrivacyReport.PrivacyReport(graph.get_ros_graph())
+        sources = [name for name, attributes in base_graph.nodes(data=True)
+                   if attributes['node_type'] == 'node' and attributes['privacy_type'] == 'source']
+        for source in sources:
+            # Reached entry -> (previous entry, path from the previous entry), the source has no previous entry
+            previous = {source: (None, [source])}
+            reached_leaks = {}  # Leak -> (entry, path from the entry)
+            queue = deque([source])
+            while queue:
+                entry = queue.popleft()
+                for enclave in entry_partitions.get(entry, ()):
+                    entry_summary = self.summaries[enclave][1][entry]
+                    for leak, path in entry_summary['leaks'].items():
+                        reached_leaks.setdefault(leak, (entry, path))
+                    for exit_transmitter, path in entry_summary['exits'].items():
+                        if exit_transmitter not in previous:
+                            previous[exit_transmitter] = (entry, path)
+                            queue.append(exit_transmitter)
+            for leak in sorted(reached_leaks, key=rank.get):
+                entry, path = reached_leaks[leak]
+                report.add_path(_erase_loops(_path_to(previous, entry) + path[1:]))
+        return report
+
+
+# Splits a privacy graph into one partition per enclave
+# @param graph: A privacy graph whose edges all connect a ROS node and a transmitter
+# @return: A dictionary mapping enclaves to partitions as (graph nodes with their attributes, edges) and the set of
+#          boundary transmitters
+def partition_graph(graph: nx.DiGraph) -> (dict, set):
+    partitions = {}
+    transmitter_enclaves = {}
+    for name, attributes in graph.nodes(data=True):
+        if attributes['node_type'] != 'node':
+            continue
+        nodes, edges = partitions.setdefault(attributes['enclave'], ({}, []))
+        nodes[name] = attributes
+        for transmitter in graph.successors(name):
+            nodes[transmitter] = graph.nodes[transmitter]
+            edges.append((name, transmitter))
+            transmitter_enclaves.setdefault(transmitter, set()).add(attributes['enclave'])
+        for transmitter in graph.predecessors(name):
+            nodes[transmitter] = graph.nodes[transmitter]
+            edges.append((transmitter, name))
+            transmitter_enclaves.setdefault(transmitter, set()).add(attributes['enclave'])
+    boundary = {transmitter for transmitter, enclaves in transmitter_enclaves.items() if len(enclaves) > 1}
+    return partitions, boundary
+
+
+# Computes a fingerprint of a partition, which changes with its graph nodes, their types, its edges and its boundary
+# transmitters, so a summary of the partition can be reused as long as the fingerprint is the same
+def partition_fingerprint(partition: tuple, boundary: set) -> str:
+    nodes, edges = partition
+    fingerprint = hashlib.sha256()
+    for name in sorted(nodes):
+        fingerprint.update(f"{name}\0{nodes[name]['node_type']}\0{nodes[name]['privacy_type']}\0"
+                           f"{name in boundary}\n".encode())
+    fingerprint.update(b'\1')
+    for source, target in sorted(edges):
+        fingerprint.update(f'{source}\0{target}\n'.encode())
+    return fingerprint.hexdigest()
+
+
+# Builds the arguments of summarize_partition for a partition, which can be passed to a worker process
+def _partition_task(partition: tuple, boundary: set) -> (list, list, list, list, list):
+    nodes, edges = partition
+    sources = [name for name, attributes in nodes.items()
+               if attributes['node_type'] == 'node' and attributes['privacy_type'] == 'source']
+    leaks = [name for name, attributes in nodes.items()
+             if attributes['node_type'] == 'node' and attributes['privacy_type'] in ['leak', 'default']]
+    return list(nodes), edges, sources, [name for name in nodes if name in boundary], leaks
+
+
+# Summarizes a partition: the leaks and boundary transmitters each entry (source or boundary transmitter) reaches
+# within the partition, on paths that end at the first leak
+# @param nodes: The graph nodes of the partition
+# @param edges: The edges of the partition
+# @param sources: The sources of the partition
+# @param boundary: The boundary transmitters of the partition
+# @param leaks: The leaks of the partition (leak and default ROS nodes)
+# @return: A dictionary mapping each entry to {'leaks': {leak: path}, 'exits': {boundary transmitter: path}} with one
+#          shortest path from the entry to each
+def summarize_partition(nodes: list, edges: list, sources: list, boundary: list, leaks: list) -> dict:
+    graph = nx.DiGraph()
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from(edges)
+    predecessors, reached_leaks = Reachability.multi_source_bfs(graph, sources + boundary, leaks)
+    boundary = set(boundary)
+    summary = {}
+    for entry, entry_predecessors in predecessors.items():
+        summary[entry] = {'leaks': {leak: Reachability.witness_path(entry_predecessors, leak)
+                                    for leak in reached_leaks[entry]},
+                          'exits': {node: Reachability.witness_path(entry_predecessors, node)
+                                    for node in entry_predecessors if node in boundary and node != entry}}
+    return summary
+
+
+def _summarize_partition_in_worker(task: tuple) -> dict:
+    return summarize_partition(*task)
+
+
+# Rebuilds the path from the source to a reached entry from the entries recorded while stitching
+def _path_to(previous: dict, entry) -> list:
+    segments = []
+    while entry is not None:
+        entry, segment = previous[entry]
+        segments.append(segment)
+    path = list(segments.pop())
+    for segment in reversed(segments):
+        path += segment[1:]
+    return path
+
+
+# Removes the cycles of a path, the paths of different partitions can pass through the same boundary transmitter
+def _erase_loops(path: list) -> list:
+    erased = []
+    positions = {}
+    for node in path:
+        if node in positions:
+            for removed in erased[positions[node] + 1:]:
+                del positions[removed]
+            del erased[positions[node] + 1:]
+        else:
+            positions[node] = len(erased)
+            erased.append(node)
+    return erased
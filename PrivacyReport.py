@@ -0,0 +1,78 @@
+import networkx as nx
+
+
+# The result of a privacy analysis of a ROSGraph: the connected source and leak pairs, the witness paths proving each
+# connection and the graph nodes and edges on these paths
+# Witness paths are added one by one as they are found, graph nodes and edges on them are deduplicated while adding.
+class PrivacyReport:
+    # @param ros_graph: The ROS graph the vulnerable edges are looked up in
+    # @param paths_per_pair: The maximum number of witness paths stored per pair, None stores all paths
+    def __init__(self, ros_graph: nx.DiGraph, paths_per_pair=1):
+        self.ros_graph = ros_graph
+        self.paths_per_pair = paths_per_pair
+        self.paths = {}  # (source, leak) -> witness paths in the order they were found
+        self.truncated = set()  # Pairs for which more witness paths were found than stored
+        self._path_elements = {}  # Graph nodes on witness paths in the order they were found
+        self._edges = {}  # Edges of the ROS graph between consecutive graph nodes of witness paths, in both directions
+
+    def __bool__(self) -> bool:
+        return self.is_vulnerable()
+
+    # Adds a source and leak pair without witness paths yet
+    def add_pair(self, source, leak) -> None:
+        self.paths.setdefault((source, leak), [])
+
+    # Adds a witness path for the pair of its first and last graph node
+    # @return: Whether the path was stored, False if the pair already has paths_per_pair paths
+    def add_path(self, path: list) -> bool:
+        pair_paths = self.paths.setdefault((path[0], path[-1]), [])
+        if self.paths_per_pair is not None and len(pair_paths) >= self.paths_per_pair:
+            self.truncated.add((path[0], path[-1]))
+            return False
+        pair_paths.append(path)
+        for index, element in enumerate(path):
+            self._path_elements[element] = None
+            if index != 0:
+                previous_element = path[index - 1]
+                if self.ros_graph.has_edge(previous_element, element):
+                    self._edges[previous_element, element] = None
+                if self.ros_graph.has_edge(element, previous_element):
+                    self._edges[element, previous_element] = None
+        return True
+
+    # Returns whether any source reaches a leak
+    def is_vulnerable(self) -> bool:
+        return len(self.paths) > 0
+
+    # Returns the connected (source, leak) pairs
+    def pairs(self) -> list:
+        return list(self.paths)
+
+    # Yields all stored witness paths, pair by pair
+    def iter_paths(self):
+        for pair_paths in self.paths.values():
+            yield from pair_paths
+
+    # Returns all graph nodes on witness paths in the order they were found
+    def path_elements(self) -> list:
+        return list(self._path_elements)
+
+    # Returns all edges of the ROS graph on witness paths (in both directions) in the order they were found
+    def edges(self) -> list:
+        return list(self._edges)
+
+    # Returns a one line summary of the report
+    def summary(self) -> str:
+        if not self.is_vulnerable():
+            return 'No Vulnerable Paths'
+        path_count = sum(len(pair_paths) for pair_paths in self.paths.values())
+        return (f'{path_count} vulnerable path(s) between {len(self.paths)} source/leak pair(s), '
+                f'{len(self._path_elements)} graph nodes and {len(self._edges)} edges involved')
+
+    # Returns the report as a dictionary that can be written as JSON
+    def to_dict(self) -> dict:
+        return {'vulnerable': self.is_vulnerable(), 'paths_per_pair': self.paths_per_pair,
+                'pairs': [{'source': source, 'leak': leak, 'paths': pair_paths,
+                           'truncated': (source, leak) in self.truncated}
+                          for (source, leak), pair_paths in self.paths.items()],
+                'path_elements': self.path_elements(), 'edges': [list(edge) for edge in self.edges()]}
@@ -1,5 +1,38 @@
+import itertools
+import json
+import os
 import networkx as nx
-import matplotlib.pyplot as plt
+import Categorization
+import Diagnostics
+import GraphCore
+import Instrumentation
+import Layout
+import PrivacyReport
+import Reachability
+
+
+# Privacy types of graph nodes that are not part of the privacy graph
+PRIVACY_REMOVED_TYPES = ['sanitizer', 'mundane']
+# Names of the standard set of connections every node has: the /rosout topic for logging, topic /parameter_events and
+# services /describe_parameters, /get_parameters, /get_parameter_types, /list_parameters, /set_parameters,
+# /set_parameters_atomically for parameter management and topic /clock for time management
+STANDARD_ELEMENTS = ['rosout', 'parameter_events', 'describe_parameters', 'get_parameters', 'get_parameter_types',
+                     'list_parameters', 'set_parameters', 'set_parameters_atomically', 'clock']
+# Names of the services of lifecycle nodes, which can be added to the standard elements
+LIFECYCLE_ELEMENTS = ['change_state', 'get_available_states', 'get_available_transitions', 'get_state',
+                      'get_transition_graph']
+# Version of the file format written by ROSGraph.write_graph
+COMPILED_GRAPH_FORMAT = 2
+# Edges created for a connection per transmission type and node competence as (edge leaves the node, role), in the
+# order they are created by add_publisher, add_subscriber, add_server, add_client, add_executor and add_caller
+CONNECTION_EDGES = {
+    ('topic', 'publish'): [(True, 'publisher')],
+    ('topic', 'subscribe'): [(False, 'subscriber')],
+    ('service', 'reply'): [(True, 'server'), (False, 'server')],
+    ('service', 'request'): [(False, 'client'), (True, 'client')],
+    ('action', 'execute'): [(True, 'executor'), (False, 'executor')],
+    ('action', 'call'): [(False, 'caller'), (True, 'caller')],
+}
 
 
 # A class representing the data flow graph of a ROS system with nodes representing ROS nodes, topics, services and
@@ -8,54 +41,142 @@ import matplotlib.pyplot as plt
 # the node or the type of communication represented by the edge
 class ROSGraph:
     # Initializes the ROSGraph
-    # @param nx_graph: An existing networkx graph to be used as the base for the ROSGraph
-    def __init__(self, graph_path=None, include_standard_elements=False):
-        print('>>>>>>>>>>Initializing ROSGraph<<<<<<<<<<')
+    # @param graph_path: A compiled graph file written by write_graph to be used as the base for the ROSGraph
+    # @param standard_elements: The names (or trailing name segments) of the standard elements removed from the graph
+    #                           if include_standard_elements is False, defaults to STANDARD_ELEMENTS
+    def __init__(self, graph_path=None, include_standard_elements=False, standard_elements=None):
+        Diagnostics.debug('Initializing ROSGraph')
         self.include_standard_elements = include_standard_elements
+        self.standard_elements = [element.strip('/') for element in
+                                  (STANDARD_ELEMENTS if standard_elements is None else standard_elements)]
+        # Last name segment -> names of all graph nodes ending in it, used to find standard elements
+        self._basename_index = {}
+        # (node_type, privacy_type) -> names of all graph nodes of the ROS graph with these types
+        self._type_index = {}
+        # Name -> insertion position of all graph nodes of the ROS graph, used to return indexed nodes in graph order
+        self._node_positions = {}
+        self._position_counter = itertools.count()
         self.remove_non_descendants = True
         self.vulnerable_path_elements = []
         self.vulnerable_edges = []
+        self.privacy_report = None  # The PrivacyReport of the last is_privacy_vulnerable call
         self.nx_graph = nx.DiGraph()
-        # TODO: Implement reading of graph from file
-        #if graph_path is not None:
-            #self.read_graph(graph_path)
         self.privacy_graph = None  # Only access through get_privacy_graph()
+        # Allowed edges between all graph nodes that are not removed by their privacy type, kept up to date by every
+        # change of the ROS graph. The privacy graph is only rebuilt from it if a change affected its structure.
+        self._base_privacy_graph = nx.DiGraph()
+        self._privacy_graph_dirty = True
+        # Compact integer-indexed snapshot of the privacy graph used by the analysis, built with the privacy graph
+        self._privacy_core = None  # Only access through get_privacy_core()
+        # Reachability of the sources in the base privacy graph, kept up to date by apply_categorization_delta and
+        # dropped by every other change
+        self._reachability = None
+        # Reachability indexes of the base privacy graph, following all edges and ending paths at leaks. Both are
+        # built on demand, the first is only dropped by structural changes, the second by every change.
+        self._reachability_index = None
+        self._leak_reachability_index = None
+        # Positions of the layouts drawn so far by layout and graph fingerprint, so redrawing an unchanged graph
+        # does not lay it out again
+        self._layout_cache = Layout.LayoutCache()
+        if graph_path is not None and not self.read_graph(graph_path):
+            Diagnostics.warning(f'Could not read graph from {graph_path}', path=graph_path)
         self.update_privacy_graph()
-        print('>>>>>>>>>>Finished Initializing ROSGraph<<<<<<<<<<')
+        Diagnostics.debug('Finished Initializing ROSGraph')
 
     # Adds a graph node representing a ROS node to the graph
     # @param node_name: Combination <namespace><name> of the node to add
     # @param enclave: The enclave the node belongs to
-    # @param privacy_type: The privacy type of the node (default, source, leak, conduit, sanitizer)
-    def add_node_node(self, node_name: str, enclave: str, privacy_type='default'):
-        self.nx_graph.add_node(node_name, node_type='node', enclave=enclave, privacy_type=privacy_type)
+    # @param privacy_type: The privacy type of the node (default, source, leak, conduit, sanitizer), None keeps the
+    #                     privacy type of an existing node and uses default for a new one
+    def add_node_node(self, node_name: str, enclave: str, privacy_type=None):
+        self._add_graph_node(node_name, node_type='node', enclave=enclave, privacy_type=privacy_type)
 
     # Adds a graph node representing a ROS topic to the graph
     # @param topic_name: The name of the topic to add
     # @param enclave: The enclave the topic belongs to
     # @param data_type: The type of the topic to add
-    # @param privacy_type: The privacy type of the topic (default, sensitive, mundane)
-    def add_topic_node(self, topic_name, enclave, data_type=None, privacy_type='default'):
-        self.nx_graph.add_node(topic_name, node_type='topic', data_type=data_type, enclave=enclave,
-                               privacy_type=privacy_type)
+    # @param privacy_type: The privacy type of the topic (default, sensitive, mundane), None keeps the privacy type of
+    #                     an existing topic and uses default for a new one
+    def add_topic_node(self, topic_name, enclave, data_type=None, privacy_type=None):
+        self._add_graph_node(topic_name, node_type='topic', data_type=data_type, enclave=enclave,
+                             privacy_type=privacy_type)
 
     # Adds a graph node representing a ROS service to the graph
     # @param service_name: The name of the service to add
     # @param enclave: The enclave the service belongs to
     # @param data_type: The type of the service to add
-    # @param privacy_type: The privacy type of the service (default, sensitive, mundane)
-    def add_service_node(self, service_name, enclave, data_type=None, privacy_type='default'):
-        self.nx_graph.add_node(service_name, node_type='service', data_type=data_type, enclave=enclave,
-                               privacy_type=privacy_type)
+    # @param privacy_type: The privacy type of the service (default, sensitive, mundane), None keeps the privacy type of
+    #                     an existing service and uses default for a new one
+    def add_service_node(self, service_name, enclave, data_type=None, privacy_type=None):
+        self._add_graph_node(service_name, node_type='service', data_type=data_type, enclave=enclave,
+                             privacy_type=privacy_type)
 
     # Adds a graph node representing a ROS action to the graph
     # @param action_name: The name of the action to add
     # @param enclave: The enclave the action belongs to
     # @param data_type: The type of the action to add
-    # @param privacy_type: The privacy type of the action (default, sensitive, mundane)
-    def add_action_node(self, action_name, enclave, data_type=None, privacy_type='default'):
-        self.nx_graph.add_node(action_name, node_type='action', data_type=data_type, enclave=enclave,
-                               privacy_type=privacy_type)
+    # @param privacy_type: The privacy type of the action (default, sensitive, mundane), None keeps the privacy type of
+    #                     an existing action and uses default for a new one
+    def add_action_node(self, action_name, enclave, data_type=None, privacy_type=None):
+        self._add_graph_node(action_name, node_type='action', data_type=data_type, enclave=enclave,
+                             privacy_type=privacy_type)
+
+    # Adds a graph node with the given attributes to the ROS graph or updates the attributes of an existing one
+    # An existing graph node keeps its privacy type if the given privacy type is None.
+    # @param name: The name of the graph node
+    # @param attributes: The attributes of the graph node (node_type, enclave, privacy_type, ...)
+    def _add_graph_node(self, name, **attributes) -> None:
+        if self.nx_graph.has_node(name):
+            previous_attributes = self.nx_graph.nodes[name]
+            previous_privacy_type = previous_attributes['privacy_type']
+            previous_types = (previous_attributes['node_type'], previous_privacy_type)
+            if attributes['privacy_type'] is None:
+                attributes['privacy_type'] = previous_privacy_type
+            self.nx_graph.add_node(name, **attributes)
+            self._reindex_node_types(name, previous_types)
+        else:
+            previous_privacy_type = None
+            if attributes['privacy_type'] is None:
+                attributes['privacy_type'] = 'default'
+            self.nx_graph.add_node(name, **attributes)
+            self._index_node(name)
+        self._sync_privacy_node(name, previous_privacy_type)
+        self._reachability = None
+
+    # Adds a graph node of the ROS graph to the indexes of last name segments and of node and privacy types
+    def _index_node(self, name) -> None:
+        if '/' in name:
+            self._basename_index.setdefault(name.rsplit('/', 1)[1], {})[name] = None
+        attributes = self.nx_graph.nodes[name]
+        self._type_index.setdefault((attributes['node_type'], attributes['privacy_type']), {})[name] = None
+        self._node_positions[name] = next(self._position_counter)
+
+    # Removes a graph node of the ROS graph from the indexes, before it is removed from the graph
+    def _unindex_node(self, name) -> None:
+        if '/' in name:
+            basename = name.rsplit('/', 1)[1]
+            self._basename_index[basename].pop(name, None)
+            if not self._basename_index[basename]:
+                del self._basename_index[basename]
+        attributes = self.nx_graph.nodes[name]
+        self._remove_from_type_index(name, (attributes['node_type'], attributes['privacy_type']))
+        del self._node_positions[name]
+
+    # Moves a graph node of the ROS graph to the index entry of its current node and privacy type
+    # @param name: The name of the graph node
+    # @param previous_types: The node type and privacy type of the graph node before the change
+    def _reindex_node_types(self, name, previous_types) -> None:
+        attributes = self.nx_graph.nodes[name]
+        types = (attributes['node_type'], attributes['privacy_type'])
+        if types != previous_types:
+            self._remove_from_type_index(name, previous_types)
+            self._type_index.setdefault(types, {})[name] = None
+
+    # Removes a graph node from the index entry of the given node and privacy type
+    def _remove_from_type_index(self, name, types) -> None:
+        self._type_index[types].pop(name, None)
+        if not self._type_index[types]:
+            del self._type_index[types]
 
     # Add a graph edge representing the subscription of a node to a topic to the graph
     # @param node_name: The name of the node subscribing to the topic in the form <namespace><name>
@@ -138,6 +259,7 @@ class ROSGraph:
                 self.nx_graph.edges[source, target]['allowed'] = True
         else:
             self.nx_graph.add_edge(source, target, role=None, allowed=True)
+        self._sync_privacy_edge(source, target)
 
     # Add a graph edge representing a denied connection between a node and a mode of communication or, if the edge
     # already exists, set the allowed attribute to False
@@ -148,6 +270,7 @@ class ROSGraph:
             self.nx_graph.edges[source, target]['allowed'] = False
         else:
             self.nx_graph.add_edge(source, target, role=None, allowed=False)
+        self._sync_privacy_edge(source, target)
 
     # Change the allowed attribute of an existing edge to True. This is only possible if a DENY rule was changed to
     # ALLOW by the user. Generally ALLOW rules do not overwrite DENY rules.
@@ -156,8 +279,9 @@ class ROSGraph:
     def change_deny_to_allow(self, source, target):
         if self.nx_graph.has_edge(source, target):
             self.nx_graph.edges[source, target]['allowed'] = True
+            self._sync_privacy_edge(source, target)
         else:
-            print(f'>>>>>>>>>>Edge {source} -> {target} does not exist<<<<<<<<<<')
+            Diagnostics.warning(f'Edge {source} -> {target} does not exist', edge=[source, target])
 
     # Add a graph edge representing a connection between a node and a mode of communication with the given allowed or,
     # if the edge already exists, set the allowed attribute to the given value
@@ -171,57 +295,237 @@ class ROSGraph:
         elif allowed is None:
             pass
         else:
-            print(f'>>>>>>>>>>Allowed value {allowed} not recognised<<<<<<<<<<')
+            Diagnostics.warning(f'Allowed value {allowed} not recognised')
 
     # Set the privacy type for a ros node
     # @param node_name: The name of the node to set the privacy type for
     # @param privacy_type: The privacy type to set for the node
     def set_privacy_type_for_node(self, node_name, privacy_type) -> None:
+        if self._set_privacy_type_for_node(node_name, privacy_type):
+            self._reachability = None
+
+    # Sets the privacy type for a ros node without dropping the reachability of the sources
+    # @return: Whether the privacy type was set
+    def _set_privacy_type_for_node(self, node_name, privacy_type) -> bool:
         node_privacy_types = ['default', 'source', 'leak', 'conduit', 'sanitizer']
         if self.nx_graph.has_node(node_name):
             if self.nx_graph.nodes[node_name]['node_type'] == 'node':
                 if privacy_type in node_privacy_types:
+                    previous_privacy_type = self.nx_graph.nodes[node_name]['privacy_type']
                     self.nx_graph.nodes[node_name]['privacy_type'] = privacy_type
+                    self._reindex_node_types(node_name, ('node', previous_privacy_type))
+                    self._sync_privacy_node(node_name, previous_privacy_type)
+                    return True
                 else:
-                    print(f'>>>>>>>>>>Privacy type {privacy_type} not recognised<<<<<<<<<<')
+                    Diagnostics.warning(f'Privacy type {privacy_type} not recognised', node=node_name)
             else:
-                print(f">>>>>>>>>>Graph node {node_name} is not a ros node, but a(n) "
-                      f"{self.nx_graph.nodes[node_name]['node_type']}<<<<<<<<<<")
+                Diagnostics.warning(f"Graph node {node_name} is not a ros node, but a(n) "
+                                    f"{self.nx_graph.nodes[node_name]['node_type']}", node=node_name)
         else:
-            print(f'>>>>>>>>>>Graph node {node_name} does not exist<<<<<<<<<<')
+            Diagnostics.warning(f'Graph node {node_name} does not exist', node=node_name)
+        return False
 
     # Set the privacy type for a transmitter
     # @param transmitter_name: The name of the transmitter to set the privacy type for
     # @param privacy_type: The privacy type to set for the transmitter
     def set_privacy_type_for_transmitter(self, transmitter_name, privacy_type) -> None:
+        if self._set_privacy_type_for_transmitter(transmitter_name, privacy_type):
+            self._reachability = None
+
+    # Sets the privacy type for a transmitter without dropping the reachability of the sources
+    # @return: Whether the privacy type was set
+    def _set_privacy_type_for_transmitter(self, transmitter_name, privacy_type) -> bool:
         transmitter_privacy_types = ['default', 'sensitive', 'mundane']
         if self.nx_graph.has_node(transmitter_name):
             if self.nx_graph.nodes[transmitter_name]['node_type'] in ['topic', 'service', 'action']:
                 if privacy_type in transmitter_privacy_types:
-                    self.nx_graph.nodes[transmitter_name]['privacy_type'] = privacy_type
+                    previous_attributes = self.nx_graph.nodes[transmitter_name]
+                    previous_privacy_type = previous_attributes['privacy_type']
+                    previous_attributes['privacy_type'] = privacy_type
+                    self._reindex_node_types(transmitter_name,
+                                             (previous_attributes['node_type'], previous_privacy_type))
+                    self._sync_privacy_node(transmitter_name, previous_privacy_type)
+                    return True
                 else:
-                    print(f'>>>>>>>>>>Privacy type {privacy_type} not recognised<<<<<<<<<<')
+                    Diagnostics.warning(f'Privacy type {privacy_type} not recognised', node=transmitter_name)
             else:
-                print(f">>>>>>>>>>Graph node {transmitter_name} is not a ros transmitter, but a(n) "
-                      f"{self.nx_graph.nodes[transmitter_name]['node_type']}<<<<<<<<<<")
+                Diagnostics.warning(f"Graph node {transmitter_name} is not a ros transmitter, but a(n) "
+                                    f"{self.nx_graph.nodes[transmitter_name]['node_type']}", node=transmitter_name)
         else:
-            print(f'>>>>>>>>>>Graph node {transmitter_name} does not exist<<<<<<<<<<')
+            Diagnostics.warning(f'Graph node {transmitter_name} does not exist', node=transmitter_name)
+        return False
 
     # Applies multiple categorizations according to lists
+    # The lists hold exact names and prefix, glob and regex rules (see Categorization.CategorizationMatcher), which are
+    # compiled once and matched in one pass over the graph nodes. Graph nodes that match no entry keep their privacy
+    # type.
     def apply_categorization(self, source_nodes=[], leak_nodes=[], conduit_nodes=[], sanitizer_nodes=[],
                              sensitive_transmitters=[], mundane_transmitters=[]) -> None:
-        for source in source_nodes:
-            self.set_privacy_type_for_node(source, 'source')
-        for leak in leak_nodes:
-            self.set_privacy_type_for_node(leak, 'leak')
-        for conduit in conduit_nodes:
-            self.set_privacy_type_for_node(conduit, 'conduit')
-        for sanitizer in sanitizer_nodes:
-            self.set_privacy_type_for_node(sanitizer, 'sanitizer')
-        for sensitive_transmission in sensitive_transmitters:
-            self.set_privacy_type_for_transmitter(sensitive_transmission, 'sensitive')
-        for mundane_transmission in mundane_transmitters:
-            self.set_privacy_type_for_transmitter(mundane_transmission, 'mundane')
+        with Instrumentation.phase('categorization'):
+            matcher = Categorization.CategorizationMatcher({'source': source_nodes, 'leak': leak_nodes,
+                                                            'conduit': conduit_nodes, 'sanitizer': sanitizer_nodes,
+                                                            'sensitive': sensitive_transmitters,
+                                                            'mundane': mundane_transmitters})
+            privacy_types, warnings = matcher.resolve(self.nx_graph)
+            for warning in warnings:
+                Diagnostics.warning(warning)
+            for name, privacy_type in privacy_types.items():
+                if self.nx_graph.nodes[name]['node_type'] == 'node':
+                    self.set_privacy_type_for_node(name, privacy_type)
+                else:
+                    self.set_privacy_type_for_transmitter(name, privacy_type)
+
+    # Applies a change of the categorization and returns the new verdict without rebuilding the privacy graph
+    # Only the sources that reached a changed graph node before the change are searched again, so the cost depends on
+    # the part of the graph affected by the change. The first call after any other change of the graph searches all
+    # sources once.
+    # @param privacy_types: A dictionary mapping names of graph nodes to their new privacy types, ROS nodes take
+    #                       default, source, leak, conduit or sanitizer and transmitters default, sensitive or mundane
+    # @return: Whether a source can reach a leak after the change
+    def apply_categorization_delta(self, privacy_types: dict) -> bool:
+        with Instrumentation.phase('categorization_delta'):
+            # Standard elements are removed before the search, like update_privacy_graph would, but the privacy graph
+            # itself is only rebuilt when it is used
+            if not self.include_standard_elements:
+                self.remove_standard_elements()
+            reachability = self._get_reachability()
+            affected = set()
+            for name, privacy_type in privacy_types.items():
+                if not self.nx_graph.has_node(name):
+                    Diagnostics.warning(f'Graph node {name} does not exist', node=name)
+                    continue
+                previous_privacy_type = self.nx_graph.nodes[name]['privacy_type']
+                was_in_base_graph = self._base_privacy_graph.has_node(name)
+                if self.nx_graph.nodes[name]['node_type'] == 'node':
+                    self._set_privacy_type_for_node(name, privacy_type)
+                else:
+                    self._set_privacy_type_for_transmitter(name, privacy_type)
+                if self.nx_graph.nodes[name]['privacy_type'] == previous_privacy_type:
+                    continue
+                affected |= reachability.affected_by(name)
+                if not was_in_base_graph and self._base_privacy_graph.has_node(name):
+                    for predecessor in self._base_privacy_graph.pred[name]:
+                        affected |= reachability.affected_by(predecessor)
+            reachability.update(self._base_privacy_graph, self._type_index.get(('node', 'source'), {}), affected)
+        return reachability.is_vulnerable()
+
+    # Gets the reachability of the sources in the base privacy graph, searching all sources if it is not up to date
+    def _get_reachability(self) -> Reachability.IncrementalReachability:
+        if self._reachability is None:
+            Instrumentation.count('reachability_searches')
+            self._reachability = Reachability.IncrementalReachability(
+                self._base_privacy_graph, self._type_index.get(('node', 'source'), {}), self._is_base_leak)
+        return self._reachability
+
+    # Checks whether a graph node of the base privacy graph ends a vulnerable path (leak and default ROS nodes)
+    def _is_base_leak(self, name) -> bool:
+        attributes = self._base_privacy_graph.nodes[name]
+        return attributes['node_type'] == 'node' and attributes['privacy_type'] in ['leak', 'default']
+
+    # Adds many connections at once, with the same result as calling add_connection for each of them in order
+    # ALLOW and DENY rules of the whole batch are first resolved in plain dictionaries (see resolve_connections) and
+    # merged with the edges already in the graph, then all nodes and edges are committed to the graph with one
+    # add_nodes_from and one add_edges_from call. Existing graph nodes keep their privacy type.
+    # @param connections: Tuples of the parameters of add_connection
+    #                     (namespace, enclave, node_name, transmitter_name, transmission_type, node_competence, allowed)
+    def add_connections(self, connections) -> None:
+        nodes, edges = self.resolve_connections(connections)
+        for edge, state in edges.items():
+            if self.nx_graph.has_edge(*edge):
+                existing = self.nx_graph.edges[edge]
+                state[0] = existing.get('role')
+                state[1] = merge_allowed(existing.get('allowed'), state[1])
+        self.set_graph_elements(nodes, edges)
+
+    # Resolves the graph nodes and edges of a batch of connections without changing the graph
+    # The last connection of a graph node sets its attributes, the first connection of an edge sets its role and the
+    # ALLOW and DENY rules of an edge are combined with merge_allowed.
+    # @param connections: Tuples of the parameters of add_connection
+    # @return: A dictionary mapping graph node names to attribute dictionaries and a dictionary mapping edges to
+    #          [role, allowed]
+    def resolve_connections(self, connections) -> (dict, dict):
+        nodes = {}
+        edges = {}
+        for namespace, enclave, node_name, transmitter_name, transmission_type, node_competence, allowed in connections:
+            full_node_name, transmitter_name = self._full_connection_names(namespace, node_name, transmitter_name)
+            nodes[full_node_name] = {'node_type': 'node', 'enclave': enclave, 'privacy_type': 'default'}
+            if transmission_type not in ['topic', 'service', 'action']:
+                Diagnostics.warning(f'Transmission type {transmission_type} not recognised')
+                continue
+            nodes[transmitter_name] = {'node_type': transmission_type, 'data_type': None, 'enclave': enclave,
+                                       'privacy_type': 'default'}
+            if (transmission_type, node_competence) not in CONNECTION_EDGES:
+                Diagnostics.warning(f'Node competence {node_competence} not recognised')
+                continue
+            for leaves_node, role in CONNECTION_EDGES[transmission_type, node_competence]:
+                edge = (full_node_name, transmitter_name) if leaves_node else (transmitter_name, full_node_name)
+                state = edges.setdefault(edge, [role, None])
+                if allowed in [True, False]:
+                    state[1] = merge_allowed(state[1], allowed)
+                elif allowed is not None:
+                    Diagnostics.warning(f'Allowed value {allowed} not recognised')
+        return nodes, edges
+
+    # Adds graph nodes and edges to the ROS graph or updates the attributes of existing ones
+    # Existing graph nodes keep their privacy type, the allowed state of existing edges is replaced.
+    # @param nodes: A dictionary mapping graph node names to attribute dictionaries as returned by resolve_connections
+    # @param edges: A dictionary mapping edges to [role, allowed]
+    def set_graph_elements(self, nodes: dict, edges: dict) -> None:
+        edge_count = self.nx_graph.number_of_edges()
+        previous_types = {}
+        for name, attributes in nodes.items():
+            if self.nx_graph.has_node(name):
+                previous_attributes = self.nx_graph.nodes[name]
+                previous_types[name] = (previous_attributes['node_type'], previous_attributes['privacy_type'])
+                attributes['privacy_type'] = previous_attributes['privacy_type']
+        self.nx_graph.add_nodes_from(nodes.items())
+        for name in nodes:
+            if name in previous_types:
+                self._reindex_node_types(name, previous_types[name])
+                self._sync_privacy_node(name, previous_types[name][1])
+            else:
+                self._index_node(name)
+                self._sync_privacy_node(name)
+        if nodes:
+            self._reachability = None
+        self.nx_graph.add_edges_from((source, target, {'role': role, 'allowed': allowed})
+                                     for (source, target), (role, allowed) in edges.items())
+        for source, target in edges:
+            self._sync_privacy_edge(source, target)
+        Instrumentation.count('edges_added', self.nx_graph.number_of_edges() - edge_count)
+
+    # Removes graph nodes and their edges from the ROS graph, names that are not in the graph are skipped
+    def remove_graph_nodes(self, names) -> None:
+        names = [name for name in names if self.nx_graph.has_node(name)]
+        if not names:
+            return
+        for name in names:
+            self._unindex_node(name)
+        self.nx_graph.remove_nodes_from(names)
+        self._base_privacy_graph.remove_nodes_from(names)
+        self._privacy_graph_dirty = True
+        self._reachability = None
+        self._invalidate_reachability_indexes()
+
+    # Removes edges from the ROS graph, edges that are not in the graph are skipped
+    # @param edges: Pairs of source and target nodes
+    def remove_graph_edges(self, edges) -> None:
+        for source, target in edges:
+            if self.nx_graph.has_edge(source, target):
+                self.nx_graph.remove_edge(source, target)
+                self._sync_privacy_edge(source, target)
+
+    # Builds the full names of the node and the transmitter of a connection
+    # @param namespace: The namespace of the node
+    # @param node_name: The name of the node without its namespace
+    # @param transmitter_name: The name of the transmitter, relative to the namespace if it does not start with /
+    def _full_connection_names(self, namespace, node_name, transmitter_name) -> (str, str):
+        full_node_name = namespace + '/' + node_name
+        full_node_name = full_node_name.replace('//', '/')
+        if not transmitter_name.startswith('/'):
+            transmitter_name = namespace + '/' + transmitter_name
+            transmitter_name = transmitter_name.replace('//', '/')
+        return full_node_name, transmitter_name
 
     # Add a connection between a node and a transmitter with the given transmission type and node competence
     # @param enclave: The enclave the node belongs to
@@ -232,12 +536,9 @@ class ROSGraph:
     # @param allowed: Whether the node is allowed to perform its role in the transmission
     def add_connection(self, namespace, enclave, node_name, transmitter_name, transmission_type, node_competence,
                        allowed=None):
-        full_node_name = namespace + '/' + node_name
-        full_node_name = full_node_name.replace('//', '/')
+        edge_count = self.nx_graph.number_of_edges()
+        full_node_name, transmitter_name = self._full_connection_names(namespace, node_name, transmitter_name)
         self.add_node_node(full_node_name, enclave)
-        if not transmitter_name.startswith('/'):
-            transmitter_name = namespace + '/' + transmitter_name
-            transmitter_name = transmitter_name.replace('//', '/')
         if transmission_type == 'topic':
             self.add_topic_node(transmitter_name, enclave)
             if node_competence == 'publish':
@@ -245,7 +546,7 @@ class ROSGraph:
             elif node_competence == 'subscribe':
                 self.add_subscriber(full_node_name, transmitter_name, allowed)
             else:
-                print(f'>>>>>>>>>>Node competence {node_competence} not recognised<<<<<<<<<<')
+                Diagnostics.warning(f'Node competence {node_competence} not recognised')
         elif transmission_type == 'service':
             self.add_service_node(transmitter_name, enclave)
             if node_competence == 'reply':
@@ -253,7 +554,7 @@ class ROSGraph:
             elif node_competence == 'request':
                 self.add_client(full_node_name, transmitter_name, allowed)
             else:
-                print(f'>>>>>>>>>>Node competence {node_competence} not recognised<<<<<<<<<<')
+                Diagnostics.warning(f'Node competence {node_competence} not recognised')
         elif transmission_type == 'action':
             self.add_action_node(transmitter_name, enclave)
             if node_competence == 'execute':
@@ -261,251 +562,354 @@ class ROSGraph:
             elif node_competence == 'call':
                 self.add_caller(full_node_name, transmitter_name, allowed)
             else:
-                print(f'>>>>>>>>>>Node competence {node_competence} not recognised<<<<<<<<<<')
+                Diagnostics.warning(f'Node competence {node_competence} not recognised')
+        else:
+            Diagnostics.warning(f'Transmission type {transmission_type} not recognised')
+        Instrumentation.count('edges_added', self.nx_graph.number_of_edges() - edge_count)
+
+    # Writes the ROS graph to a compiled graph file that can be loaded with read_graph
+    # Nodes are stored as lists of their attributes and edges as pairs of node indices with role and allowed, written
+    # as compact JSON. The file is replaced atomically, so a concurrent reader never sees a partially written graph.
+    # @param path: The path of the compiled graph file
+    # @param keystore_hash: A content hash of the policy files the graph was built from
+    # @param fragments: The fragment files the policy files included, which are part of the content hash
+    def write_graph(self, path: str, keystore_hash: str = None, fragments=()) -> None:
+        node_index = {}
+        nodes = []
+        for index, (name, attributes) in enumerate(self.nx_graph.nodes(data=True)):
+            node_index[name] = index
+            nodes.append((name, attributes['node_type'], attributes['enclave'], attributes.get('data_type'),
+                          attributes['privacy_type']))
+        edges = [(node_index[source], node_index[target], attributes.get('role'), attributes.get('allowed'))
+                 for source, target, attributes in self.nx_graph.edges(data=True)]
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as outfile:
+            json.dump({'format': COMPILED_GRAPH_FORMAT, 'keystore_hash': keystore_hash, 'fragments': sorted(fragments),
+                       'nodes': nodes, 'edges': edges}, outfile, separators=(',', ':'))
+        os.replace(temporary_path, path)
+
+    # Replaces the ROS graph by the graph stored in a compiled graph file written by write_graph
+    # A file that can't be read or does not have the structure write_graph gives it is not read, like an outdated one.
+    # @param path: The path of the compiled graph file
+    # @param keystore_hash: If given, the graph is only read if it was built from policy files with this content hash.
+    #                       A function is called with the fragment files recorded with the graph to compute the hash.
+    # @return: Whether the graph was read
+    def read_graph(self, path: str, keystore_hash=None) -> bool:
+        try:
+            with open(path, 'r') as infile:
+                compiled_graph = json.load(infile)
+            if not isinstance(compiled_graph, dict) or compiled_graph.get('format') != COMPILED_GRAPH_FORMAT:
+                return False
+            if callable(keystore_hash):
+                keystore_hash = keystore_hash(compiled_graph['fragments'])
+            if keystore_hash is not None and compiled_graph['keystore_hash'] != keystore_hash:
+                return False
+            nodes = []
+            for name, node_type, enclave, data_type, privacy_type in compiled_graph['nodes']:
+                if not all(isinstance(value, str) for value in [name, node_type, privacy_type]):
+                    raise TypeError(f'Graph node {name!r} has an attribute of the wrong type')
+                nodes.append((name, node_attributes(node_type, enclave, privacy_type, data_type)))
+            edges = []
+            for source, target, role, allowed in compiled_graph['edges']:
+                if not all(isinstance(index, int) and 0 <= index < len(nodes) for index in [source, target]):
+                    raise IndexError(f'Edge ({source!r}, {target!r}) has no valid graph node indices')
+                edges.append((nodes[source][0], nodes[target][0], {'role': role, 'allowed': allowed}))
+        except (OSError, ValueError, KeyError, TypeError, IndexError) as error:
+            Diagnostics.debug(f'Could not read compiled graph {path}: {error!r}', path=path)
+            return False
+        self.load_graph_elements(nodes, edges)
+        return True
+
+    # Replaces the ROS graph by the given nodes and edges and rebuilds all state derived from it
+    # @param nodes: Pairs of node names and attribute dictionaries
+    # @param edges: Triples of source, target and attribute dictionary
+    def load_graph_elements(self, nodes, edges) -> None:
+        self.nx_graph = nx.DiGraph()
+        self.nx_graph.add_nodes_from(nodes)
+        self.nx_graph.add_edges_from(edges)
+        self._basename_index = {}
+        self._type_index = {}
+        self._node_positions = {}
+        for name in self.nx_graph.nodes():
+            self._index_node(name)
+        self._base_privacy_graph = nx.DiGraph()
+        self._base_privacy_graph.add_nodes_from((name, dict(attributes))
+                                                for name, attributes in self.nx_graph.nodes(data=True)
+                                                if attributes['privacy_type'] not in PRIVACY_REMOVED_TYPES)
+        self._base_privacy_graph.add_edges_from((source, target, dict(attributes))
+                                                for source, target, attributes in self.nx_graph.edges(data=True)
+                                                if attributes.get('allowed') is True and
+                                                self._base_privacy_graph.has_node(source) and
+                                                self._base_privacy_graph.has_node(target))
+        self.privacy_graph = None
+        self._privacy_core = None
+        self._reachability = None
+        self._invalidate_reachability_indexes()
+        self._privacy_graph_dirty = True
+
+    # Updates the privacy graph of a single graph node after it was added or changed in the ROS graph
+    # Changes between privacy types that neither remove the graph node nor make it a source only update the attributes
+    # of the current privacy graph, all other changes mark it for a rebuild. The reachability of the sources is dropped
+    # by the callers, apply_categorization_delta updates it instead.
+    # @param name: The name of the changed graph node
+    # @param previous_privacy_type: The privacy type of the graph node before the change, None if it was added
+    def _sync_privacy_node(self, name, previous_privacy_type=None) -> None:
+        self._leak_reachability_index = None
+        attributes = self.nx_graph.nodes[name]
+        privacy_type = attributes['privacy_type']
+        if privacy_type in PRIVACY_REMOVED_TYPES:
+            if self._base_privacy_graph.has_node(name):
+                self._base_privacy_graph.remove_node(name)
+                self._privacy_graph_dirty = True
+                self._reachability_index = None
+        elif not self._base_privacy_graph.has_node(name):
+            self._base_privacy_graph.add_node(name, **attributes)
+            for successor, edge_attributes in self.nx_graph.succ[name].items():
+                if edge_attributes.get('allowed') is True and self._base_privacy_graph.has_node(successor):
+                    self._base_privacy_graph.add_edge(name, successor, **edge_attributes)
+            for predecessor, edge_attributes in self.nx_graph.pred[name].items():
+                if edge_attributes.get('allowed') is True and self._base_privacy_graph.has_node(predecessor):
+                    self._base_privacy_graph.add_edge(predecessor, name, **edge_attributes)
+            self._privacy_graph_dirty = True
+            self._reachability_index = None
         else:
-            print(f'>>>>>>>>>>Transmission type {transmission_type} not recognised<<<<<<<<<<')
+            self._base_privacy_graph.nodes[name].update(attributes)
+            if previous_privacy_type != privacy_type and 'source' in [previous_privacy_type, privacy_type]:
+                self._privacy_graph_dirty = True
+            elif self.privacy_graph is not None and self.privacy_graph.has_node(name):
+                self.privacy_graph.nodes[name].update(attributes)
+                if self._privacy_core is not None:
+                    self._privacy_core.update_attributes(name, attributes)
+
+    # Updates the privacy graph of a single edge after it was added or its allowed attribute changed in the ROS graph
+    # @param source: The source node of the edge (u)
+    # @param target: The target node of the edge (v)
+    def _sync_privacy_edge(self, source, target) -> None:
+        attributes = self.nx_graph.edges[source, target] if self.nx_graph.has_edge(source, target) else {}
+        if (attributes.get('allowed') is True and self._base_privacy_graph.has_node(source) and
+                self._base_privacy_graph.has_node(target)):
+            if not self._base_privacy_graph.has_edge(source, target):
+                self._base_privacy_graph.add_edge(source, target, **attributes)
+                self._privacy_graph_dirty = True
+                self._reachability = None
+                self._invalidate_reachability_indexes()
+            else:
+                self._base_privacy_graph.edges[source, target].update(attributes)
+        elif self._base_privacy_graph.has_edge(source, target):
+            self._base_privacy_graph.remove_edge(source, target)
+            self._privacy_graph_dirty = True
+            self._reachability = None
+            self._invalidate_reachability_indexes()
+
+    # Drops the reachability indexes of the base privacy graph after a change of its structure
+    def _invalidate_reachability_indexes(self) -> None:
+        self._reachability_index = None
+        self._leak_reachability_index = None
+
+    # Marks the privacy graph for a rebuild, e.g. after changing include_standard_elements or remove_non_descendants
+    def invalidate_privacy_graph(self) -> None:
+        self._privacy_graph_dirty = True
 
     # Updates the privacy graph to reflect the current state of the ROS graph
+    # The privacy graph is only rebuilt if the ROS graph changed in a way that affects its structure since the last call
     def update_privacy_graph(self) -> None:
         # Removes all nodes and edges that belong to the standard set of connections a node has.
         if not self.include_standard_elements:
             self.remove_standard_elements()
-        self.privacy_graph = nx.DiGraph(self.nx_graph)
-
-        nodes_to_delete = []
-        edges_to_delete = []
-
-        # Remove all nodes and edges that are not descendants of a source node or source nodes themselves
-        sources = self.get_nodes_of_privacy_type('node', 'source', graph_type='privacy')
-        source_descendants = []
-        if sources and self.remove_non_descendants:
-            for node in sources:
-                source_descendants += nx.descendants(self.nx_graph, node)
-            non_descendants = [element for element in self.nx_graph.nodes() if element not in source_descendants and
-                               element not in sources]
-        else:
-            non_descendants = []
-
-        # Remove sanitizer nodes and mundane topics, services, and actions
-        for node in self.privacy_graph.nodes():
-            if self.privacy_graph.nodes[node]['privacy_type'] in ['sanitizer', 'mundane'] or node in non_descendants:
-                nodes_to_delete.append(node)
-        for edge in self.privacy_graph.edges():
-            if (self.privacy_graph.edges[edge]['allowed'] in [False, None] or edge[0] in nodes_to_delete or edge[1] in
-                    nodes_to_delete):  # TODO: delete edges with allowed=None? -> deletion by default?
-                edges_to_delete.append(edge)
-        self.privacy_graph.remove_edges_from(edges_to_delete)
-        self.privacy_graph.remove_nodes_from(nodes_to_delete)
-
-        # Remove topics, services, and actions with only one adjacent node (no communication to other nodes)
-        nodes_to_delete = []
-        edges_to_delete = []
-        for node in self.privacy_graph.nodes():
-            if self.privacy_graph.degree(node) == 0:
-                nodes_to_delete.append(node)
-        for node in self.privacy_graph.nodes():
-            if self.privacy_graph.nodes[node]['node_type'] in ['topic', 'service', 'action']:
-                predecessor_nodes = [n for n in self.privacy_graph.predecessors(node)]
-                successor_nodes = [n for n in self.privacy_graph.successors(node)]
-                if (len(predecessor_nodes) == 1 and len(successor_nodes) == 1 and predecessor_nodes[0] ==
-                        successor_nodes[0]):
-                    nodes_to_delete.append(node)
-
-        # Remove all nodes and edges that are no longer descendants of a source node or source nodes themselves after
-        # removing transmitters with only one adjacent node  # TODO: implement loop handling this
-        source_descendants = []
-        if sources and self.remove_non_descendants:
-            for node in sources:
-                source_descendants += nx.descendants(self.privacy_graph, node)
-            non_descendants = [element for element in self.privacy_graph.nodes() if element not in source_descendants and
-                               element not in sources]
-        else:
-            non_descendants = []
-        for node in self.privacy_graph.nodes():
-            if node in non_descendants:
-                nodes_to_delete.append(node)
-        for edge in self.privacy_graph.edges():
-            if edge[0] in nodes_to_delete or edge[1] in nodes_to_delete:  # TODO: delete edges with allowed=None? -> deletion by default?
-                edges_to_delete.append(edge)
-        self.privacy_graph.remove_edges_from(edges_to_delete)
-        self.privacy_graph.remove_nodes_from(nodes_to_delete)
-
-        # Remove topics, services, and actions with only one adjacent node (no communication to other nodes)
-        nodes_to_delete = []
-        edges_to_delete = []
-        for node in self.privacy_graph.nodes():
-            if self.privacy_graph.degree(node) == 0:
-                nodes_to_delete.append(node)
-        for node in self.privacy_graph.nodes():
-            if self.privacy_graph.nodes[node]['node_type'] in ['topic', 'service', 'action']:
-                predecessor_nodes = [n for n in self.privacy_graph.predecessors(node)]
-                successor_nodes = [n for n in self.privacy_graph.successors(node)]
-                if (len(predecessor_nodes) == 1 and len(successor_nodes) == 1 and predecessor_nodes[0] ==
-                        successor_nodes[0]) or len(predecessor_nodes) == 0 or len(successor_nodes) == 0:
-                    nodes_to_delete.append(node)
-        for edge in self.privacy_graph.edges():
-            if edge[0] in nodes_to_delete or edge[1] in nodes_to_delete:  # TODO: delete edges with allowed=None? -> deletion by default?
-                edges_to_delete.append(edge)
-        self.privacy_graph.remove_edges_from(edges_to_delete)
-        self.privacy_graph.remove_nodes_from(nodes_to_delete)
-
-    # Removes all nodes and edges that belong to the standard set of connections a node has.
-    # This includes the /rosout topic for logging,
-    # topic /parameter_events, and services /describe_parameters, /get_parameters, /get_parameter_types,
-    # /list_parameters, /set_parameters, /set_parameters_atomically for parameter management,
-    # topic /clock for time management,
+        if not self._privacy_graph_dirty and self.privacy_graph is not None:
+            return
+        Instrumentation.count('privacy_graph_rebuilds')
+        with Instrumentation.phase('privacy_graph_rebuild'):
+            # Sanitizer nodes, mundane transmitters and edges not allowed by the MAC are already missing in the base
+            # graph
+            self.privacy_graph = nx.DiGraph(self._base_privacy_graph)
+            self._privacy_graph_dirty = False
+
+            # Remove all graph nodes that are not descendants of a source node or source nodes themselves and all
+            # topics, services, and actions that do not connect different nodes, until no more graph nodes can be
+            # removed
+            # Sources are never removed from the base graph, so the sources of the ROS graph are the ones to start from
+            sources = self.get_nodes_of_privacy_type('node', 'source')
+            reachable = None
+            if self.remove_non_descendants and sources:
+                reachable = self._get_reachability_index().descendants(sources)
+            Reachability.prune_privacy_graph(self.privacy_graph, sources,
+                                             remove_non_descendants=self.remove_non_descendants, reachable=reachable)
+            self._privacy_core = GraphCore.CompactGraph(self.privacy_graph)
+
+    # Gets the reachability index of the base privacy graph, which is rebuilt only after its structure changed
+    # @param stop_at_leaks: Whether paths end at the first leak (leak and default ROS nodes) like vulnerable paths
+    def _get_reachability_index(self, stop_at_leaks=False) -> Reachability.ReachabilityIndex:
+        if stop_at_leaks:
+            if self._leak_reachability_index is None:
+                Instrumentation.count('reachability_index_builds')
+                self._leak_reachability_index = Reachability.ReachabilityIndex(self._base_privacy_graph,
+                                                                               self._is_base_leak)
+            return self._leak_reachability_index
+        if self._reachability_index is None:
+            Instrumentation.count('reachability_index_builds')
+            self._reachability_index = Reachability.ReachabilityIndex(self._base_privacy_graph)
+        return self._reachability_index
+
+    # Checks whether a graph node can reach another one in the privacy graph
+    # Queries are answered from a reachability index, which is built on the first query after a change of the graph
+    # @param source: The graph node the path starts in
+    # @param target: The graph node the path ends in
+    # @param stop_at_leaks: Whether the path has to end at the first leak on it, like the paths of is_privacy_vulnerable
+    def can_reach(self, source, target, stop_at_leaks=False) -> bool:
+        Instrumentation.count('reachability_queries')
+        self.update_privacy_graph()
+        if not self._base_privacy_graph.has_node(source) or not self._base_privacy_graph.has_node(target):
+            return False
+        return self._get_reachability_index(stop_at_leaks).can_reach(source, target)
+
+    # Removes all nodes and edges that belong to the standard set of connections a node has (see STANDARD_ELEMENTS).
+    # The graph nodes are looked up by the last segment of their name, so the cost depends on the number of matches,
+    # not on the size of the graph.
     def remove_standard_elements(self) -> None:
-        rosout = [element for element in self.nx_graph.nodes() if element.endswith('/rosout')]
-        parameter_events = [element for element in self.nx_graph.nodes() if element.endswith('/parameter_events')]
-        describe_parameters = [element for element in self.nx_graph.nodes() if element.endswith('/describe_parameters')]
-        get_parameters = [element for element in self.nx_graph.nodes() if element.endswith('/get_parameters')]
-        get_parameter_types = [element for element in self.nx_graph.nodes() if element.endswith('/get_parameter_types')]
-        list_parameters = [element for element in self.nx_graph.nodes() if element.endswith('/list_parameters')]
-        set_parameters = [element for element in self.nx_graph.nodes() if element.endswith('/set_parameters')]
-        set_parameters_atomically = [element for element in self.nx_graph.nodes() if element.endswith(
-            '/set_parameters_atomically')]
-        clock = [element for element in self.nx_graph.nodes() if element.endswith('/clock')]
-        nodes_to_delete = (rosout + parameter_events + describe_parameters + get_parameters + get_parameter_types +
-                           list_parameters + set_parameters + set_parameters_atomically + clock)
-        # TODO: decide if included in standard elements
-        # change_state = [element for element in self.nx_graph.nodes() if element.endswith('/change_state')]
-        # get_available_states = [element for element in self.nx_graph.nodes() if element.endswith('/get_available_states')]
-        # get_available_transitions = [element for element in self.nx_graph.nodes() if
-        #                             element.endswith('/get_available_transitions')]
-        # get_state = [element for element in self.nx_graph.nodes() if element.endswith('/get_state')]
-        # get_transition_graph = [element for element in self.nx_graph.nodes() if
-        #                        element.endswith('/get_transition_graph')]
-        # nodes_to_delete += (change_state + get_available_states + get_available_transitions + get_state +
-        #                   get_transition_graph)
-        edges_to_delete = []
-        for edge in self.nx_graph.edges():
-            if edge[0] in nodes_to_delete or edge[1] in nodes_to_delete:
-                edges_to_delete.append(edge)
-        self.nx_graph.remove_edges_from(edges_to_delete)
-        self.nx_graph.remove_nodes_from(nodes_to_delete)
+        nodes_to_delete = {}
+        for element in self.standard_elements:
+            suffix = '/' + element
+            for name in self._basename_index.get(element.rsplit('/', 1)[-1], {}):
+                if name.endswith(suffix):
+                    nodes_to_delete[name] = None
+        self.remove_graph_nodes(nodes_to_delete)
 
     # Determines whether the graph is privacy vulnerable or not based on possible connections between source and leak
     # nodes in the current privacy graph
+    # All connections are found in one multi-source search. The witness paths of the connections are collected in a
+    # PrivacyReport (see get_privacy_report), which is bounded to paths_per_pair shortest paths per source and leak.
+    # @param exhaustive: Whether to report all edge-disjoint paths per source and leak instead (slow on big graphs)
+    # @param paths_per_pair: The number of shortest witness paths reported per source and leak, ignored if exhaustive
     # TODO: visualize vulnerable paths in own graphic?
-    def is_privacy_vulnerable(self) -> bool:
-        self.vulnerable_path_elements = []
-        self.vulnerable_edges = []
-        self.update_privacy_graph()
-        privacy_vulnerable = False
-        vulnerable_paths = []
-        sources = self.get_nodes_of_privacy_type('node', 'source', graph_type='privacy')
-        leaks = (self.get_nodes_of_privacy_type('node', 'leak', graph_type='privacy') +
-                 self.get_nodes_of_privacy_type('node', 'default', graph_type='privacy'))
-        for source in sources:
-            for leak in leaks:
-                if nx.has_path(self.privacy_graph, source, leak):
-                    privacy_vulnerable = True
-                    disjoint_paths = nx.edge_disjoint_paths(self.privacy_graph, source, leak)
-                    for path in disjoint_paths:
-                        leak_counter = 0
-                        for node in path:
-                            if node in leaks:
-                                leak_counter += 1
-                        if leak_counter == 1:
-                            vulnerable_paths.append(path)
-                            print(f'>>>>>>>>>>Privacy Endangered: {source} can reach {leak}<<<<<<<<<<')
-                        elif leak_counter > 1:
-                            # Path contains multiple leaks, so the subpath from the source to the first leak is already
-                            # included in the list
-                            pass
-                        else:
-                            print(f'>>>>>>>>>>Path {path} contains no leaks<<<<<<<<<<')  # Should never happen
-
-        for path in vulnerable_paths:
-            for index, element in enumerate(path):
-                previous_element = path[index - 1]
-                if element not in self.vulnerable_path_elements:
-                    self.vulnerable_path_elements.append(element)
-                if index != 0:
-                    if (self.nx_graph.has_edge(previous_element, element) and
-                            self.nx_graph.edges[previous_element, element] not in self.vulnerable_edges):
-                        self.vulnerable_edges.append((previous_element, element))
-                    if (self.nx_graph.has_edge(element, previous_element) and
-                            self.nx_graph.edges[element, previous_element] not in self.vulnerable_edges):
-                        self.vulnerable_edges.append((element, previous_element))
-
-        print(f'>>>>>>>>>>Vulnerable Paths: {vulnerable_paths}<<<<<<<<<<') if privacy_vulnerable else print(
-            '>>>>>>>>>>No Vulnerable Paths<<<<<<<<<<')
-        return privacy_vulnerable
-
-    # Sets the layout for the graph visualization using networkx
-    # @param layout: The layout to use for the visualization (spiral, spring, planar, multipartite, kamada_kawai)
+    def is_privacy_vulnerable(self, exhaustive=False, paths_per_pair=1) -> bool:
+        Instrumentation.count('reachability_searches')
+        with Instrumentation.phase('vulnerability_check'):
+            core = self.get_privacy_core()
+            sources = core.nodes_of('node', 'source')
+            leaks = core.nodes_of('node', 'leak') + core.nodes_of('node', 'default')
+            report = PrivacyReport.PrivacyReport(self.nx_graph, None if exhaustive else paths_per_pair)
+            if exhaustive:
+                # The max-flow based enumeration runs on the networkx graph
+                pairs, vulnerable_paths = Reachability.find_vulnerable_paths(self.privacy_graph, core.names_of(sources),
+                                                                             core.names_of(leaks), exhaustive=True)
+                for source, leak in pairs:
+                    report.add_pair(source, leak)
+                for path in vulnerable_paths:
+                    report.add_path(path)
+            else:
+                pairs, vulnerable_paths = Reachability.find_vulnerable_paths(core, sources, leaks)
+                if paths_per_pair == 1:
+                    for path in vulnerable_paths:
+                        report.add_path(core.names_of(path))
+                else:
+                    leak_names = set(core.names_of(leaks))
+                    for source, leak in pairs:
+                        source, leak = core.names_of((source, leak))
+                        report.add_pair(source, leak)
+                        # One path more than stored tells whether the paths of the pair were truncated
+                        for path in Reachability.iter_shortest_witness_paths(self.privacy_graph, source, leak,
+                                                                             leak_names, limit=paths_per_pair + 1):
+                            if not report.add_path(path):
+                                break
+        self.set_privacy_report(report)
+        return report.is_vulnerable()
+
+    # Sets the PrivacyReport of an analysis of the graph and the vulnerable graph nodes and edges drawn from it
+    def set_privacy_report(self, report: PrivacyReport.PrivacyReport) -> None:
+        self.privacy_report = report
+        self.vulnerable_path_elements = report.path_elements()
+        self.vulnerable_edges = report.edges()
+        Diagnostics.info(report.summary(), vulnerable=report.is_vulnerable())
+
+    # Gets the PrivacyReport of the last is_privacy_vulnerable call, None if it was not called yet
+    def get_privacy_report(self) -> PrivacyReport.PrivacyReport:
+        return self.privacy_report
+
+    # Sets the layout for the graph visualization
+    # Layouts are cached by the fingerprint of the graph (see Layout.graph_fingerprint). The scalable layouts of the
+    # privacy graph are taken from the layout of the ROS graph, since the privacy graph is a subgraph of it. Graph nodes
+    # keep their place in both views and a change of the categorization does not need a new layout.
+    # @param layout: The layout to use for the visualization (see Layout.LAYOUTS)
+    # @param graph_type: The graph to lay out (ros, privacy)
     def set_layout(self, layout, graph_type='ros') -> dict:
         graph = self.nx_graph
         if graph_type == 'privacy':
-            graph = self.get_privacy_graph()
-        if layout == 'spiral':
-            return nx.spiral_layout(graph)
-        elif layout == 'spring':
-            return nx.spring_layout(graph)
-        elif layout == 'planar':
-            return nx.planar_layout(graph)
-        elif layout == 'multipartite':
-            # Shows enclaves, can be used for node_type
-            return nx.multipartite_layout(graph, subset_key='enclave')
-        elif layout == 'kamada_kawai':  # Needs package 'scipy' to run
-            return nx.kamada_kawai_layout(graph)
-        else:
-            print(f'>>>>>>>>>>Layout {layout} not recognised, defaulted to spiral layout<<<<<<<<<<')
-            return nx.spiral_layout(graph)
+            graph = self.get_privacy_graph()  # Removes the standard elements from the ROS graph first if excluded
+            if layout in Layout.SCALABLE_LAYOUTS:
+                positions = self.set_layout(layout)
+                return {name: positions[name] for name in graph}
+        fingerprint = Layout.graph_fingerprint(graph)
+        positions = self._layout_cache.get(layout, fingerprint)
+        if positions is None:
+            positions = Layout.compute_layout(graph, layout)
+            self._layout_cache.put(layout, fingerprint, positions)
+        return positions
 
     # Gets all nodes of a given type from the graph
+    # The nodes are looked up in the type index and returned in graph order
     # @param node_type: The type of node to get (node, topic, service, action)
     def get_nodes_of_type(self, node_type) -> list:
         nodes = []
-        for node in self.nx_graph.nodes():
-            if self.nx_graph.nodes[node]['node_type'] == node_type:
-                nodes.append(node)
-        return nodes
+        for (indexed_node_type, _), names in self._type_index.items():
+            if indexed_node_type == node_type:
+                nodes += names
+        return sorted(nodes, key=self._node_positions.__getitem__)
 
     # Gets all nodes of a given privacy type from the graph
     # @param node_type: The type of node to get (node, topic, service, action)
     # @param privacy_type: The privacy type of node to get (source, leak, conduit, sanitizer, default)
     # @param graph_type: The type of graph to get the nodes from (ros, privacy)
+    # The nodes are looked up in the type index of the graph and returned in graph order
     def get_nodes_of_privacy_type(self, node_type, privacy_type, graph_type='ros') -> list:
-        if graph_type == 'ros':
-            graph = self.nx_graph
-        elif graph_type == 'privacy':
-            graph = self.privacy_graph
-        else:
-            print(f'>>>>>>>>>>Graph {graph_type} not recognised, defaulted to ros graph<<<<<<<<<<')
-            graph = self.nx_graph
-        nodes = []
-        for node in graph.nodes():
-            if (graph.nodes[node]['node_type'] == node_type and
-                    graph.nodes[node]['privacy_type'] == privacy_type):
-                nodes.append(node)
-        return nodes
+        if graph_type == 'privacy':
+            core = self.get_privacy_core()
+            return core.names_of(core.nodes_of(node_type, privacy_type))
+        elif graph_type != 'ros':
+            Diagnostics.warning(f'Graph {graph_type} not recognised, defaulted to ros graph')
+        return sorted(self._type_index.get((node_type, privacy_type), ()), key=self._node_positions.__getitem__)
 
     # Gets the ROS graph
     def get_ros_graph(self) -> nx.DiGraph:
         return self.nx_graph
 
+    # Gets the privacy graph before graph nodes that are not reachable from sources or don't connect different nodes
+    # are pruned: all graph nodes but sanitizer nodes and mundane transmitters and all allowed edges between them
+    # The base privacy graph is kept up to date by every change of the ROS graph, so getting it costs nothing. It must
+    # not be changed.
+    def get_base_privacy_graph(self) -> nx.DiGraph:
+        if not self.include_standard_elements:
+            self.remove_standard_elements()
+        return self._base_privacy_graph
+
     # Gets the privacy graph
     def get_privacy_graph(self) -> nx.DiGraph:
         self.update_privacy_graph()
         return self.privacy_graph
 
+    # Gets the compact integer-indexed snapshot of the privacy graph used by the analysis
+    # The networkx privacy graph stays the representation for changes and drawing, the snapshot is rebuilt with it.
+    def get_privacy_core(self) -> GraphCore.CompactGraph:
+        self.update_privacy_graph()
+        return self._privacy_core
+
     # Visualizes the graph
-    # @param layout: The layout to use for the visualization (spiral, spring, planar, multipartite, kamada_kawai)
+    # @param layout: The layout to use for the visualization (see Layout.LAYOUTS)
     # TODO: improve visualization of big graphs
     def show_ros_view(self, layout='spiral'):
+        import matplotlib.pyplot as plt  # Only needed for the views, importing it is slow
         if not self.include_standard_elements:
             self.remove_standard_elements()
-        pos = self.set_layout(layout)
+        with Instrumentation.phase('layout'):
+            pos = self.set_layout(layout)
 
         node_list = self.get_nodes_of_type('node')
         topic_list = self.get_nodes_of_type('topic')
         service_list = self.get_nodes_of_type('service')
         action_list = self.get_nodes_of_type('action')
-        print(f'Topics: {topic_list}')
-        print(f'Services: {service_list}')
-        print(f'Actions: {action_list}')
+        Diagnostics.debug(f'Topics: {topic_list}')
+        Diagnostics.debug(f'Services: {service_list}')
+        Diagnostics.debug(f'Actions: {action_list}')
 
         node_size = 300  # 200/300
         nx.draw_networkx_nodes(self.nx_graph, pos, nodelist=node_list, node_color='lightgrey', node_shape='o',
@@ -525,7 +929,7 @@ class ROSGraph:
                 elif self.nx_graph.edges[edge]['allowed'] is False or self.nx_graph.edges[edge]['allowed'] is None:
                     denied_edges.append(edge)
             except KeyError:
-                print(f'>>>>>>>>>>No Allowed or Denied Attribute for Edge {edge}<<<<<<<<<<')
+                Diagnostics.warning(f'No Allowed or Denied Attribute for Edge {edge}')
 
         edge_width = 1  # 0.7/1
         nx.draw_networkx_edges(self.nx_graph, pos, allowed_edges, arrows=True, edge_color='black', width=edge_width)
@@ -539,9 +943,10 @@ class ROSGraph:
         plt.show()
 
     # Visualizes the privacy view of either the ROS graph or the privacy graph
-    # @param layout: The layout to use for the visualization (spiral, spring, planar, multipartite, kamada_kawai)
+    # @param layout: The layout to use for the visualization (see Layout.LAYOUTS)
     # @param ros_or_privacy_graph: The graph to visualize (ros, privacy)
     def show_privacy_view(self, layout='spiral', ros_or_privacy_graph='privacy'):
+        import matplotlib.pyplot as plt  # Only needed for the views, importing it is slow
         if not self.include_standard_elements:
             self.remove_standard_elements()
         if ros_or_privacy_graph == 'ros':
@@ -549,9 +954,10 @@ class ROSGraph:
         elif ros_or_privacy_graph == 'privacy':
             graph = self.get_privacy_graph()
         else:
-            print(f'>>>>>>>>>>Graph {ros_or_privacy_graph} not recognised, defaulted to ros graph<<<<<<<<<<')
+            Diagnostics.warning(f'Graph {ros_or_privacy_graph} not recognised, defaulted to ros graph')
             graph = self.nx_graph
-        pos = self.set_layout(layout, graph_type=ros_or_privacy_graph)
+        with Instrumentation.phase('layout'):
+            pos = self.set_layout(layout, graph_type=ros_or_privacy_graph)
 
         privacy_typing_nodes = {'source': [], 'leak': [], 'conduit': [], 'sanitizer': [], 'default': []}
         privacy_typing_transmitters = {'sensitive': [], 'mundane': [], 'default': []}
@@ -589,7 +995,7 @@ class ROSGraph:
                     denied_edges.append(edge)  # TODO: Should edges with allowed=None be considered denied?
             except KeyError:
                 # TODO: Add allowed=None?
-                print(f'>>>>>>>>>>No Allowed or Denied Attribute for Edge {edge}<<<<<<<<<<')
+                Diagnostics.warning(f'No Allowed or Denied Attribute for Edge {edge}')
 
         nx.draw_networkx_edges(graph, pos, allowed_edges, arrows=True, edge_color='black', width=1)
         nx.draw_networkx_edges(graph, pos, denied_edges, arrows=True, edge_color='lightgrey', width=1)
@@ -601,3 +1007,20 @@ class ROSGraph:
         nx.draw_networkx_labels(graph, pos, labels, font_size=10)
         plt.subplots_adjust(left=0.01, bottom=0.01, right=0.99, top=0.99, wspace=None, hspace=None)
         plt.show()
+
+
+# Combines two allowed states of an edge, DENY (False) beats ALLOW (True) and both beat no rule (None)
+def merge_allowed(allowed, other_allowed):
+    if allowed is False or other_allowed is False:
+        return False
+    if allowed is True or other_allowed is True:
+        return True
+    return None
+
+
+# Builds the attribute dictionary of a graph node the way the add_*_node methods of ROSGraph store it
+# ROS nodes have no data type, transmitters always have one (None if unknown)
+def node_attributes(node_type, enclave, privacy_type, data_type=None) -> dict:
+    if node_type == 'node':
+        return {'node_type': node_type, 'enclave': enclave, 'privacy_type': privacy_type}
+    return {'node_type': node_type, 'data_type': data_type, 'enclave': enclave, 'privacy_type': privacy_type}
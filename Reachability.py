@@ -0,0 +1,348 @@
+from collections import deque
+import itertools
+import networkx as nx
+import Diagnostics
+
+# Node types of graph nodes representing a mode of communication
+TRANSMITTER_TYPES = ['topic', 'service', 'action']
+
+
+# Finds every source -> leak reachability of a graph in one multi-source breadth-first search
+# Every queue entry carries the source it originated from, so each node keeps one predecessor per source reaching it.
+# Leaks end a search branch, since a path passing a leak is already reported at the first leak on it.
+# @param graph: The directed graph to search (usually the privacy graph or its GraphCore.CompactGraph)
+# @param sources: The nodes to start the search from
+# @param leaks: The nodes that end a path, pass an empty collection to compute plain reachability
+# @return: Predecessors of the reached nodes per source and the leaks reached per source in discovery order
+def multi_source_bfs(graph: nx.DiGraph, sources, leaks) -> (dict, dict):
+    leaks = set(leaks)
+    predecessors = {source: {source: None} for source in sources}
+    reached_leaks = {source: [] for source in predecessors}
+    queue = deque((source, source) for source in predecessors)
+    while queue:
+        node, source = queue.popleft()
+        source_predecessors = predecessors[source]
+        for successor in graph.successors(node):
+            if successor in source_predecessors:
+                continue
+            source_predecessors[successor] = node
+            if successor in leaks:
+                reached_leaks[source].append(successor)
+            else:
+                queue.append((successor, source))
+    return predecessors, reached_leaks
+
+
+# Collects all nodes reachable from any of the given sources, including the sources themselves
+# @param graph: The directed graph to search
+# @param sources: The nodes to start the search from
+def descendants_of(graph: nx.DiGraph, sources) -> set:
+    reachable = set(sources)
+    queue = deque(reachable)
+    while queue:
+        for successor in graph.successors(queue.popleft()):
+            if successor not in reachable:
+                reachable.add(successor)
+                queue.append(successor)
+    return reachable
+
+
+# Rebuilds the path from a source to a reached node from the predecessors recorded by multi_source_bfs
+# @param predecessors: The predecessors recorded for the source
+# @param target: The reached node the path ends in
+def witness_path(predecessors: dict, target) -> list:
+    path = []
+    node = target
+    while node is not None:
+        path.append(node)
+        node = predecessors[node]
+    path.reverse()
+    return path
+
+
+# Lists all edge-disjoint paths between a source and a leak that contain no other leak
+# This is the exhaustive (max-flow based) enumeration, only used if explicitly requested
+# @param graph: The directed graph to search
+# @param source: The start of the paths
+# @param leak: The end of the paths
+# @param leaks: All leaks of the graph
+def disjoint_witness_paths(graph: nx.DiGraph, source, leak, leaks) -> list:
+    paths = []
+    for path in nx.edge_disjoint_paths(graph, source, leak):
+        leak_counter = 0
+        for node in path:
+            if node in leaks:
+                leak_counter += 1
+        if leak_counter == 1:
+            paths.append(path)
+        elif leak_counter > 1:
+            # Path contains multiple leaks, so the subpath from the source to the first leak is already included
+            pass
+        else:
+            Diagnostics.error(f'Path {path} contains no leaks', path=path)  # Should never happen
+    return paths
+
+
+# Yields the shortest paths between a source and a leak that contain no other leak, shortest first
+# The paths are computed lazily, so only as many paths as are consumed are searched for.
+# @param graph: The directed graph to search
+# @param source: The start of the paths
+# @param leak: The end of the paths
+# @param leaks: All leaks of the graph
+# @param limit: The maximum number of paths to yield, None yields all of them
+def iter_shortest_witness_paths(graph: nx.DiGraph, source, leak, leaks, limit=None):
+    view = nx.subgraph_view(graph, filter_node=lambda node: node == leak or node not in leaks)
+    return itertools.islice(nx.shortest_simple_paths(view, source, leak), limit)
+
+
+# Finds all pairs of sources and leaks connected in the graph and the paths proving the connections
+# By default one shortest path without intermediate leaks is reported per pair. The exhaustive mode reports every
+# edge-disjoint path per pair instead, which needs one max-flow computation per connected pair.
+# @param graph: The directed graph to search (usually the privacy graph), a GraphCore.CompactGraph with node ids works
+#               as well except in the exhaustive mode
+# @param sources: The nodes the paths start in
+# @param leaks: The nodes the paths end in
+# @param exhaustive: Whether to enumerate all edge-disjoint paths per pair
+# @return: The connected (source, leak) pairs and the list of vulnerable paths
+def find_vulnerable_paths(graph: nx.DiGraph, sources, leaks, exhaustive=False) -> (list, list):
+    leak_rank = {leak: index for index, leak in enumerate(leaks)}
+    pairs = []
+    vulnerable_paths = []
+    if exhaustive:
+        predecessors, _ = multi_source_bfs(graph, sources, ())
+        for source, source_predecessors in predecessors.items():
+            for leak in sorted((node for node in source_predecessors if node in leak_rank and node != source),
+                               key=leak_rank.get):
+                pairs.append((source, leak))
+                vulnerable_paths += disjoint_witness_paths(graph, source, leak, leak_rank)
+    else:
+        predecessors, reached = multi_source_bfs(graph, sources, leak_rank)
+        for source, reached_leaks in reached.items():
+            for leak in sorted(reached_leaks, key=leak_rank.get):
+                pairs.append((source, leak))
+                vulnerable_paths.append(witness_path(predecessors[source], leak))
+    return pairs, vulnerable_paths
+
+
+# A reachability index over the strongly connected components of a graph
+# The graph is condensed with an iterative version of Tarjan's algorithm, which finds the components in reverse
+# topological order. Every component then gets a bitset (a Python int) of the components reachable from it, combined
+# from the bitsets of its successor components, so a reachability query is a single bit test. The bitsets take
+# (number of components)^2 / 8 bytes in total.
+class ReachabilityIndex:
+    # Builds the index of a graph
+    # @param graph: The directed graph to index
+    # @param is_terminal: A function telling whether the edges leaving a graph node are ignored, e.g. to index the
+    #                     paths that end at the first leak. None follows all edges.
+    def __init__(self, graph: nx.DiGraph, is_terminal=None):
+        self.component = {}  # Node -> id of its component
+        self.members = []  # Component id -> nodes of the component
+        self.reach = []  # Component id -> bitset of the components reachable from it, including itself
+        if is_terminal is None:
+            self._successors = graph.successors
+        else:
+            self._successors = lambda node: () if is_terminal(node) else graph.successors(node)
+        self._condense(graph.nodes())
+
+    def _condense(self, nodes) -> None:
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        for root in nodes:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self._successors(root)))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = lowlink[child] = len(index)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(self._successors(child))))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        self._add_component(node, stack, on_stack)
+
+    # Pops the component rooted in a node from the Tarjan stack and computes its bitset
+    def _add_component(self, root, stack: list, on_stack: set) -> None:
+        component_id = len(self.members)
+        members = []
+        while True:
+            member = stack.pop()
+            on_stack.discard(member)
+            self.component[member] = component_id
+            members.append(member)
+            if member == root:
+                break
+        reach = 1 << component_id
+        for member in members:
+            for successor in self._successors(member):
+                successor_id = self.component[successor]
+                if successor_id != component_id:  # All other successor components are already complete
+                    reach |= self.reach[successor_id]
+        self.members.append(members)
+        self.reach.append(reach)
+
+    # Returns whether a path leads from source to target
+    def can_reach(self, source, target) -> bool:
+        return bool(self.reach[self.component[source]] >> self.component[target] & 1)
+
+    # Returns whether a path leads from any of the sources to any of the targets other than the source itself
+    def reaches_any(self, sources, targets) -> bool:
+        targets = set(targets)
+        target_mask = 0
+        for target in targets:
+            target_mask |= 1 << self.component[target]
+        for source in sources:
+            mask = target_mask
+            if source in targets and len(self.members[self.component[source]]) == 1:
+                mask &= ~(1 << self.component[source])
+            if self.reach[self.component[source]] & mask:
+                return True
+        return False
+
+    # Returns all nodes reachable from any of the sources, including the sources themselves
+    def descendants(self, sources) -> set:
+        mask = 0
+        for source in sources:
+            mask |= self.reach[self.component[source]]
+        return set(node for component_id, bit in enumerate(reversed(bin(mask)[2:])) if bit == '1'
+                   for node in self.members[component_id])
+
+
+# Keeps the leak-bounded reachability of every source of a graph up to date across changes of privacy types
+# Stores the nodes reached from each source (searching like multi_source_bfs) and, per node, the sources reaching it.
+# After a change only the sources that reached a changed node (or a predecessor of a node added back to the graph) are
+# searched again, so the cost of an update depends on the part of the graph the change affects. The searches run on
+# the unpruned privacy graph, which connects the same sources and leaks as the pruned one.
+class IncrementalReachability:
+    # Searches all sources of a graph
+    # @param graph: The directed graph to search (usually the base privacy graph of a ROSGraph)
+    # @param sources: The source nodes of the graph
+    # @param is_leak: A function telling whether a graph node ends a path
+    def __init__(self, graph: nx.DiGraph, sources, is_leak):
+        self.is_leak = is_leak
+        self.reachable = {}  # Source -> nodes reached from it
+        self.reached_leaks = {}  # Source -> leaks reached from it in discovery order
+        self.covering = {}  # Node -> sources reaching it
+        self.update(graph, sources, ())
+
+    # Returns the sources that have to be searched again if a graph node changes
+    def affected_by(self, node) -> set:
+        return set(self.covering.get(node, ()))
+
+    # Searches the given affected sources and all new sources again and drops the sources that are gone
+    # @param graph: The changed graph
+    # @param sources: All source nodes of the changed graph
+    # @param affected: The sources whose reachable nodes may have changed
+    def update(self, graph: nx.DiGraph, sources, affected) -> None:
+        sources = set(sources)
+        for source in list(self.reachable):
+            if source not in sources or source in affected:
+                for node in self.reachable.pop(source):
+                    self.covering[node].discard(source)
+                    if not self.covering[node]:
+                        del self.covering[node]
+                del self.reached_leaks[source]
+        for source in sources:
+            if source not in self.reachable:
+                self._search(graph, source)
+
+    # Searches the nodes reachable from a source, ending search branches at leaks
+    def _search(self, graph: nx.DiGraph, source) -> None:
+        reachable = {source}
+        reached_leaks = []
+        queue = deque([source])
+        while queue:
+            for successor in graph.successors(queue.popleft()):
+                if successor in reachable:
+                    continue
+                reachable.add(successor)
+                if self.is_leak(successor):
+                    reached_leaks.append(successor)
+                else:
+                    queue.append(successor)
+        self.reachable[source] = reachable
+        self.reached_leaks[source] = reached_leaks
+        for node in reachable:
+            self.covering.setdefault(node, set()).add(source)
+
+    # Returns all connected (source, leak) pairs
+    def pairs(self) -> list:
+        return [(source, leak) for source, reached_leaks in self.reached_leaks.items() for leak in reached_leaks]
+
+    # Returns whether any source reaches a leak
+    def is_vulnerable(self) -> bool:
+        return any(self.reached_leaks.values())
+
+
+# Checks whether a graph node of the privacy graph can be removed without changing any source -> leak connection
+# This is the case for graph nodes without edges and for topics, services and actions that do not connect two
+# different graph nodes (no predecessor, no successor or the same single graph node on both sides)
+def _is_prunable(graph: nx.DiGraph, node) -> bool:
+    predecessors = graph.pred[node]
+    successors = graph.succ[node]
+    if not predecessors and not successors:
+        return True
+    if graph.nodes[node]['node_type'] in TRANSMITTER_TYPES:
+        if not predecessors or not successors:
+            return True
+        if len(predecessors) == 1 and len(successors) == 1 and next(iter(predecessors)) == next(iter(successors)):
+            return True
+    return False
+
+
+# Prunes a privacy graph in place until it reaches a fixpoint
+# Removes graph nodes that are neither sources nor descendants of a source as well as all graph nodes matching
+# _is_prunable. Only the neighbours of removed graph nodes are checked again, and the descendants of the sources are
+# recomputed once per round, so the pass scales linearly with the size of the graph. Removing graph nodes matching
+# _is_prunable never changes the descendants of the sources, so descendants known in advance are removed in one go.
+# @param graph: The privacy graph to prune
+# @param sources: The source nodes of the graph
+# @param remove_non_descendants: Whether to remove graph nodes that are not reachable from any source
+# @param reachable: The descendants of the sources including the sources, e.g. from a ReachabilityIndex of the graph,
+#                   None computes them while pruning
+def prune_privacy_graph(graph: nx.DiGraph, sources, remove_non_descendants=True, reachable=None) -> None:
+    check_descendants = remove_non_descendants and len(sources) > 0
+    if check_descendants and reachable is not None:
+        graph.remove_nodes_from([node for node in graph.nodes() if node not in reachable])
+        check_descendants = False
+    worklist = deque(graph.nodes())
+    queued = set(worklist)
+    while True:
+        while worklist:
+            node = worklist.popleft()
+            queued.discard(node)
+            if not graph.has_node(node) or not _is_prunable(graph, node):
+                continue
+            neighbours = set(graph.pred[node])
+            neighbours.update(graph.succ[node])
+            graph.remove_node(node)
+            for neighbour in neighbours:
+                if neighbour not in queued:
+                    queued.add(neighbour)
+                    worklist.append(neighbour)
+        if not check_descendants:
+            break
+        reachable = descendants_of(graph, [source for source in sources if graph.has_node(source)])
+        non_descendants = [node for node in graph.nodes() if node not in reachable]
+        if not non_descendants:
+            break
+        for node in non_descendants:
+            for neighbour in graph.succ[node]:
+                if neighbour in reachable and neighbour not in queued:
+                    queued.add(neighbour)
+                    worklist.append(neighbour)
+        graph.remove_nodes_from(non_descendants)
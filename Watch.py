@@ -0,0 +1,183 @@
+import os
+from lxml import etree as ET
+import Categorization
+import Diagnostics
+import Instrumentation
+import ROSGraph
+import XMLParser
+
+
+# Keeps a ROSGraph up to date with the policy files of a keystore while they are edited
+# The contribution of every policy file, the graph nodes and edges its rules add with their ALLOW and DENY state, is
+# recorded together with the XInclude fragments it read. When a policy file or a fragment it includes changes, only
+# the contributions of the affected policy files are retracted and read again, and only the graph nodes and edges they
+# touch are updated in the graph. The graph is the same as the one XMLParser.build_graph_from_directory builds from the
+# keystore, so the cost of an update depends on the size of the change, not on the size of the keystore.
+# Changes are found by polling the modification times and sizes of the xml files of the keystore and of the fragments
+# included from outside of it, which only reads the directory entries of unchanged files.
+class KeystoreWatcher:
+    # @param graph: The ROSGraph to keep up to date, it is filled by the first update
+    # @param path: The directory of the keystore
+    def __init__(self, graph: ROSGraph.ROSGraph, path: str):
+        self.graph = graph
+        self.path = path
+        self.categorization = None  # CategorizationMatcher of the categorization applied to added graph nodes
+        self.signatures = {}  # Watched file -> (modification time, size)
+        self.kinds = {}  # Xml file of the keystore -> classification (see XMLParser.classify_xml_file)
+        self.order = {}  # Policy file -> position in the keystore
+        self.contributions = {}  # Policy file -> {'nodes': {...}, 'edges': {...}, 'includes': fragment files}
+        self.includers = {}  # Fragment file -> policy files including it
+        self.node_files = {}  # Graph node -> {policy file: attributes of the graph node in the policy file}
+        self.edge_files = {}  # Edge -> {policy file: (role, allowed) of the edge in the policy file}
+
+    # Sets the categorization applied to the graph nodes added by later updates, graph nodes already in the graph are
+    # not changed
+    # @param categorization: A dictionary mapping the keys of Categorization.CATEGORIZATION_KEYS to lists of names and
+    #                        rules
+    def set_categorization(self, categorization: dict) -> None:
+        self.categorization = Categorization.CategorizationMatcher(categorization)
+
+    # Checks the keystore for changed files and updates the graph with the contributions of the affected policy files
+    # @return: The policy files whose contributions were updated, including removed policy files
+    def update(self) -> list:
+        with Instrumentation.phase('watch_update'):
+            keystore = [os.path.abspath(xml_file) for xml_file in XMLParser.crawl_keystore(self.path)]
+            in_keystore = set(keystore)
+            signatures = {}
+            for watched_file in keystore + [fragment for fragment in self.includers if fragment not in in_keystore]:
+                try:
+                    stat = os.stat(watched_file)
+                except OSError:
+                    continue
+                signatures[watched_file] = (stat.st_mtime_ns, stat.st_size)
+            changed = [watched_file for watched_file in signatures
+                       if self.signatures.get(watched_file) != signatures[watched_file]]
+            changed += [watched_file for watched_file in self.signatures if watched_file not in signatures]
+            self.signatures = signatures
+            if not changed:
+                return []
+            for watched_file in changed:
+                if watched_file in signatures and watched_file in in_keystore:
+                    self.kinds[watched_file] = XMLParser.classify_xml_file(watched_file)
+                else:
+                    self.kinds.pop(watched_file, None)
+            self.order = {policy: position for position, policy in
+                          enumerate(xml_file for xml_file in keystore if self.kinds[xml_file] == 'policy')}
+            affected = {}
+            for watched_file in changed:
+                if watched_file in self.order or watched_file in self.contributions:
+                    affected[watched_file] = None
+                for policy in self.includers.get(watched_file, ()):
+                    affected[policy] = None
+            self._update_contributions(list(affected))
+            Instrumentation.count('policy_files_updated', len(affected))
+            return list(affected)
+
+    # Retracts the contributions of policy files and reads them again, policy files that are no longer part of the
+    # keystore are only retracted
+    # A policy file that can't be read keeps its previous contribution until it or a fragment file it tried to include
+    # changes again, so creating a missing fragment file reads it again.
+    def _update_contributions(self, policies: list) -> None:
+        touched_nodes = {}
+        touched_edges = {}
+        for policy in policies:
+            contribution = None
+            if policy in self.order:
+                with XMLParser.fragment_cache.track() as includes:
+                    try:
+                        rules = XMLParser.read_policy_rules(policy)
+                    except (OSError, ET.XMLSyntaxError) as error:
+                        rules = None
+                        Diagnostics.error(f'Could not read {policy}: {error}', path=policy)
+                if rules is None:
+                    self._watch_includes(policy, includes)
+                    continue
+                nodes, edges = self.graph.resolve_connections(rules)
+                contribution = {'nodes': nodes, 'edges': edges, 'includes': includes}
+            for previous_contribution in [self._retract(policy), contribution]:
+                if previous_contribution is not None:
+                    touched_nodes.update(dict.fromkeys(previous_contribution['nodes']))
+                    touched_edges.update(dict.fromkeys(previous_contribution['edges']))
+            if contribution is not None:
+                self._record(policy, contribution)
+        self._apply(touched_nodes, touched_edges)
+
+    # Removes the contribution of a policy file from the records
+    # @return: The removed contribution, None if the policy file had none
+    def _retract(self, policy: str) -> dict:
+        contribution = self.contributions.pop(policy, None)
+        if contribution is None:
+            return None
+        for records, elements in [(self.node_files, contribution['nodes']), (self.edge_files, contribution['edges'])]:
+            for element in elements:
+                del records[element][policy]
+                if not records[element]:
+                    del records[element]
+        for fragment in contribution['includes']:
+            self.includers[fragment].discard(policy)
+            if not self.includers[fragment]:
+                del self.includers[fragment]
+        return contribution
+
+    # Adds fragment files a policy file tried to include to its contribution without changing its graph nodes and edges
+    # A policy file without a contribution gets an empty one.
+    def _watch_includes(self, policy: str, includes: set) -> None:
+        contribution = self.contributions.setdefault(policy, {'nodes': {}, 'edges': {}, 'includes': set()})
+        contribution['includes'] = contribution['includes'] | includes
+        for fragment in includes:
+            self.includers.setdefault(fragment, set()).add(policy)
+
+    # Adds the contribution of a policy file to the records
+    def _record(self, policy: str, contribution: dict) -> None:
+        self.contributions[policy] = contribution
+        for name, attributes in contribution['nodes'].items():
+            self.node_files.setdefault(name, {})[policy] = attributes
+        for edge, (role, allowed) in contribution['edges'].items():
+            self.edge_files.setdefault(edge, {})[policy] = (role, allowed)
+        for fragment in contribution['includes']:
+            self.includers.setdefault(fragment, set()).add(policy)
+
+    # Updates the touched graph nodes and edges of the graph to the state the recorded contributions give them
+    # Like in a graph built from the whole keystore, the last policy file of a graph node sets its attributes, the
+    # first policy file of an edge sets its role and DENY beats ALLOW over all policy files of an edge.
+    def _apply(self, touched_nodes, touched_edges) -> None:
+        ros_graph = self.graph.get_ros_graph()
+        nodes = {}
+        removed_nodes = []
+        for name in touched_nodes:
+            files = self.node_files.get(name)
+            if files is None:
+                removed_nodes.append(name)
+                continue
+            attributes = files[max(files, key=self.order.get)]
+            if not ros_graph.has_node(name) or any(ros_graph.nodes[name].get(key) != value
+                                                   for key, value in attributes.items() if key != 'privacy_type'):
+                nodes[name] = dict(attributes)
+        edges = {}
+        removed_edges = []
+        for edge in touched_edges:
+            files = self.edge_files.get(edge)
+            if files is None:
+                removed_edges.append(edge)
+                continue
+            role = files[min(files, key=self.order.get)][0]
+            allowed = None
+            for _, file_allowed in files.values():
+                allowed = ROSGraph.merge_allowed(allowed, file_allowed)
+            if not ros_graph.has_edge(*edge) or (ros_graph.edges[edge].get('role'),
+                                                 ros_graph.edges[edge].get('allowed')) != (role, allowed):
+                edges[edge] = [role, allowed]
+        added = [name for name in nodes if not ros_graph.has_node(name)]
+        self.graph.remove_graph_edges(removed_edges)
+        self.graph.remove_graph_nodes(removed_nodes)
+        self.graph.set_graph_elements(nodes, edges)
+        for name in added if self.categorization is not None else []:
+            privacy_type = self.categorization.match(name, ros_graph.nodes[name]['node_type'])
+            if privacy_type is None:
+                continue
+            if ros_graph.nodes[name]['node_type'] == 'node':
+                self.graph.set_privacy_type_for_node(name, privacy_type)
+            else:
+                self.graph.set_privacy_type_for_transmitter(name, privacy_type)
+        Diagnostics.debug(f'Updated {len(nodes)} graph node(s) and {len(edges)} edge(s), removed '
+                          f'{len(removed_nodes)} graph node(s) and {len(removed_edges)} edge(s)')
@@ -1,25 +1,170 @@
+from concurrent.futures import ProcessPoolExecutor
 from lxml import etree as ET
+import contextlib
+import hashlib
 import os
-import copy
+import re
+import Diagnostics
+import Instrumentation
 import ROSGraph
 
+# Namespaces of XInclude elements, policies still use the namespace of the 2003 draft in places
+XINCLUDE_TAGS = ['{http://www.w3.org/2001/XInclude}include', '{http://www.w3.org/2003/XInclude}include']
+# Tags of the policy elements whose XInclude children are expanded while a policy file is streamed
+INCLUDE_PARENT_TAGS = ['policy', 'enclaves', 'enclave', 'profiles']
+# Root tags of files that are only included by policies
+FRAGMENT_ROOT_TAGS = ['profiles', 'profile']
+# Attributes of a policy expression that grant or deny a node competence
+NODE_COMPETENCES = ['publish', 'subscribe', 'reply', 'request', 'execute', 'call']
+
+
+# A cache of parsed XInclude fragments, keyed by the path of the fragment file and the xpointer selecting elements
+# from it. Entries are invalidated if the modification time of the fragment changes, so each shared profile is parsed
+# only once per run. Includes inside a fragment are resolved through the cache as well when the fragment is read.
+class FragmentCache:
+    def __init__(self):
+        self.fragments = {}  # (path, xpointer) -> (modification time of the file, selected elements)
+        self.registered = set()  # Fragment files found in the keystore, parsed once they are included
+        self.tracked = None  # Fragment files resolved while track is active
+        self.hits = 0
+        self.misses = 0
+
+    # Registers fragment files found in the keystore. They are not parsed until a policy includes them.
+    # @param paths: The paths of the fragment files
+    def register(self, paths) -> None:
+        self.registered.update(os.path.abspath(path) for path in paths)
+
+    # Returns the elements selected by an xpointer from a fragment file
+    # The returned elements belong to the cache and are only read, never copied or modified
+    # @param path: The path of the fragment file
+    # @param xpointer: The xpointer selecting the elements, None selects the root element
+    def resolve(self, path: str, xpointer: str = None) -> list:
+        path = os.path.abspath(path)
+        if self.tracked is not None:
+            self.tracked.add(path)
+        key = (path, xpointer)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.fragments.get(key)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        elements = select_xpointer(ET.parse(path), xpointer)
+        self.fragments[key] = (mtime, elements)
+        return elements
+
+    # Records the paths of all fragment files resolved while the context is active, cached or not
+    # @return: The set the paths are added to
+    @contextlib.contextmanager
+    def track(self):
+        previous = self.tracked
+        self.tracked = set()
+        try:
+            yield self.tracked
+        finally:
+            if previous is not None:
+                previous.update(self.tracked)
+            self.tracked = previous
+
+    # Returns the hit and miss statistics of the cache
+    def statistics(self) -> dict:
+        included = set(path for path, _ in self.fragments)
+        return {'hits': self.hits, 'misses': self.misses, 'fragments': len(self.fragments),
+                'registered': len(self.registered), 'unused': len(self.registered - included)}
+
+    def clear(self) -> None:
+        self.fragments = {}
+        self.registered = set()
+        self.hits = 0
+        self.misses = 0
+
+
+# The fragment cache used by all policy files read in this process
+fragment_cache = FragmentCache()
+
 
 # Builds a graph from the policy files in the given directory and subdirectories
+# The rules of each policy file are streamed into the graph while the file is read, so no intermediate representation
+# of the keystore is kept. The policy files can also be parsed by multiple worker processes, whose rules are added in
+# the order of the keystore, so the resulting graph does not depend on the number of workers.
+# @param existing_graph_path: A compiled graph file used as cache. It is loaded instead of parsing the policy files if
+#                             it was built from policy files with the same content, otherwise it is rewritten.
+# @param workers: The number of processes parsing policy files, 1 parses them in this process, 0 uses all CPU cores
+# @param standard_elements: The standard elements of the graph, see ROSGraph.ROSGraph
 # TODO: Add option to read from a single file instead of a directory
-def build_graph_from_directory(existing_graph_path=None, path: str = None, include_standard_elements=False) -> (
-        ROSGraph.ROSGraph):
+def build_graph_from_directory(existing_graph_path=None, path: str = None, include_standard_elements=False,
+                               workers=1, standard_elements=None) -> ROSGraph.ROSGraph:
     if path is None:
         path = os.getcwd()
-    graph = ROSGraph.ROSGraph(graph_path=existing_graph_path, include_standard_elements=include_standard_elements)
-    keystore = crawl_keystore(path)
-    contents = {}
-    for index, xml_file in enumerate(keystore):
-        contents[index] = read_sros2_file(xml_file)
-    for index, content in contents.items():
-        add_policy_to_graph(content, graph)
+    graph = ROSGraph.ROSGraph(include_standard_elements=include_standard_elements,
+                              standard_elements=standard_elements)
+    with Instrumentation.phase('crawl'):
+        classified = scan_keystore(crawl_keystore(path))
+    if existing_graph_path is not None:
+        with Instrumentation.phase('graph_cache_read'):
+            loaded = graph.read_graph(existing_graph_path,
+                                      lambda fragments: hash_keystore(path, classified, fragments))
+        if loaded:
+            Diagnostics.info(f'Loaded compiled graph from {existing_graph_path}', path=existing_graph_path)
+            return graph
+    fragment_cache.register(classified['fragment'])
+    for xml_file in classified['unrelated']:
+        Diagnostics.info(f'Skipping {xml_file}, it is neither a policy nor a policy fragment.', path=xml_file)
+    keystore = classified['policy']
+    includes, fragments = fragment_cache.hits + fragment_cache.misses, fragment_cache.misses
+    # The rules are streamed into the graph, so the phase covers parsing the policy files and adding their rules
+    with Instrumentation.phase('parse'), fragment_cache.track() as included:
+        if workers == 1 or len(keystore) < 2:
+            graph.add_connections(rule for xml_file in keystore for rule in iter_sros2_rules(xml_file))
+        else:
+            workers = min(workers or os.cpu_count(), len(keystore))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(_read_policy_rules_in_worker, keystore,
+                                       chunksize=max(1, len(keystore) // (workers * 4)))
+                graph.add_connections(rule for rules in _count_fragment_statistics(results) for rule in rules)
+    Instrumentation.count('files_parsed', len(keystore))
+    Instrumentation.count('includes_resolved', fragment_cache.hits + fragment_cache.misses - includes)
+    Instrumentation.count('fragments_parsed', fragment_cache.misses - fragments)
+    if existing_graph_path is not None:
+        with Instrumentation.phase('graph_cache_write'):
+            graph.write_graph(existing_graph_path, hash_keystore(path, classified, included), included)
+        Diagnostics.info(f'Saved compiled graph to {existing_graph_path}', path=existing_graph_path)
     return graph
 
 
+# Computes a content hash of the policy and fragment files of a keystore and of the fragment files its policies include
+# @param path: The directory of the keystore
+# @param classified: The files of the keystore as returned by scan_keystore
+# @param fragments: The fragment files resolved while the policy files were parsed, inside or outside of the keystore.
+#                   A missing fragment file is hashed as missing.
+def hash_keystore(path: str, classified: dict, fragments=()) -> str:
+    keystore_hash = hashlib.sha256()
+    xml_files = set(os.path.abspath(xml_file) for xml_file in classified['policy'] + classified['fragment'])
+    for xml_file in sorted(xml_files.union(fragments)):
+        keystore_hash.update(os.path.relpath(xml_file, path).encode())
+        try:
+            with open(xml_file, 'rb') as infile:
+                keystore_hash.update(hashlib.sha256(infile.read()).digest())
+        except OSError:
+            keystore_hash.update(b'missing')
+    return keystore_hash.hexdigest()
+
+
+# Adds the included fragment files, fragment cache statistics and diagnostics reported by worker processes to those of
+# this process
+# @param results: The results of _read_policy_rules_in_worker
+# @return: The rules of the results
+def _count_fragment_statistics(results):
+    for rules, included, hits, misses, records in results:
+        if fragment_cache.tracked is not None:
+            fragment_cache.tracked.update(included)
+        fragment_cache.hits += hits
+        fragment_cache.misses += misses
+        for record in records:
+            Diagnostics.diagnostics.add_record(record)
+        yield rules
+
+
 # Lists all xml files in the given directory and subdirectories with their respective paths including their names as
 # keys and names as values
 def crawl_keystore(path: str):
@@ -31,84 +176,181 @@ def crawl_keystore(path: str):
     return keystore
 
 
-# Reads a policy file and returns a dictionary containing the xml file's structure
-def read_sros2_file(path: str) -> dict:
+# Classifies an xml file by its root element without parsing the whole file
+# @return: 'policy' for policy files, 'fragment' for files included by policies and 'unrelated' for all other files
+def classify_xml_file(path: str) -> str:
+    try:
+        with open(path, 'rb') as xml_file:
+            for _, element in ET.iterparse(xml_file, events=('start',)):
+                if element.tag == 'policy':
+                    return 'policy'
+                elif element.tag in FRAGMENT_ROOT_TAGS:
+                    return 'fragment'
+                break
+    except ET.XMLSyntaxError:
+        pass
+    return 'unrelated'
+
+
+# Sorts the files of a keystore by their classification, keeping the order of the keystore
+# @param keystore: The xml files as returned by crawl_keystore
+# @return: A dictionary mapping 'policy', 'fragment' and 'unrelated' to lists of paths
+def scan_keystore(keystore) -> dict:
+    classified = {'policy': [], 'fragment': [], 'unrelated': []}
+    for xml_file in keystore:
+        classified[classify_xml_file(xml_file)].append(xml_file)
+    return classified
+
+
+# Reads a policy file and yields its rules while the file is parsed
+# Each rule has the form (namespace, enclave, node, transmitter, transmission type, node competence, allowed), which
+# matches the parameters of ROSGraph.add_connection. Every profile is dropped from the parsed tree once its rules were
+# yielded, so memory use does not grow with the size of the file. XIncludes are expanded at every level of the policy,
+# like lxml's xinclude() would, e.g. whole enclaves included with xpointer(/policy/enclaves/*).
+# @param path: The path of the policy file
+def iter_sros2_rules(path: str):
+    with open(path, 'rb') as xml_file:
+        context = ET.iterparse(xml_file, events=('start', 'end'))
+        _, root = next(context)
+        if root.tag != 'policy':
+            Diagnostics.warning(f'Root tag {root.tag} not recognised.', path=path)
+            return
+        enclave_name = None
+        for event, element in context:
+            if event == 'start':
+                if element.tag == 'enclave':
+                    enclave_name = element.get('path')
+                continue
+            parent = element.getparent()
+            if element.tag == 'profile' and parent is not None and parent.tag == 'profiles':
+                yield from _iter_profile_rules(element, path, enclave_name)
+            elif element.tag in XINCLUDE_TAGS and parent is not None and parent.tag in INCLUDE_PARENT_TAGS:
+                for included, included_path in _iter_included(element, path):
+                    yield from _iter_element_rules(included, included_path, enclave_name)
+            elif element.tag not in ['enclave', 'profiles', 'enclaves']:
+                continue
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+
+# Reads the rules of a policy file into a list that can be passed between processes
+def read_policy_rules(path: str) -> list:
+    return list(iter_sros2_rules(path))
+
+
+# Reads the rules of a policy file with all XIncludes expanded by lxml's xinclude() before the whole tree is walked
+# This is how policy files were read before they were streamed. It keeps every included file in memory and is only
+# used as reference for the rules iter_sros2_rules yields (see Benchmark.check_rules).
+def read_policy_rules_with_xinclude(path: str) -> list:
     tree = ET.parse(path)
     tree.xinclude()
-    root = tree.getroot()
-    if root.tag == 'policy':
-        content = parse_policy(tree.getroot())
+    rules = []
+    for enclaves in tree.getroot().iter('enclaves'):
+        for enclave in enclaves.iter('enclave'):
+            for profile in enclave.iter('profile'):
+                for expression in profile:
+                    for attribute_key, attribute_value in expression.items():
+                        if attribute_key in NODE_COMPETENCES:
+                            allowed = True if attribute_value == 'ALLOW' else False if attribute_value == 'DENY' \
+                                else None
+                            rules += [(profile.get('ns'), enclave.get('path'), profile.get('node'),
+                                       expression_element.text, expression_element.tag, attribute_key, allowed)
+                                      for expression_element in expression if isinstance(expression_element.tag, str)]
+    return rules
+
+
+# Reads the rules of a policy file together with the fragment files it includes, directly or through other fragments
+# @return: The rules of the policy file and the set of the absolute paths of the fragment files
+def read_policy_contribution(path: str) -> (list, set):
+    with fragment_cache.track() as included:
+        rules = read_policy_rules(path)
+    return rules, included
+
+
+# Reads the rules of a policy file in a worker process and reports the fragment files it included, the fragment cache
+# statistics and the diagnostics of the worker
+def _read_policy_rules_in_worker(path: str) -> (list, set, int, int, list):
+    hits = fragment_cache.hits
+    misses = fragment_cache.misses
+    with Diagnostics.diagnostics.capture() as records:
+        rules, included = read_policy_contribution(path)
+    return rules, included, fragment_cache.hits - hits, fragment_cache.misses - misses, records
+
+
+# Yields the rules of an included policy element: enclaves, an enclave, profiles or a profile
+# @param element: The included element
+# @param path: The path of the file the element was read from
+# @param enclave_name: The path of the enclave the element belongs to, an included enclave sets its own
+def _iter_element_rules(element, path: str, enclave_name: str):
+    if element.tag == 'profile':
+        yield from _iter_profile_rules(element, path, enclave_name)
+    elif element.tag in ['enclaves', 'enclave', 'profiles']:
+        if element.tag == 'enclave':
+            enclave_name = element.get('path')
+        for child, child_path in _iter_children(element, path):
+            yield from _iter_element_rules(child, child_path, enclave_name)
+    else:
+        Diagnostics.warning(f'Included element {element.tag} not recognised.', path=path)
+
+
+# Yields the rules of a profile element
+# @param profile: The profile element
+# @param path: The path of the file the profile was read from, includes in the profile are relative to it
+# @param enclave_name: The path of the enclave the profile belongs to
+def _iter_profile_rules(profile, path: str, enclave_name: str):
+    node_name = profile.get('node')
+    namespace = profile.get('ns')
+    for expression, expression_path in _iter_children(profile, path):
+        for attribute_key, attribute_value in expression.items():
+            if attribute_key in NODE_COMPETENCES:
+                allowed = None
+                if attribute_value == 'ALLOW':
+                    allowed = True
+                elif attribute_value == 'DENY':
+                    allowed = False
+                else:
+                    Diagnostics.warning(f'Attribute value {attribute_value} not recognised.', path=expression_path)
+                for expression_element, _ in _iter_children(expression, expression_path):
+                    yield (namespace, enclave_name, node_name, expression_element.text, expression_element.tag,
+                           attribute_key, allowed)
+
+
+# Yields the child elements of an element with all XInclude elements replaced by the elements they include
+# @param element: The parent element
+# @param path: The path of the file the element was read from
+# @return: Pairs of child elements and the paths of the files they were read from
+def _iter_children(element, path: str):
+    for child in element:
+        if child.tag in XINCLUDE_TAGS:
+            yield from _iter_included(child, path)
+        elif isinstance(child.tag, str):
+            yield child, path
+
+
+# Yields the elements included by an XInclude element, resolving nested includes through the fragment cache
+# @param include: The XInclude element
+# @param path: The path of the file the XInclude element was read from, its href is relative to it
+# @return: Pairs of included elements and the paths of the files they were read from
+def _iter_included(include, path: str):
+    fragment_path = os.path.join(os.path.dirname(path), include.get('href'))
+    for element in fragment_cache.resolve(fragment_path, include.get('xpointer')):
+        if element.tag in XINCLUDE_TAGS:
+            yield from _iter_included(element, fragment_path)
+        else:
+            yield element, fragment_path
+
+
+# Selects the elements an xpointer points to in a parsed file
+# Supports the xpointer() scheme with an XPath expression and shorthand pointers to an element id
+# @param tree: The parsed file
+# @param xpointer: The xpointer, None selects the root element
+def select_xpointer(tree, xpointer: str = None) -> list:
+    if xpointer is None:
+        return [tree.getroot()]
+    match = re.fullmatch(r'\s*xpointer\((.*)\)\s*', xpointer)
+    if match:
+        selection = tree.xpath(match.group(1))
     else:
-        print(f'Root tag {root.tag} not recognised.')
-        content = {}
-    return content
-
-
-def parse_policy(root) -> dict:
-    policy_dict = {}
-    for enclaves in root:
-        for enclave_index, enclave in enumerate(enclaves):
-            policy_dict[f'Enclave_{enclave_index}'] = copy.deepcopy(enclave.attrib)
-            policy_dict[f'Enclave_{enclave_index}']['profiles'] = parse_enclave(enclave)
-    return policy_dict
-
-
-def parse_enclave(enclave) -> dict:
-    enclave_dict = {}
-    for profiles_index, profiles in enumerate(enclave):
-        enclave_dict[f'Profiles_{profiles_index}'] = copy.deepcopy(profiles.attrib)
-        for profile_index, profile in enumerate(profiles):
-            enclave_dict[f'Profiles_{profiles_index}'][f'Profile_{profile_index}'] = copy.deepcopy(profile.attrib)
-            enclave_dict[f'Profiles_{profiles_index}'][f'Profile_{profile_index}']['expressions'] \
-                = parse_profile(profile)
-
-    return enclave_dict
-
-
-def parse_profile(profile) -> dict:
-    profile_dict = {}
-    for expression_index, expression in enumerate(profile):
-        profile_dict[f'Expression_{expression_index}'] = copy.deepcopy(expression.attrib)
-        profile_dict[f'Expression_{expression_index}']['type'] = expression.tag
-        profile_dict[f'Expression_{expression_index}']['expression_elements'] \
-            = parse_expression(expression)
-    return profile_dict
-
-
-def parse_expression(expression) -> dict:
-    expression_dict = {}
-    for expression_element_index, expression_element in enumerate(expression):
-        expression_dict[f'Element_{expression_element_index}'] = {'type': expression_element.tag,
-                                                                  'name': expression_element.text}
-    return expression_dict
-
-
-def add_policy_to_graph(policy: dict, graph: ROSGraph.ROSGraph) -> None:
-    for enclave_key, enclave in policy.items():
-        enclave_name = enclave['path']
-        for key, item in enclave.items():
-            if key == 'profiles':
-                for profiles_key, profiles in item.items():
-                    for profile_key, profile in profiles.items():
-                        if profile_key.startswith('Profile'):
-                            add_profile_to_graph(profile, graph, enclave_name)
-
-
-def add_profile_to_graph(profile: dict, graph: ROSGraph.ROSGraph, enclave_name: str) -> None:
-    node_name = profile['node']
-    namespace = profile['ns']
-    for key, item in profile.items():
-        if key == 'expressions':
-            for expression_key, expression in profile[key].items():
-                for attribute_key, attribute_value in expression.items():
-                    if attribute_key in ['publish', 'subscribe', 'reply', 'request', 'execute', 'call']:
-                        for element_key, element in expression['expression_elements'].items():
-                            allowed = None
-                            if attribute_value == 'ALLOW':
-                                allowed = True
-                            elif attribute_value == 'DENY':
-                                allowed = False
-                            else:
-                                print(f'Attribute value {attribute_value} not recognised.')
-                            graph.add_connection(namespace, enclave_name, node_name, element['name'],
-                                                 element['type'], attribute_key, allowed)
+        selection = tree.xpath('//*[@id=$id or @xml:id=$id]', id=xpointer)
+    return [element for element in selection if isinstance(element, ET._Element)]
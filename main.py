@@ -1,17 +1,23 @@
 import os
 import json
-import networkx as nx
+import BatchAnalysis
+import Categorization
+import Diagnostics
+import GraphExport
+import Instrumentation
+import Layout
+import PartitionedAnalysis
+import Watch
 import XMLParser
 import sys
 import getopt
+import time
 import ROSGraph
 
 
 # This is the main function that is called when the program is run. It handles command line arguments and calls the
 # necessary functions to build the graph and display it.
 def main(argv) -> None:
-    print(f'Starting directory: {os.getcwd()}')
-    print(f'Output directory: {os.path.join(os.getcwd(), "output")}')
     show_ros_view = False
     show_privacy_view = False
     use_existing_graph = False
@@ -21,6 +27,20 @@ def main(argv) -> None:
     save_path = os.path.join(os.getcwd(), "output")
     include_standard_elements = False
     categorization_path = os.path.join(os.getcwd(), "categorizations/categorization.json")
+    exhaustive_paths = False
+    workers = 1
+    save_format = 'adjlist'
+    standard_elements = ROSGraph.STANDARD_ELEMENTS
+    batch_paths = None
+    paths_per_pair = 1
+    quiet = False
+    json_output = False
+    profile = False
+    profile_path = None
+    layout = 'kamada_kawai'
+    partitioned = False
+    watch = False
+    watch_interval = 1.0
 
     # Handles command line arguments
     # '-h' or '--help' prints the proper format
@@ -28,14 +48,41 @@ def main(argv) -> None:
     # '-p' or '--privacy_view' displays the privacy graph
     # '-s' or '--save' saves the graphs to the output directory
     # '--save_path' specifies the output directory
+    # '--save_format' specifies the format the graphs are saved in (npz, graphml, ndjson, adjlist), adjlist writes the
+    # multiline adjacency lists ros_graph and privacy_graph without attributes
     # '-c' or '--categorization_path' specifies the path to the categorization file
+    # (its lists take exact names and prefix:, glob: and re: rules, see Categorization.CategorizationMatcher)
     # '-d' or '--default_connections' includes the standard connections in the graph (e.g. /list_parameters)
-    proper_format = "main.py -h -r -p -s -c -d\nalternative long options:\n--help\n--ros_view\n--privacy_view\n" \
-                    "--save\n--save_path\n--categorization_path\n--default_connections\n"
+    # '-l' or '--lifecycle_connections' counts the services of lifecycle nodes as standard connections
+    # '-e' or '--exhaustive_paths' reports all edge-disjoint vulnerable paths instead of one per source and leak
+    # '-j' or '--workers' specifies the number of processes parsing policy files (0 uses all CPU cores)
+    # '-g' or '--graph_cache' loads the graph from a compiled graph file if the policy files did not change
+    # '--graph_cache_path' specifies the path of the compiled graph file
+    # '-k' or '--paths_per_pair' specifies the number of shortest vulnerable paths reported per source and leak
+    # '-b' or '--batch' evaluates a directory or comma separated list of categorization files against the graph
+    # '-q' or '--quiet' only prints the summary of the run at the end
+    # '--json' only prints the summary of the run at the end as JSON
+    # '--profile' times the phases of the run, counts graph operations and profiles each phase with cProfile
+    # '--profile_path' specifies the directory the cProfile profiles of the phases are saved to
+    # '--layout' specifies the layout of the ROS and privacy views (see Layout.LAYOUTS), multilevel and enclave scale to
+    # big graphs
+    # '--partitioned' analyzes the privacy graph enclave by enclave with the number of processes of '--workers'
+    # '--watch' keeps checking the policy files and re-checks the privacy verdict after every change until interrupted
+    # '--watch_interval' specifies the seconds between two checks of the policy files
+    proper_format = "main.py -h -r -p -s -c -d -l -e -k -j -g -b -q\nalternative long options:\n--help\n--ros_view\n" \
+                    "--privacy_view\n--save\n--save_path\n--categorization_path\n--default_connections\n" \
+                    "--lifecycle_connections\n" \
+                    "--exhaustive_paths\n--paths_per_pair\n--workers\n--graph_cache\n--graph_cache_path\n" \
+                    "--save_format\n--batch\n--quiet\n--json\n--profile\n--profile_path\n--layout\n--partitioned\n" \
+                    "--watch\n--watch_interval\n"
     try:
-        opts, _ = getopt.getopt(argv, "hrpsdc:", ["help", "ros_view", "privacy_view", "save",
-                                                  "save_path=", "default_connections", "categorization_path="])
-        print(f'Options chosen: {opts}')
+        opts, _ = getopt.getopt(argv, "hrpsdlec:k:j:gb:q", ["help", "ros_view", "privacy_view", "save", "save_path=",
+                                                            "default_connections", "lifecycle_connections",
+                                                            "categorization_path=", "exhaustive_paths",
+                                                            "paths_per_pair=", "workers=", "graph_cache",
+                                                            "graph_cache_path=", "save_format=", "batch=", "quiet",
+                                                            "json", "profile", "profile_path=", "layout=",
+                                                            "partitioned", "watch", "watch_interval="])
     except getopt.GetoptError:
         print('Error')
         print(proper_format)
@@ -52,19 +99,92 @@ def main(argv) -> None:
             save = True
         elif opt == "--save_path":
             save_path = arg
+        elif opt == "--save_format":
+            if arg not in GraphExport.EXPORT_FORMATS:
+                print(f'Save format {arg} not recognised, choose from {GraphExport.EXPORT_FORMATS}')
+                sys.exit(2)
+            save_format = arg
         elif opt in ("-c", "--categorization_path"):
             categorization_path = arg
         elif opt in ("-d", "--default_connections"):
             include_standard_elements = True
+        elif opt in ("-l", "--lifecycle_connections"):
+            standard_elements = ROSGraph.STANDARD_ELEMENTS + ROSGraph.LIFECYCLE_ELEMENTS
+        elif opt in ("-e", "--exhaustive_paths"):
+            exhaustive_paths = True
+        elif opt in ("-k", "--paths_per_pair"):
+            if not arg.isdecimal() or int(arg) < 1:
+                print(f'Number of paths per pair {arg} is not an integer of at least 1')
+                print(proper_format)
+                sys.exit(2)
+            paths_per_pair = int(arg)
+        elif opt in ("-j", "--workers"):
+            if not arg.isdecimal():
+                print(f'Number of workers {arg} is not a non-negative integer')
+                print(proper_format)
+                sys.exit(2)
+            workers = int(arg)
+        elif opt in ("-g", "--graph_cache"):
+            use_existing_graph = True
+        elif opt == "--graph_cache_path":
+            use_existing_graph = True
+            existing_graph_path = arg
+        elif opt in ("-b", "--batch"):
+            batch_paths = arg
+        elif opt in ("-q", "--quiet"):
+            quiet = True
+        elif opt == "--json":
+            json_output = True
+        elif opt == "--profile":
+            profile = True
+        elif opt == "--profile_path":
+            profile = True
+            profile_path = arg
+        elif opt == "--layout":
+            if arg not in Layout.LAYOUTS:
+                print(f'Layout {arg} not recognised, choose from {Layout.LAYOUTS}')
+                sys.exit(2)
+            layout = arg
+        elif opt == "--partitioned":
+            partitioned = True
+        elif opt == "--watch":
+            watch = True
+        elif opt == "--watch_interval":
+            watch = True
+            try:
+                watch_interval = float(arg)
+            except ValueError:
+                watch_interval = None
+            if watch_interval is None or not 0 <= watch_interval < float('inf'):
+                print(f'Watch interval {arg} is not a non-negative number of seconds')
+                print(proper_format)
+                sys.exit(2)
+    if quiet or json_output:
+        Diagnostics.diagnostics.echo_level = None
+    if profile:
+        Instrumentation.instrumentation.enable(profile_phases=True)
+    Diagnostics.info(f'Starting directory: {os.getcwd()}')
+    Diagnostics.info(f'Output directory: {save_path}')
+    Diagnostics.info(f'Options chosen: {opts}')
 
-    if use_existing_graph:
-        graph = ROSGraph.ROSGraph(graph_path=existing_graph_path, include_standard_elements=include_standard_elements)
+    watcher = None
+    if watch:
+        # The watcher records the contribution of every policy file, so it reads the policy files itself
+        graph = ROSGraph.ROSGraph(include_standard_elements=include_standard_elements,
+                                  standard_elements=standard_elements)
+        watcher = Watch.KeystoreWatcher(graph, policy_path)
+        watcher.update()
     else:
-        graph = XMLParser.build_graph_from_directory(path=policy_path,
-                                                     include_standard_elements=include_standard_elements)
-    with open(categorization_path, 'r') as infile:
-        print(f'Loading categorization from {categorization_path}')
-        categorization_dict = json.load(infile)
+        graph = XMLParser.build_graph_from_directory(
+            existing_graph_path=existing_graph_path if use_existing_graph else None, path=policy_path,
+            include_standard_elements=include_standard_elements, workers=workers, standard_elements=standard_elements)
+    Diagnostics.info(f'XInclude fragment cache: {XMLParser.fragment_cache.statistics()}')
+    if batch_paths is not None:
+        run_batch(graph, batch_paths, workers, save_path if save else None, json_output)
+        report_instrumentation(profile_path, json_output)
+        return
+    Diagnostics.info(f'Loading categorization from {categorization_path}')
+    categorization_dict = Categorization.read_categorization(categorization_path)
     graph.apply_categorization(source_nodes=categorization_dict['source'],
                                leak_nodes=categorization_dict['leak'],
                                conduit_nodes=categorization_dict['conduit'],
@@ -72,23 +192,133 @@ def main(argv) -> None:
                                sensitive_transmitters=categorization_dict['sensitive'],
                                mundane_transmitters=categorization_dict['mundane'])
     if show_ros_view:
-        graph.show_ros_view(layout='kamada_kawai')  # layout='planar'
-    if graph.is_privacy_vulnerable():
-        print("Privacy Vulnerable")
-    else:
-        print("Privacy Safe")
+        with Instrumentation.phase('ros_view'):
+            graph.show_ros_view(layout=layout)
+    partitioned_analysis = None
+    if partitioned:
+        if exhaustive_paths or paths_per_pair != 1:
+            Diagnostics.warning('The partitioned analysis reports one vulnerable path per source and leak')
+        partitioned_analysis = PartitionedAnalysis.PartitionedAnalysis(workers)
+    analyze(graph, partitioned_analysis, exhaustive_paths, paths_per_pair)
     if show_privacy_view:
-        graph.show_privacy_view(layout='kamada_kawai')
+        with Instrumentation.phase('privacy_view'):
+            graph.show_privacy_view(layout=layout)
     if save:
-        save_graph(graph, save_path)
+        with Instrumentation.phase('save'):
+            save_graph(graph, save_path, save_format)
+            save_privacy_report(graph, save_path)
+    print_summary(graph, json_output)
+    if watcher is not None:
+        watcher.set_categorization(categorization_dict)
+        run_watch(graph, watcher, watch_interval, partitioned_analysis, exhaustive_paths, paths_per_pair,
+                  json_output)
+    report_instrumentation(profile_path, json_output)
+
+
+# Determines whether the graph is privacy vulnerable, with the partitioned analysis if one is given
+# @param partitioned_analysis: A PartitionedAnalysis, which reuses the summaries of unchanged enclaves across calls
+def analyze(graph: ROSGraph.ROSGraph, partitioned_analysis=None, exhaustive_paths=False, paths_per_pair=1) -> None:
+    if partitioned_analysis is not None:
+        graph.set_privacy_report(partitioned_analysis.analyze(graph))
+    else:
+        graph.is_privacy_vulnerable(exhaustive=exhaustive_paths, paths_per_pair=paths_per_pair)
 
 
-# Saves the ROS and privacy graphs to the given path as adjacency lists
-def save_graph(graph: ROSGraph.ROSGraph, path: str) -> None:
-    ros_graph = graph.get_ros_graph()
-    nx.write_multiline_adjlist(ros_graph, os.path.join(path, "ros_graph"))
+# Polls the policy files and re-checks the privacy verdict after every change until interrupted with Ctrl+C
+# Only the contributions of the changed policy files are updated in the graph (see Watch.KeystoreWatcher). The
+# diagnostics of each check replace those of the previous one.
+# @param interval: The seconds between two checks of the policy files
+def run_watch(graph: ROSGraph.ROSGraph, watcher: Watch.KeystoreWatcher, interval=1.0, partitioned_analysis=None,
+              exhaustive_paths=False, paths_per_pair=1, json_output=False) -> None:
+    Diagnostics.info(f'Watching {watcher.path} for changes, press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(interval)
+            Diagnostics.diagnostics.clear()
+            start = time.perf_counter()
+            updated = watcher.update()
+            if not updated:
+                continue
+            for policy in updated:
+                Diagnostics.info(f'Updated the contribution of {policy}', path=policy)
+            analyze(graph, partitioned_analysis, exhaustive_paths, paths_per_pair)
+            Diagnostics.info(f'Re-checked the privacy verdict in {time.perf_counter() - start:.3f}s')
+            print_summary(graph, json_output)
+    except KeyboardInterrupt:
+        Diagnostics.info('Stopped watching')
+
+
+# Prints the summary of an analysis run, either as one line or as a JSON document
+# The JSON document contains the verdict, the privacy report, the sizes of the graphs, the fragment cache statistics,
+# all warnings and errors of the run and the phase timers and counters if the run is profiled.
+def print_summary(graph: ROSGraph.ROSGraph, json_output=False) -> None:
+    report = graph.get_privacy_report()
+    verdict = 'Privacy Vulnerable' if report.is_vulnerable() else 'Privacy Safe'
+    if not json_output:
+        print(f'{verdict}: {report.summary()} ({Diagnostics.diagnostics.counts()["warning"]} warning(s))')
+        return
     privacy_graph = graph.get_privacy_graph()
-    nx.write_multiline_adjlist(privacy_graph, os.path.join(path, "privacy_graph"))
+    summary = {'verdict': verdict, 'vulnerable': report.is_vulnerable(), 'report': report.to_dict(),
+               'graph': {'ros_nodes': graph.get_ros_graph().number_of_nodes(),
+                         'ros_edges': graph.get_ros_graph().number_of_edges(),
+                         'privacy_nodes': privacy_graph.number_of_nodes(),
+                         'privacy_edges': privacy_graph.number_of_edges()},
+               'fragment_cache': XMLParser.fragment_cache.statistics(),
+               'diagnostics': {'counts': Diagnostics.diagnostics.counts(),
+                               'records': Diagnostics.diagnostics.to_list(Diagnostics.WARNING)}}
+    if Instrumentation.instrumentation.enabled:
+        summary['instrumentation'] = Instrumentation.instrumentation.report()
+    print(json.dumps(summary, indent=4))
+
+
+# Prints the phase timers, counters and profiles of a profiled run and saves the profiles as .prof files
+# The timers and counters of a JSON summary are part of the summary, so only the profiles are saved then.
+# @param profile_path: The directory the profiles are saved to, None does not save them
+def report_instrumentation(profile_path=None, json_output=False) -> None:
+    if not Instrumentation.instrumentation.enabled:
+        return
+    if profile_path is not None:
+        for written_file in Instrumentation.instrumentation.save_profiles(profile_path):
+            Diagnostics.info(f'Saved profile to {written_file}')
+    if not json_output:
+        print(Instrumentation.instrumentation.format_report())
+
+
+# Evaluates the categorization files of a batch against the graph and prints the results as a table or JSON document
+# @param batch_paths: A directory or comma separated list of categorization files
+# @param save_path: The output directory the results are saved to as JSON, None does not save them
+def run_batch(graph: ROSGraph.ROSGraph, batch_paths: str, workers=1, save_path=None, json_output=False) -> None:
+    with Instrumentation.phase('batch'):
+        results = BatchAnalysis.evaluate_categorizations(graph, BatchAnalysis.list_categorizations(batch_paths),
+                                                         workers)
+    if save_path is not None:
+        os.makedirs(save_path, exist_ok=True)
+        with open(os.path.join(save_path, 'batch_results.json'), 'w') as outfile:
+            json.dump(results, outfile, indent=4)
+        Diagnostics.info(f'Saved batch results to {os.path.join(save_path, "batch_results.json")}')
+    if json_output:
+        summary = {'batch': results,
+                   'diagnostics': {'counts': Diagnostics.diagnostics.counts(),
+                                   'records': Diagnostics.diagnostics.to_list(Diagnostics.WARNING)}}
+        if Instrumentation.instrumentation.enabled:
+            summary['instrumentation'] = Instrumentation.instrumentation.report()
+        print(json.dumps(summary, indent=4))
+    else:
+        print(BatchAnalysis.format_results(results))
+
+
+# Saves the ROS and privacy graphs to the given path in the given format (see GraphExport.EXPORT_FORMATS)
+def save_graph(graph: ROSGraph.ROSGraph, path: str, save_format='adjlist') -> None:
+    for written_file in GraphExport.save_graphs(graph, path, save_format):
+        Diagnostics.info(f'Saved graphs to {written_file}')
+
+
+# Saves the PrivacyReport of the last analysis of the graph to the given path as JSON
+def save_privacy_report(graph: ROSGraph.ROSGraph, path: str) -> None:
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'privacy_report.json'), 'w') as outfile:
+        json.dump(graph.get_privacy_report().to_dict(), outfile, indent=4)
+    Diagnostics.info(f'Saved privacy report to {os.path.join(path, "privacy_report.json")}')
 
 
 if __name__ == '__main__':